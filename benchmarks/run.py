@@ -0,0 +1,141 @@
+"""
+Runs the benchmark scenarios and compares them against stored baselines.
+
+    python -m benchmarks.run                 # measure and print
+    python -m benchmarks.run --save          # store results as the new baseline
+    python -m benchmarks.run --check         # exit 1 when throughput regressed
+                                             # or startup went over budget
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+import typing as t
+
+from .scenarios import Scenario, all_scenarios
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__),"baselines.json")
+
+
+def measure(scenario:Scenario, repeat:int=5) -> t.Dict[str,float]:
+    """Times repeat runs of scenario on fresh engines, best run wins.
+    """
+    times = []
+    for _ in range(repeat):
+        engine, _ = scenario.build()
+        engine.compile()
+        start = time.perf_counter()
+        engine.run()
+        times.append(time.perf_counter() - start)
+    best = min(times)
+
+    engine, _ = scenario.build()
+    engine.compile()
+    tracemalloc.start()
+    try:
+        engine.run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "runs_per_sec": 1 / best,
+        "iteration_us": best / scenario.iterations * 1_000_000,
+        "peak_mb": peak / 1_048_576,
+    }
+
+
+def measure_startup(repeat:int=5) -> t.Dict[str,float]:
+    """Times import context_engine in fresh interpreters and init_engine() calls.
+    """
+    code = ("import time; start = time.perf_counter(); import context_engine; "
+            "print(time.perf_counter() - start)")
+    imports = [float(subprocess.run([sys.executable,"-c",code],check=True,capture_output=True,
+                                    text=True).stdout) for _ in range(repeat)]
+
+    from context_engine import init_engine
+    timer = timeit.Timer(init_engine)
+    number, _ = timer.autorange()
+    init = min(timer.repeat(repeat,number)) / number
+    return {
+        "import_ms": min(imports) * 1000,
+        "init_engine_us": init * 1_000_000,
+    }
+
+
+def check(results:t.Dict[str,t.Dict[str,float]], baselines:t.Dict[str,t.Dict[str,float]],
+          threshold:float) -> t.List[str]:
+    """Names scenarios whose runs/sec fell more than threshold below baseline.
+    """
+    failures = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            continue
+        floor = baseline["runs_per_sec"] * (1 - threshold)
+        if result["runs_per_sec"] < floor:
+            failures.append(f"{name}: {result['runs_per_sec']:.3f} runs/s below "
+                            f"{floor:.3f} ({baseline['runs_per_sec']:.3f} baseline - {threshold:.0%})")
+    return failures
+
+
+def main(argv:t.Optional[t.List[str]]=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run",description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline",default=DEFAULT_BASELINE,help="baseline json file")
+    parser.add_argument("--save",action="store_true",help="store results as baseline")
+    parser.add_argument("--check",action="store_true",help="fail when throughput regressed")
+    parser.add_argument("--threshold",type=float,default=0.2,help="allowed runs/sec drop, default 0.2")
+    parser.add_argument("--repeat",type=int,default=5,help="runs per scenario, best is kept")
+    parser.add_argument("--scale",type=float,default=1.0,help="multiplies loop sizes")
+    parser.add_argument("-k",dest="only",default=None,help="only scenarios containing this text")
+    parser.add_argument("--import-budget-ms",type=float,default=100.0,
+                        help="max import context_engine time, default 100ms")
+    parser.add_argument("--init-budget-us",type=float,default=100.0,
+                        help="max init_engine() time, default 100us")
+    args = parser.parse_args(argv)
+
+    startup = measure_startup(args.repeat)
+    print(f"import context_engine {startup['import_ms']:.2f} ms, init_engine() {startup['init_engine_us']:.2f} us")
+
+    results = {}
+    print(f"{'scenario':<28} {'runs/s':>10} {'iteration us':>14} {'peak MB':>10}")
+    for scenario in all_scenarios(args.scale):
+        if args.only and args.only not in scenario.name:
+            continue
+        result = results[scenario.name] = measure(scenario,args.repeat)
+        print(f"{scenario.name:<28} {result['runs_per_sec']:>10.3f} "
+              f"{result['iteration_us']:>14.3f} {result['peak_mb']:>10.2f}")
+
+    if args.save:
+        baselines = load_baselines(args.baseline)
+        baselines.update(results)
+        with open(args.baseline,"w") as out:
+            json.dump(baselines,out,indent=4,sort_keys=True)
+        print(f"saved baseline to {args.baseline}")
+
+    if args.check:
+        failures = check(results,load_baselines(args.baseline),args.threshold)
+        if startup["import_ms"] > args.import_budget_ms:
+            failures.append(f"import took {startup['import_ms']:.2f} ms, budget {args.import_budget_ms} ms")
+        if startup["init_engine_us"] > args.init_budget_us:
+            failures.append(f"init_engine took {startup['init_engine_us']:.2f} us, budget {args.init_budget_us} us")
+        for failure in failures:
+            print(f"REGRESSION {failure}",file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+def load_baselines(path:str) -> t.Dict[str,t.Dict[str,float]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as source:
+        return json.load(source)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
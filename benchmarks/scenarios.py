@@ -0,0 +1,102 @@
+"""
+Synthetic process documents built with the test builders.
+"""
+import typing as t
+
+from context_engine import init_engine
+from tests.base_testing import (get_process_skeleton, get_step, get_expression, get_for_each,
+                                get_while, get_if, get_block)
+
+
+class Scenario():
+    """Named process document with a factory for fresh engines.
+
+       iterations is the number of loop iterations (or steps) one run performs
+       and is used to work out per iteration latency.
+    """
+    def __init__(self, name:str, iterations:int, build:t.Callable[[],t.Tuple]) -> None:
+        self.name = name
+        self.iterations = iterations
+        self.build = build
+
+
+def foreach_loop(size:int=100_000) -> Scenario:
+    steps = get_expression(["outlist.append(locals.i)"]) + get_step("noop",args="i")
+
+    def build():
+        engine, context = init_engine(get_process_skeleton([get_for_each("items","i",steps)]))
+        register_noop(engine)
+        context.items = list(range(size))
+        context.outlist = []
+        return engine, context
+    return Scenario("for each loop",size,build)
+
+
+def while_loop(size:int=100_000) -> Scenario:
+    steps = get_expression(["set('count',count + 1)"])
+
+    def build():
+        engine, context = init_engine(get_process_skeleton(
+            [get_while([f"count < {size}"],steps,"loop")]))
+        context.count = 0
+        return engine, context
+    return Scenario("while loop",size,build)
+
+
+def deep_nesting(depth:int=50, size:int=2_000) -> Scenario:
+    inner = get_for_each("items","i",get_expression(["set('total',total + locals.i)"]))
+    for level in range(depth):
+        inner = get_block([get_if([f"{level} >= 0"],[inner])])
+
+    def build():
+        engine, context = init_engine(get_process_skeleton(
+            [get_for_each("outer","o",[inner])]))
+        context.outer = list(range(10))
+        context.items = list(range(size // 10))
+        context.total = 0
+        return engine, context
+    return Scenario(f"deep nesting {depth}",size,build)
+
+
+def expression_heavy(size:int=20_000, expressions:int=10) -> Scenario:
+    steps = get_expression([f"set('v{x}',locals.i * {x} + len(str(locals.i)) % 7)" for x in range(expressions)])
+
+    def build():
+        engine, context = init_engine(get_process_skeleton([get_for_each("items","i",steps)]))
+        context.items = list(range(size))
+        return engine, context
+    return Scenario(f"{expressions} expressions per step",size * expressions,build)
+
+
+def many_components(components:int=500, rounds:int=100) -> Scenario:
+    steps = []
+    for x in range(components):
+        steps += get_step(f"component_{x}",args=x)
+
+    def build():
+        engine, context = init_engine(get_process_skeleton(
+            [get_for_each("rounds","r",steps)]))
+        for x in range(components):
+            register_noop(engine,f"component_{x}")
+        context.rounds = list(range(rounds))
+        return engine, context
+    return Scenario(f"{components} components",components * rounds,build)
+
+
+def register_noop(engine, name:str="noop"):
+    @engine.component(name=name)
+    def noop(engine,context):
+        context.args
+
+
+def all_scenarios(scale:float=1.0) -> t.List[Scenario]:
+    """Every scenario, scale shrinks or grows loop sizes.
+    """
+    size = lambda n: max(1,int(n * scale))
+    return [
+        foreach_loop(size(100_000)),
+        while_loop(size(100_000)),
+        deep_nesting(50,size(2_000)),
+        expression_heavy(size(20_000)),
+        many_components(500,size(100)),
+    ]
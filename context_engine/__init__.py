@@ -1 +1,3 @@
 from .engine import Context, Engine, init_engine, Frame
+from .plan import CompileError, Plan
+from .loader import ProcessValidationError, load_process, validate_process
@@ -0,0 +1,312 @@
+import ast
+import builtins
+from functools import lru_cache
+import typing as t
+
+from . import engine as engine_module
+from .decorators import Command
+from .paths import PathError, compile_path
+from .plan import STEP_BLOCKS, Plan, PlanNode
+
+# flows whose context access is fully described by their members and nested steps
+BUILTIN_FLOWS = frozenset(("block","do while","for each","if","map","parallel for each",
+                           "try","while"))
+
+# flow step members step_effects accounts for, flows using any other member
+# have unknown effects
+ANALYZED_FLOW_MEMBERS = frozenset(("flow","expressions","conditions","expression","collection",
+                                   "result","results","field") + STEP_BLOCKS)
+# members that configure how a flow runs without touching the context
+SETTING_FLOW_MEMBERS = frozenset(("var","batch_size","chunk_size","distributed","max_workers",
+                                  "ordered","parallel","fail_on_error","incremental"))
+
+# built-in expressions writing the context key named by their first argument
+WRITING_EXPRESSIONS = frozenset(("set","new_dict","new_list","new_spill_list"))
+
+# built-in expressions that don't touch the context
+PURE_EXPRESSIONS = frozenset(("open_csv","open_jsonl"))
+
+# calls that can reach any name, expressions using them have unknown effects
+DYNAMIC_CALLS = frozenset(("eval","exec","globals","vars","getattr","setattr",
+                           "delattr","__import__","compile"))
+
+# builtins that neither change their arguments nor reach other names, calls to
+# any other builtin have unknown effects (next advances its iterator)
+PURE_BUILTINS = frozenset(("abs","all","any","ascii","bin","bool","bytes","callable","chr",
+                           "complex","dict","divmod","enumerate","filter","float","format",
+                           "frozenset","hasattr","hash","hex","id","int","isinstance",
+                           "issubclass","len","list","map","max","min","oct","ord","pow",
+                           "range","repr","reversed","round","set","slice","sorted","str",
+                           "sum","tuple","type","zip"))
+
+# receivers whose methods never change the arguments they are passed, and
+# their method names for receivers the context doesn't hold a value for yet
+_CONTAINER_TYPES = (list,dict,set,frozenset,tuple,str,bytes,int,float)
+_CONTAINER_METHODS = frozenset(name for kind in _CONTAINER_TYPES for name in dir(kind)
+                               if not name.startswith("_"))
+
+_BUILTIN_NAMES = frozenset(vars(builtins))
+# modules and classes expressions can reach besides the context
+_GLOBAL_NAMES = frozenset(vars(engine_module)) - _BUILTIN_NAMES
+
+
+class Effects():
+    """Context keys a step reads and writes, keys are first path segments.
+    """
+    __slots__ = ("reads","writes")
+
+    def __init__(self, reads:t.Iterable[str]=(), writes:t.Iterable[str]=()) -> None:
+        self.reads:t.FrozenSet[str] = frozenset(reads)
+        self.writes:t.FrozenSet[str] = frozenset(writes)
+
+    def __or__(self, other:"Effects") -> "Effects":
+        return Effects(self.reads | other.reads,self.writes | other.writes)
+
+    def without(self, keys:t.Iterable[str]) -> "Effects":
+        keys = frozenset(keys)
+        return Effects(self.reads - keys,self.writes - keys)
+
+    def conflicts(self, other:"Effects") -> bool:
+        """True when running the two steps in either order may give different results.
+        """
+        return bool(self.writes & (other.reads | other.writes) or self.reads & other.writes)
+
+    def __repr__(self) -> str:
+        return f"<Effects reads={sorted(self.reads)} writes={sorted(self.writes)}>"
+
+
+class _Source():
+    """What an expression does independent of the context it runs on.
+    """
+    __slots__ = ("names","mutated","calls","method_calls","dynamic")
+
+    def __init__(self) -> None:
+        self.names:t.Set[str] = set()
+        self.mutated:t.Set[str] = set()
+        # (called name, constant first argument or None, names passed as arguments)
+        self.calls:t.List[t.Tuple[str,t.Optional[str],t.Tuple[str,...]]] = []
+        # (receiver base name, receiver is that name itself, method, names passed as arguments)
+        self.method_calls:t.List[t.Tuple[str,bool,str,t.Tuple[str,...]]] = []
+        self.dynamic:bool = False
+
+
+def root_key(path:t.Any) -> t.Optional[str]:
+    """First segment of a context path, None when it isn't a valid path.
+    """
+    if type(path) is not str:
+        return None
+    try:
+        key = compile_path(path).keys[0]
+    except PathError:
+        return None
+    return key if type(key) is str else None
+
+
+@lru_cache(maxsize=4096)
+def analyze_source(source:str) -> _Source:
+    """Parses an expression once and collects the names it uses, the names it
+       may mutate (method call receivers and := targets) and the names and
+       methods it calls with the names passed to them.
+    """
+    result = _Source()
+    tree = ast.parse(source,mode="eval")
+    bound:t.Set[str] = set()
+    for node in ast.walk(tree):
+        if isinstance(node,ast.Name):
+            if isinstance(node.ctx,ast.Load):
+                result.names.add(node.id)
+            else:
+                # comprehension targets live in their own scope
+                bound.add(node.id)
+        elif isinstance(node,ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node,ast.NamedExpr):
+            result.mutated.add(node.target.id)
+        elif isinstance(node,ast.Call):
+            func = node.func
+            arguments = [_base_name(argument) for argument in
+                         list(node.args) + [keyword.value for keyword in node.keywords]]
+            arguments = tuple(name for name in arguments if name)
+            if isinstance(func,ast.Name):
+                first = node.args[0] if node.args else None
+                constant = first.value if isinstance(first,ast.Constant) and type(first.value) is str else None
+                result.calls.append((func.id,constant,arguments))
+                if func.id in DYNAMIC_CALLS:
+                    result.dynamic = True
+            elif isinstance(func,ast.Attribute):
+                base = _base_name(func.value)
+                if base is not None:
+                    result.mutated.add(base)
+                    result.method_calls.append((base,isinstance(func.value,ast.Name),func.attr,arguments))
+    result.names -= bound
+    result.mutated -= bound
+    result.calls = [(name,constant,tuple(argument for argument in arguments if argument not in bound))
+                    for name, constant, arguments in result.calls]
+    result.method_calls = [(base,direct,method,tuple(argument for argument in arguments if argument not in bound))
+                           for base, direct, method, arguments in result.method_calls if base not in bound]
+    return result
+
+
+def _base_name(node:ast.AST) -> t.Optional[str]:
+    while isinstance(node,(ast.Attribute,ast.Subscript)):
+        node = node.value
+    return node.id if isinstance(node,ast.Name) else None
+
+
+def expression_effects(source:str, context:t.Mapping) -> t.Optional[Effects]:
+    """Effects of one expression on context, None when they can't be known.
+    """
+    try:
+        analyzed = analyze_source(source)
+    except SyntaxError:
+        return None
+    if analyzed.dynamic:
+        return None
+
+    reads = set()
+    writes = set()
+    for name in analyzed.names:
+        value = context.get(name) if name in context else None
+        if isinstance(value,Command):
+            continue
+        if name in context or name == "locals" or name not in _BUILTIN_NAMES:
+            reads.add(name)
+    for name in analyzed.mutated:
+        if name in context:
+            if not isinstance(context.get(name),Command):
+                writes.add(name)
+        elif name == "locals" or (name not in _BUILTIN_NAMES and name not in _GLOBAL_NAMES):
+            writes.add(name)
+
+    for name, constant, arguments in analyzed.calls:
+        command = context.get(name) if name in context else None
+        if not isinstance(command,Command):
+            # callables placed on the context might change their arguments
+            if name in context or name not in _BUILTIN_NAMES:
+                writes.update(arguments)
+            elif name not in PURE_BUILTINS:
+                return None
+            continue
+        if name in PURE_EXPRESSIONS:
+            continue
+        if name in WRITING_EXPRESSIONS:
+            key = root_key(constant)
+            if key is None:
+                return None
+            writes.add(key)
+        elif command.reads is not None and command.writes is not None:
+            reads.update(command.reads)
+            writes.update(command.writes)
+        else:
+            return None
+
+    for base, direct, method, arguments in analyzed.method_calls:
+        if base in context or base == "locals" or (base not in _BUILTIN_NAMES and
+                                                   base not in _GLOBAL_NAMES):
+            # methods of a plain list, dict, set or string don't change their
+            # arguments, any other method might
+            if direct and base in context:
+                plain = type(context.get(base)) in _CONTAINER_TYPES
+            else:
+                plain = method in _CONTAINER_METHODS
+            if not plain:
+                writes.update(arguments)
+        elif base in _BUILTIN_NAMES and isinstance(getattr(builtins,base),type):
+            # unbound methods such as list.append(out,...) change their arguments
+            writes.update(arguments)
+        else:
+            # modules and other globals (os.remove) are unknown
+            return None
+    return Effects(reads,writes)
+
+
+def step_effects(node:PlanNode, context:t.Mapping) -> t.Optional[Effects]:
+    """Effects of a compiled step or flow step including nested steps, None when
+       any part of it has unknown effects.
+    """
+    source = node.source
+    effects = Effects()
+    for member in ("expressions","conditions"):
+        for expression in source.get(member) or ():
+            found = expression_effects(expression,context)
+            if found is None:
+                return None
+            effects = effects | found
+
+    if node.flow is not None:
+        if node.flow not in BUILTIN_FLOWS:
+            return None
+        if any(member not in ANALYZED_FLOW_MEMBERS and member not in SETTING_FLOW_MEMBERS
+               for member in source):
+            return None
+        if source.get("expression") is not None:
+            found = expression_effects(source["expression"],context)
+            if found is None:
+                return None
+            effects = effects | found
+        for member in ("result","results"):
+            if source.get(member) is not None:
+                key = root_key(source[member])
+                if key is None:
+                    return None
+                effects = effects | Effects((),(key,))
+        body = Effects()
+        for block in STEP_BLOCKS:
+            nested = node.fields.get(block)
+            if type(nested) is Plan:
+                for child in nested:
+                    found = step_effects(child,context)
+                    if found is None:
+                        return None
+                    body = body | found
+        effects = effects | body
+        collection = source.get("collection")
+        if collection is not None:
+            key = root_key(collection)
+            if key is None:
+                return None
+            # loop variables are views of the collection items, writing through
+            # locals (or map's field) may change the collection
+            writes = (key,) if "locals" in body.writes or source.get("field") is not None else ()
+            effects = effects | Effects((key,),writes)
+        # loop variables and caught errors go to the flow's locals
+        return effects | Effects((),("locals",))
+
+    component = node.component
+    if component is not None:
+        if component.reads is None or component.writes is None:
+            return None
+        effects = effects | Effects(component.reads,component.writes)
+        if node.result is not None:
+            key = node.result.keys[0]
+            if type(key) is not str:
+                return None
+            effects = effects | Effects((),(key,))
+    return effects
+
+
+def dependencies(nodes:t.Sequence[PlanNode], context:t.Mapping,
+                 private:t.Iterable[str]=("locals",)) -> t.List[t.FrozenSet[int]]:
+    """For each sibling step the indexes of earlier siblings it has to wait for.
+
+       Steps with unknown effects wait for every earlier step and every later
+       step waits for them, so they run on their own in document order. Keys in
+       private are per step (top-level steps each get their own locals) and
+       never make steps depend on each other.
+    """
+    effects = [step_effects(node,context) for node in nodes]
+    private = frozenset(private)
+    effects = [None if found is None else found.without(private) for found in effects]
+
+    graph = []
+    barrier = None
+    for index, found in enumerate(effects):
+        if found is None:
+            graph.append(frozenset(range(index)))
+            barrier = index
+            continue
+        start = 0 if barrier is None else barrier
+        waits = {earlier for earlier in range(start,index)
+                 if effects[earlier] is None or effects[earlier].conflicts(found)}
+        graph.append(frozenset(waits))
+    return graph
@@ -0,0 +1,93 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import os
+import typing as t
+
+from ctx import Ctx
+
+from .decorators import Command
+
+
+class RunResult():
+    """Outcome of one run of Engine.run_many.
+    """
+    __slots__ = ("context","error")
+
+    def __init__(self, context:t.Mapping, error:t.Optional[BaseException]=None) -> None:
+        self.context = context
+        self.error = error
+
+    def __get_ok(self) -> bool:
+        return self.error is None
+
+    ok:bool = property(__get_ok)
+
+    def __repr__(self) -> str:
+        return f"<RunResult ok={self.ok} error={self.error!r}>"
+
+
+def run_many(engine, inputs:t.Iterable[t.Mapping], workers:t.Optional[int]=None,
+             mode:str="thread") -> t.List[RunResult]:
+    """Runs engine's process once per input, see Engine.run_many.
+    """
+    if mode not in ("thread","process"):
+        raise ValueError(f"unknown run_many mode '{mode}'")
+    if mode == "process" and "fork" not in multiprocessing.get_all_start_methods():
+        raise ValueError("run_many mode 'process' needs the fork start method, "
+                         "it is not available on this platform")
+    if engine.plan is None:
+        engine.compile()
+
+    inputs = list(inputs)
+    if workers == 1 or len(inputs) < 2:
+        return [run_one(engine,seed) for seed in inputs]
+
+    if mode == "thread":
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda seed: run_one(engine,seed),inputs))
+
+    # forked workers inherit the initializer arguments without pickling them,
+    # so components need not be picklable
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1,len(inputs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context("fork"),
+                             initializer=_init_process,initargs=(engine,)) as pool:
+        results = list(pool.map(_run_in_process,inputs,chunksize=chunksize))
+    for result in results:
+        result.context = result.context.load()
+    return results
+
+
+def run_one(engine, seed:t.Mapping) -> RunResult:
+    """Runs engine's process on a spawned engine seeded with seed.
+    """
+    spawned, context = engine.spawn()
+    context.update(seed)
+    try:
+        spawned.run()
+    except Exception as x:
+        return RunResult(context,x)
+    return RunResult(context)
+
+
+def context_data(context:t.Mapping) -> Ctx:
+    """Copies context values leaving out attached expressions and frame bindings.
+    """
+    return Ctx({key:value for key,value in context.items()
+                if not isinstance(value,Command) and not key.startswith("_Context__")})
+
+
+# engine of the pool this worker process belongs to, set by _init_process
+_process_engine = None
+
+def _init_process(engine):
+    global _process_engine
+    _process_engine = engine
+
+
+def _run_in_process(seed:t.Mapping) -> RunResult:
+    from .snapshot import snapshot
+    result = run_one(_process_engine,seed)
+    # contexts travel back as snapshots, large binary values skip the pickle stream
+    result.context = snapshot(result.context)
+    return result
@@ -0,0 +1,187 @@
+from collections import OrderedDict
+from collections.abc import Mapping, Set
+import threading
+import time
+import typing as t
+
+
+class ExpressionCache():
+    """Bounded LRU cache of compiled expression code objects keyed by source.
+
+       Loop bodies and flow conditions evaluate the same source strings over and
+       over, compiling once and reusing the code object skips the parser on every
+       iteration. A single instance is shared by all engines.
+    """
+    def __init__(self, maxsize:int=4096) -> None:
+        self.maxsize:int = maxsize
+        self.hits:int = 0
+        self.misses:int = 0
+        self.evictions:int = 0
+        self.__codes:"OrderedDict[str,t.Any]" = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def compile(self, expression:str, mode:str="eval"):
+        """Returns compiled code object for expression compiling on first use.
+
+        Args:
+            expression (str): python expression source
+            mode (str): compile mode passed to builtin compile
+
+        Returns:
+            code : compiled code object
+        """
+        codes = self.__codes
+        key = (expression, mode)
+        code = codes.get(key)
+        if code is not None:
+            self.hits += 1
+            try:
+                codes.move_to_end(key)
+            except KeyError:
+                # evicted by another thread between get and move
+                pass
+            return code
+
+        # source doubles as filename so tracebacks and profiles show the expression
+        code = compile(expression, expression, mode)
+        with self.__lock:
+            self.misses += 1
+            codes[key] = code
+            while len(codes) > self.maxsize:
+                codes.popitem(last=False)
+                self.evictions += 1
+        return code
+
+    def clear(self):
+        """Drops all cached code objects and resets counters.
+        """
+        with self.__lock:
+            self.__codes.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.__codes)
+
+    def __get_stats(self) -> t.Dict[str,int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.__codes),
+            "maxsize": self.maxsize,
+        }
+
+    stats:t.Dict[str,int] = property(__get_stats)
+
+
+# shared by every context/engine in the process.
+expression_cache = ExpressionCache()
+
+# returned by ResultCache.get when there is no live entry
+MISS = object()
+
+
+class ResultCache():
+    """Bounded LRU cache of command results with optional time to live.
+
+       Memoized components and expressions keep one of these, entries are keyed
+       by their frozen arguments (see freeze) or a custom key function. Entries
+       older than ttl seconds are dropped when they are next looked up.
+    """
+    def __init__(self, maxsize:int=128, ttl:t.Optional[float]=None,
+                 key:t.Optional[t.Callable[...,t.Hashable]]=None,
+                 clock:t.Callable[[],float]=time.monotonic) -> None:
+        self.maxsize:int = maxsize
+        self.ttl:t.Optional[float] = ttl
+        self.key = key
+        self.clock = clock
+        self.hits:int = 0
+        self.misses:int = 0
+        self.evictions:int = 0
+        self.expirations:int = 0
+        self.uncacheable:int = 0
+        self.__entries:"OrderedDict[t.Hashable,t.Tuple[t.Optional[float],t.Any]]" = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key:t.Hashable) -> t.Any:
+        """Returns cached value for key or MISS.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires is None or expires > self.clock():
+                    self.hits += 1
+                    self.__entries.move_to_end(key)
+                    return value
+                del self.__entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return MISS
+
+    def put(self, key:t.Hashable, value:t.Any):
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        with self.__lock:
+            entries = self.__entries
+            entries[key] = (expires,value)
+            entries.move_to_end(key)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+                self.evictions += 1
+
+    def call(self, key:t.Any, f:t.Callable[...,t.Any], *args, **kwargs) -> t.Any:
+        """Returns the cached result for key calling f(*args,**kwargs) on a miss.
+           Keys that can't be hashed are counted as uncacheable and always call f.
+        """
+        try:
+            value = self.get(key)
+        except TypeError:
+            self.uncacheable += 1
+            return f(*args,**kwargs)
+        if value is MISS:
+            value = f(*args,**kwargs)
+            self.put(key,value)
+        return value
+
+    def clear(self):
+        """Drops all entries and resets counters.
+        """
+        with self.__lock:
+            self.__entries.clear()
+            self.hits = self.misses = self.evictions = self.expirations = self.uncacheable = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __get_stats(self) -> t.Dict[str,int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "uncacheable": self.uncacheable,
+            "size": len(self.__entries),
+            "maxsize": self.maxsize,
+        }
+
+    stats:t.Dict[str,int] = property(__get_stats)
+
+
+def freeze(value:t.Any) -> t.Hashable:
+    """Converts mappings, sequences and sets into hashable equivalents so
+       arguments can be used as cache keys. Other values are returned as is.
+       Scalars, sequences and sets are tagged with their type, 1, True and 1.0
+       or [1,2] and (1,2) compare equal but are different arguments.
+    """
+    if value is None:
+        return value
+    if isinstance(value,(str,bytes,int,float,bool)):
+        return (type(value),value)
+    if isinstance(value,Mapping):
+        # tagged so a mapping never equals a set of pairs
+        return (Mapping,frozenset((freeze(key),freeze(item)) for key, item in value.items()))
+    if isinstance(value,(list,tuple)):
+        return (type(value),tuple(freeze(item) for item in value))
+    if isinstance(value,Set):
+        return (type(value),frozenset(freeze(item) for item in value))
+    return value
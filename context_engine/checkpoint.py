@@ -0,0 +1,261 @@
+import hashlib
+from itertools import islice
+import json
+import os
+import tempfile
+import typing as t
+
+from .batch import context_data
+from .incremental import node_fingerprint, tracking
+from .snapshot import Snapshot, SnapshotError, pack
+
+# bump when the manifest or blob layout changes
+CHECKPOINT_FORMAT = 3
+MANIFEST = "manifest.json"
+BLOBS = "blobs"
+
+
+class CheckpointError(Exception):
+    """Raised when a checkpoint can not be written or read.
+    """
+    def __init__(self, message:str, path:str) -> None:
+        self.path = path
+        super().__init__(f"{path}: {message}")
+
+
+class Checkpointer():
+    """Persists the context and position of a running process so it can be resumed.
+
+       Checkpoints are taken before every `every` top-level steps (and once
+       the process finishes) and, with
+       loop_every, before every `loop_every` iterations of top-level for each,
+       while and do while flows, which also records the loop position and flow
+       locals (loop counters included). Loops nested deeper resume from the
+       start of their enclosing top-level iteration.
+
+       Each context key is packed into a snapshot blob (see snapshot.pack)
+       named by the hash of its content and a small manifest lists the blobs
+       of the latest checkpoint. While the process runs the context records
+       the keys steps read or write, a checkpoint only packs those again and
+       blobs already on disk are not written again, so checkpointing at every
+       top-level step costs little more than pickling what changed. The
+       manifest also holds a fingerprint of the process and its components,
+       a checkpoint taken with a different one can't be resumed.
+    """
+    def __init__(self, directory:t.Union[str,os.PathLike], every:int=1,
+                 loop_every:t.Optional[int]=None) -> None:
+        self.directory:str = os.fspath(directory)
+        self.every:int = every
+        self.loop_every:t.Optional[int] = loop_every
+        self.index:int = 0
+        self.saves:int = 0
+        self.__blobs:t.Set[str] = set()
+        # context key -> blob of the last checkpoint, and the recorder of the
+        # keys touched since then while run is tracking the context
+        self.__names:t.Dict[str,str] = {}
+        self.__recorder = None
+        # position restored by resume, it is already on disk so not saved again
+        self.__resume_index:t.Optional[int] = None
+        self.__resume_loop:t.Optional[t.Dict] = None
+        self.__skip_boundary:bool = False
+
+    def run(self, engine, start:int=0):
+        """Runs engine's compiled plan from top-level step start checkpointing on the way.
+        """
+        push_step = engine.frame.push_step
+        do_step = engine.do_step
+        nodes = engine.plan.nodes
+        # the first checkpoint packs every key, later ones what was touched
+        self.__names = {}
+        with tracking(engine.context,{},fingerprints=False) as recorder:
+            self.__recorder = recorder
+            try:
+                for index in range(start,len(nodes)):
+                    self.index = index
+                    if self.every and index % self.every == 0 and index != self.__resume_index:
+                        self.save(engine)
+                    do_step(push_step(nodes[index]))
+                self.index = len(nodes)
+                self.__resume_index = None
+                if self.every:
+                    self.save(engine)
+            finally:
+                self.__recorder = None
+
+    def resume(self, engine):
+        """Restores the saved context into engine and runs the rest of the process.
+        """
+        manifest = self.load_manifest()
+        if manifest.get("plan") != plan_fingerprint(engine.plan):
+            raise CheckpointError("checkpoint was taken with a different process or components",
+                                  os.path.join(self.directory,MANIFEST))
+        engine.context.update(self.load_values(manifest["keys"]))
+        self.__resume_index = manifest["index"]
+        loop = manifest.get("loop")
+        if loop is not None:
+            loop["locals"] = self.load_values(loop["locals"])
+            self.__resume_loop = loop
+        self.run(engine,manifest["index"])
+
+    def loop(self, engine, flow_step, items:t.Iterable) -> t.Iterator:
+        """Wraps the items of a loop flow adding a boundary before each item.
+           When resuming this flow the items already done are skipped.
+        """
+        start = self.resume_loop(engine,flow_step) or 0
+        iterator = iter(items)
+        if start:
+            next(islice(iterator,start,start),None)
+        for position, item in enumerate(iterator,start):
+            self.boundary(engine,flow_step,position)
+            yield item
+
+    def resume_loop(self, engine, flow_step) -> t.Optional[int]:
+        """Restores flow locals of the loop being resumed and returns its position,
+           None when flow_step isn't the loop the checkpoint was taken in.
+        """
+        loop = self.__resume_loop
+        if loop is None or flow_step.node is None or flow_step.node.path != loop["path"]:
+            return None
+        self.__resume_loop = None
+        self.__skip_boundary = True
+        flow_step.locals.update(loop["locals"])
+        return loop["position"]
+
+    def resuming(self, flow_step) -> bool:
+        loop = self.__resume_loop
+        return loop is not None and flow_step.node is not None and flow_step.node.path == loop["path"]
+
+    def boundary(self, engine, flow_step, position:t.Optional[int]=None):
+        """Called by loop flows before each iteration, checkpoints top-level loops
+           every loop_every iterations.
+        """
+        if not self.loop_every:
+            return
+        flow_stack = engine.frame.state.flow_stack
+        if len(flow_stack) != 1 or flow_stack[0] is not flow_step:
+            return
+        if self.__skip_boundary:
+            self.__skip_boundary = False
+            return
+        if position is None:
+            position = flow_step.locals.get(flow_step.var,0)
+        if position % self.loop_every == 0:
+            self.save(engine,{"path":flow_step.node.path,"position":position,
+                              "locals":dict(flow_step.locals)})
+
+    def save(self, engine, loop:t.Optional[t.Dict]=None):
+        """Writes a checkpoint of engine's context at the current position.
+        """
+        manifest = {
+            "format": CHECKPOINT_FORMAT,
+            "index": self.index,
+            "keys": self.__store_context(engine.context),
+            "loop": None,
+            "plan": plan_fingerprint(engine.plan),
+        }
+        if loop is not None:
+            loop = dict(loop)
+            loop["locals"] = self.store_values(loop["locals"])
+            manifest["loop"] = loop
+        self.__write(os.path.join(self.directory,MANIFEST),
+                     json.dumps(manifest,sort_keys=True).encode("utf-8"))
+        self.__prune(manifest)
+        self.saves += 1
+
+    def __store_context(self, context) -> t.Dict[str,str]:
+        # keys read may have changed in place, they are packed again with the written ones
+        recorder = self.__recorder
+        if recorder is None or recorder.all_keys or not self.__names:
+            names = self.store_values(context_data(context))
+        else:
+            touched = recorder.written | set(recorder.inputs)
+            names = {key:name for key, name in self.__names.items() if key not in touched}
+            names.update(self.store_values(context_data({key:dict.__getitem__(context,key) for key in touched
+                                                          if dict.__contains__(context,key)})))
+        if recorder is not None:
+            recorder.inputs.clear()
+            recorder.written.clear()
+            recorder.all_keys = False
+        self.__names = names
+        return names
+
+    def store_values(self, values:t.Mapping) -> t.Dict[str,str]:
+        """Stores each value as a content addressed blob and returns key to blob name.
+        """
+        names = {}
+        for key, value in values.items():
+            try:
+                data = pack(value)
+            except Exception as x:
+                raise CheckpointError(f"can not pickle context value: {x}",key) from x
+            name = data.digest()
+            if name not in self.__blobs:
+                path = self.__blob_path(name)
+                if not os.path.exists(path):
+                    self.__write(path,data)
+                self.__blobs.add(name)
+            names[key] = name
+        return names
+
+    def load_values(self, names:t.Mapping[str,str]) -> t.Dict[str,t.Any]:
+        values = {}
+        for key, name in names.items():
+            try:
+                with open(self.__blob_path(name),"rb") as blob:
+                    values[key] = Snapshot.read(blob).load()
+            except OSError as x:
+                raise CheckpointError(f"missing blob {name}",key) from x
+            except SnapshotError as x:
+                raise CheckpointError(f"unreadable blob {name}: {x}",key) from x
+            self.__blobs.add(name)
+        return values
+
+    def load_manifest(self) -> t.Dict:
+        path = os.path.join(self.directory,MANIFEST)
+        try:
+            with open(path,encoding="utf-8") as source:
+                manifest = json.load(source)
+        except (OSError,ValueError) as x:
+            raise CheckpointError("no readable checkpoint",path) from x
+        if manifest.get("format") != CHECKPOINT_FORMAT:
+            raise CheckpointError(f"unsupported checkpoint format {manifest.get('format')}",path)
+        return manifest
+
+    def __blob_path(self, name:str) -> str:
+        return os.path.join(self.directory,BLOBS,name)
+
+    def __write(self, path:str, data:t.Union[bytes,Snapshot]):
+        directory = os.path.dirname(path)
+        os.makedirs(directory,exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory,suffix=".tmp")
+        try:
+            with os.fdopen(fd,"wb") as out:
+                if isinstance(data,Snapshot):
+                    data.write(out)
+                else:
+                    out.write(data)
+            os.replace(temp_path,path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def __prune(self, manifest:t.Dict):
+        # blobs written by this checkpointer that the latest manifest no longer uses
+        used = set(manifest["keys"].values())
+        if manifest["loop"] is not None:
+            used.update(manifest["loop"]["locals"].values())
+        for name in self.__blobs - used:
+            try:
+                os.unlink(self.__blob_path(name))
+            except OSError:
+                pass
+        self.__blobs &= used
+
+
+def plan_fingerprint(plan) -> str:
+    """Hash of every top-level step and the components they run.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for node in plan.nodes:
+        digest.update(node_fingerprint(node).encode("ascii"))
+    return digest.hexdigest()
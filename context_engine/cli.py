@@ -0,0 +1,148 @@
+"""
+Runs a process document from the command line.
+
+    context-engine process.jsonc -m my_components --time --steps
+
+The module given with -m is imported and its register(engine, context)
+function (or module:function) is called with the engine and context returned by
+init_engine so it can add components and expressions before the run.
+
+With --worker HOST:PORT the engine does not run the process, it connects to a
+coordinator's SocketTransport and runs distributed for each items until the
+coordinator disconnects. The shared key is read from CONTEXT_ENGINE_AUTHKEY.
+
+--record TRACE writes every component and expression call of the run to TRACE,
+--replay TRACE substitutes those recorded calls for the real ones and prints
+where the time of the run went.
+"""
+import argparse
+import cProfile
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import time
+import tracemalloc
+import typing as t
+
+from .engine import init_engine
+from .loader import load_process, parse_jsonc
+
+
+def main(argv:t.Optional[t.List[str]]=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    engine, context = init_engine(load_process(args.document))
+    for module in args.module:
+        load_register(module)(engine,context)
+    if args.context:
+        with open(args.context,encoding="utf-8") as source:
+            context.update(parse_jsonc(source.read()))
+    for assignment in args.set:
+        key, _, value = assignment.partition("=")
+        context[key] = parse_value(value)
+
+    if args.worker:
+        from .distributed import connect_worker
+        host, _, port = args.worker.rpartition(":")
+        connect_worker((host or "localhost",int(port)),engine)
+        return 0
+
+    start = time.perf_counter()
+    engine.compile()
+    compiled = time.perf_counter()
+
+    hooks = None
+    if args.record:
+        from .replay import Recorder
+        hooks = Recorder(args.record).attach(engine)
+    elif args.replay:
+        from .replay import Replayer
+        hooks = Replayer(args.replay).attach(engine)
+    profiler = engine.enable_profiler() if args.steps is not None else None
+    if args.memory:
+        tracemalloc.start()
+    try:
+        if args.cprofile:
+            cprofile = cProfile.Profile()
+            cprofile.runcall(engine.run)
+            cprofile.dump_stats(args.cprofile)
+        else:
+            engine.run()
+    finally:
+        finished = time.perf_counter()
+        peak = tracemalloc.get_traced_memory()[1] if args.memory else None
+        if args.memory:
+            tracemalloc.stop()
+        engine.disable_profiler()
+        if hooks is not None:
+            hooks.detach()
+
+        out = sys.stderr
+        if args.time:
+            print(f"compile {compiled - start:.6f}s run {finished - compiled:.6f}s",file=out)
+        if profiler is not None:
+            print(profiler.report(limit=args.steps or None,kind="step"),file=out)
+        if peak is not None:
+            print(f"peak memory {peak / 1_048_576:.2f} MB",file=out)
+        if args.record:
+            print(f"recorded {hooks.calls} calls to {args.record}",file=out)
+        elif args.replay:
+            print(hooks.report.summary(),file=out)
+        if args.cprofile:
+            print(f"cProfile stats written to {args.cprofile}",file=out)
+
+    for key in args.print:
+        print(json.dumps(context.get(key),default=repr))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="context-engine",description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("document",help="JSON or JSONC process document")
+    parser.add_argument("-m","--module",action="append",default=[],
+                        help="module or .py file with register(engine, context), or module:function")
+    parser.add_argument("-c","--context",help="JSON(C) file of values to seed the context with")
+    parser.add_argument("--set",action="append",default=[],metavar="KEY=VALUE",
+                        help="seed a context value, VALUE is parsed as JSON when possible")
+    parser.add_argument("--time",action="store_true",help="print compile and run wall time")
+    parser.add_argument("--steps",nargs="?",type=int,const=0,metavar="N",
+                        help="print per step timings, optionally only the N slowest")
+    parser.add_argument("--memory",action="store_true",help="print peak traced memory")
+    parser.add_argument("--cprofile",metavar="FILE",help="write cProfile stats of the run to FILE")
+    parser.add_argument("--print",action="append",default=[],metavar="KEY",
+                        help="print a context value as JSON after the run")
+    parser.add_argument("--worker",metavar="HOST:PORT",
+                        help="serve distributed for each items for the coordinator at HOST:PORT")
+    trace = parser.add_mutually_exclusive_group()
+    trace.add_argument("--record",metavar="TRACE",help="record component and expression calls to TRACE")
+    trace.add_argument("--replay",metavar="TRACE",help="replay the calls recorded in TRACE")
+    return parser
+
+
+def load_register(spec:str) -> t.Callable:
+    """Resolves module, module:function or path.py[:function] to a register function.
+    """
+    target, _, function = spec.partition(":")
+    if target.endswith(".py") or os.sep in target:
+        name = os.path.splitext(os.path.basename(target))[0]
+        module_spec = importlib.util.spec_from_file_location(name,target)
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(target)
+    return getattr(module,function or "register")
+
+
+def parse_value(value:str) -> t.Any:
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+if __name__ == "__main__":
+    sys.exit(main())
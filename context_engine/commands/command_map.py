@@ -1,36 +1,54 @@
+import importlib
+import typing as t
 
 from context_engine.decorators import FlowComponent, Expression, Component
-import context_engine.commands.components.all as sys_components
-import context_engine.commands.expressions.all as sys_expressions
-import context_engine.commands.flows.all as sys_flows
 
+# (command class, command package, function, name used in process documents)
+# functions live in a module of the same name inside context_engine.commands.<package>
 command_map = {
     "components": [
     ],
     "expressions": [
-        ("Expression","sys_expressions","new_dict_function","new_dict"),
-        ("Expression","sys_expressions","new_list_function","new_list"),
-        ("Expression","sys_expressions","set_function","set"),
+        (Expression,"expressions","new_dict_function","new_dict"),
+        (Expression,"expressions","new_list_function","new_list"),
+        (Expression,"expressions","new_spill_list_function","new_spill_list"),
+        (Expression,"expressions","open_csv_function","open_csv"),
+        (Expression,"expressions","open_jsonl_function","open_jsonl"),
+        (Expression,"expressions","set_function","set"),
     ],
     "flows": [
-        ("FlowComponent","sys_flows","block_logic","block"),
-        ("FlowComponent","sys_flows","do_while_logic","do while"),
-        ("FlowComponent","sys_flows","foreach_logic","for each"),
-        ("FlowComponent","sys_flows","if_logic","if"),
-        ("FlowComponent","sys_flows","while_logic","while"),
-        ("FlowComponent","sys_flows","try_logic","try"),
+        (FlowComponent,"flows","block_logic","block"),
+        (FlowComponent,"flows","do_while_logic","do while"),
+        (FlowComponent,"flows","foreach_logic","for each"),
+        (FlowComponent,"flows","if_logic","if"),
+        (FlowComponent,"flows","map_logic","map"),
+        (FlowComponent,"flows","parallel_foreach_logic","parallel for each"),
+        (FlowComponent,"flows","while_logic","while"),
+        (FlowComponent,"flows","try_logic","try"),
     ]
     
 }
 
+# command_map entries with functions imported, built once per process on first use
+_registry:t.Dict[str,t.Tuple[t.Tuple[type,t.Callable,str],...]] = {}
+
+def registry(map_key:str) -> t.Tuple[t.Tuple[type,t.Callable,str],...]:
+    """Returns (command class, function, name) for every command of map_key.
+       Command modules are imported the first time their map_key is requested
+       and the result is shared by every engine.
+    """
+    entries = _registry.get(map_key)
+    if entries is None:
+        entries = _registry[map_key] = tuple(
+            (cls,getattr(importlib.import_module(f"context_engine.commands.{package}.{function}"),function),name)
+            for cls, package, function, name in command_map[map_key])
+    return entries
+
 def map_command(map_key,save_dic,context,engine=None):
-    for obj, lib, name,cb in command_map[map_key]:
-        comp= []
-        exec("comp.append(%s( '%s', %s.%s))" % (obj,cb,lib,name),globals(),locals())
-        cmd = comp and comp.pop()
+    for cls, function, name in registry(map_key):
+        cmd = cls(name,function)
         
-        cmd and context and cmd.set_context(context)
-        cmd and engine and cmd.set_engine(engine)
+        context is not None and cmd.set_context(context)
+        engine is not None and cmd.set_engine(engine)
         
-        save_dic[cb] = cmd
-        1 == 1
\ No newline at end of file
+        save_dic[name] = cmd
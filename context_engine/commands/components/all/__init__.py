@@ -1,11 +1,11 @@
 """
-Loads all flow_components
+Loads all components lazily on first attribute access
 """
-import pkgutil
-import context_engine.commands.components as components
+import importlib
 
-__all__ = [name for _,name, _ in pkgutil.iter_modules(
-    components.__path__) if name != "all"]
+__all__ = []
 
-for name in __all__:
-    exec("from ..%s import %s" % (name,name))
\ No newline at end of file
+def __getattr__(name):
+    if name in __all__:
+        return getattr(importlib.import_module(f"..{name}",__name__),name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,11 +1,12 @@
 """
-Loads all flow_components
+Loads all expressions lazily on first attribute access
 """
-import pkgutil
-import context_engine.commands.expressions as expressions
+import importlib
 
-__all__ = [name for _,name, _ in pkgutil.iter_modules(
-    expressions.__path__) if name != "all"]
+__all__ = ["new_dict_function","new_list_function","new_spill_list_function",
+           "open_csv_function","open_jsonl_function","set_function"]
 
-for name in __all__:
-    exec("from ..%s import %s" % (name,name))
\ No newline at end of file
+def __getattr__(name):
+    if name in __all__:
+        return getattr(importlib.import_module(f"..{name}",__name__),name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
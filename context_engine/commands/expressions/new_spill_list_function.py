@@ -0,0 +1,2 @@
+def new_spill_list_function(context,name):
+    context[name] = context.spill_store.new_list()
\ No newline at end of file
@@ -0,0 +1,3 @@
+def open_csv_function(context,path,delimiter=None,encoding="utf-8",fieldnames=None):
+    from context_engine.records import RecordFile
+    return RecordFile(path,"csv",encoding,delimiter,fieldnames).open()
\ No newline at end of file
@@ -0,0 +1,3 @@
+def open_jsonl_function(context,path,encoding="utf-8"):
+    from context_engine.records import RecordFile
+    return RecordFile(path,"jsonl",encoding).open()
\ No newline at end of file
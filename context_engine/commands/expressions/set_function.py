@@ -1,8 +1,4 @@
-from context_engine.decorators import get_composite_key_value
+from context_engine.paths import compile_path
 
 def set_function(context,key:str,value):
-    get_composite_key_value(context,key,value)
-    
-        
-        
-        
\ No newline at end of file
+    compile_path(key).set(context,value)
@@ -1,13 +1,11 @@
 """
-Loads all flow_components
+Loads all flow_components lazily on first attribute access
 """
-import pkgutil
-import context_engine.commands.flows as flows
+import importlib
 
-__all__ = [name for _,name, _ in pkgutil.iter_modules(
-    flows.__path__) if name != "all"]
+__all__ = ["block_logic","do_while_logic","foreach_logic","if_logic","map_logic","parallel_foreach_logic","try_logic","while_logic"]
 
-
-for name in __all__:
-    exec("from ..%s import %s" % (name,name))
-    
\ No newline at end of file
+def __getattr__(name):
+    if name in __all__:
+        return getattr(importlib.import_module(f"..{name}",__name__),name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -6,6 +6,9 @@ from .while_logic import while_logic
 
 @default_var_when_none
 def do_while_logic(engine,flow_step):
-    engine.increment_loop_counter(flow_step)
-    engine.do_steps(flow_step.steps)
-    while_logic(engine,flow_step)
\ No newline at end of file
+    # resuming a checkpoint taken in the loop skips the unconditional first pass
+    checkpoints = engine.checkpoints
+    if checkpoints is None or not checkpoints.resuming(flow_step):
+        engine.increment_loop_counter(flow_step)
+        engine.do_steps(flow_step.steps)
+    while_logic(engine,flow_step)
@@ -1,18 +1,78 @@
-from ...decorators import get_composite_key_value
+from itertools import islice
+
+from ...paths import compile_path
 
 def foreach_logic(engine,flow_step):
-    collection = get_composite_key_value(engine.context,flow_step.collection)
-    if flow_step.is_var_list and type(collection) is dict:
-        for x,y in collection.items():
-            engine.set_local(flow_step.var[0],x)
-            engine.set_local(flow_step.var[1],y)
-            engine.do_steps(flow_step.steps)
-    elif flow_step.is_var_list:
-        for x,y in enumerate(collection):
-            engine.set_local(flow_step.var[0],x)
-            engine.set_local(flow_step.var[1],y)
-            engine.do_steps(flow_step.steps)
+    if flow_step.get("parallel"):
+        from .parallel_foreach_logic import parallel_foreach_logic
+        return parallel_foreach_logic(engine,flow_step)
+    if flow_step.get("distributed"):
+        from ...distributed import distributed_foreach_logic
+        return distributed_foreach_logic(engine,flow_step)
+    
+    # items are pulled one at a time so generators and other lazy
+    # collections are never materialized
+    var = flow_step.var
+    steps = flow_step.steps
+    checkpoints = engine.checkpoints
+    if flow_step.is_var_list:
+        pairs = foreach_pairs(engine,flow_step)
+        if checkpoints is not None:
+            pairs = checkpoints.loop(engine,flow_step,pairs)
+        for x,y in pairs:
+            engine.set_local(var[0],x)
+            engine.set_local(var[1],y)
+            engine.do_steps(steps)
+    else:
+        items = foreach_items(engine,flow_step)
+        if checkpoints is not None:
+            items = checkpoints.loop(engine,flow_step,items)
+        for x in items:
+            engine.set_local(var,x)
+            engine.do_steps(steps)
+            
+def foreach_items(engine,flow_step):
+    """Returns a lazy iterable over the flow collection.
+       With batch_size items are grouped into lists of at most batch_size.
+    """
+    collection = compile_path(flow_step.collection).get(engine.context)
+    batch_size = flow_step.get("batch_size")
+    if batch_size:
+        return chunked(collection,batch_size)
+    return collection
+
+def foreach_pairs(engine,flow_step):
+    """Returns lazy (key, value) pairs for flows with two loop variables.
+       dict collections pair keys and values, anything else (and batches) pairs
+       the position with the item.
+    """
+    collection = compile_path(flow_step.collection).get(engine.context)
+    batch_size = flow_step.get("batch_size")
+    if type(collection) is dict:
+        collection = collection.items()
+        if not batch_size:
+            return collection
+    if batch_size:
+        collection = chunked(collection,batch_size)
+    return enumerate(collection)
+
+def foreach_bindings(engine,flow_step):
+    """Yields (var, value) pairs to bind for each item of the flow collection.
+    """
+    var = flow_step.var
+    if flow_step.is_var_list:
+        for x,y in foreach_pairs(engine,flow_step):
+            yield ((var[0],x),(var[1],y))
     else:
-        for x in engine.context[flow_step.collection]:
-            engine.set_local(flow_step.var,x)
-            engine.do_steps(flow_step.steps)
\ No newline at end of file
+        for x in foreach_items(engine,flow_step):
+            yield ((var,x),)
+            
+def chunked(iterable,size:int):
+    """Yields lists of at most size items pulled lazily from iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator,size))
+        if not chunk:
+            return
+        yield chunk
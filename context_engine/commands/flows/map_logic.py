@@ -0,0 +1,244 @@
+import ast
+from collections.abc import Mapping
+import operator
+
+from ...paths import compile_path
+
+# numpy is optional and imported on first map so engines that never map don't pay for it
+numpy = None
+
+# expressions are only run over arrays when built from these, which numpy
+# evaluates like Python does for each item or fails on
+VECTOR_BINARY = {ast.Add:operator.add, ast.Sub:operator.sub, ast.Mult:operator.mul,
+                 ast.Div:operator.truediv, ast.FloorDiv:operator.floordiv,
+                 ast.Mod:operator.mod, ast.Pow:operator.pow}
+VECTOR_UNARY = {ast.USub:operator.neg, ast.UAdd:operator.pos}
+VECTOR_COMPARE = {ast.Eq:operator.eq, ast.NotEq:operator.ne, ast.Lt:operator.lt,
+                  ast.LtE:operator.le, ast.Gt:operator.gt, ast.GtE:operator.ge}
+VECTOR_CALLS = {"abs":abs}
+# int64 results of these are checked for overflow against a float64 shadow
+OVERFLOWING = (operator.add,operator.sub,operator.mul,operator.pow,operator.neg,abs)
+INT_LIMIT = 2.0 ** 63
+# ints past this lose precision when numpy divides them as float64
+EXACT_FLOAT_INT = 2 ** 53
+
+class NotVectorizable(Exception):
+    """Raised while evaluating over arrays when the per item path must run.
+    """
+
+def map_logic(engine,flow_step):
+    """Evaluates expression for every item of collection and writes the results.
+
+       Numeric collections are evaluated once over NumPy arrays when numpy is
+       installed: a list of numbers binds the variable to an array, a list of
+       records or a dict of columns binds it to arrays per field, so
+       locals.o.price * locals.o.qty multiplies whole columns. Only arithmetic,
+       comparisons and abs over the item and numeric context values run over
+       arrays, and only when numpy computes what Python would per item.
+       Anything else, including overflow and division by zero, falls back to
+       evaluating per item.
+       
+       result: context key receiving the list of values
+       field: key written on each record (or new column of a dict of columns)
+    """
+    var = flow_step.var or '_'
+    expression = flow_step.get("expression")
+    collection = compile_path(flow_step.collection).get(engine.context)
+    
+    values = None
+    if load_numpy() is not None:
+        values = map_vectorized(engine,expression,var,collection)
+    if values is None:
+        values = map_items(engine,expression,var,collection)
+    engine.context.locals.pop(var,None)
+    
+    field = flow_step.get("field")
+    if field is not None:
+        if isinstance(collection,Mapping):
+            collection[field] = values
+        else:
+            for record,value in zip(collection,values):
+                record[field] = value
+    if flow_step.get("result") is not None:
+        engine.context[flow_step.get("result")] = values
+        
+def map_items(engine,expression:str,var:str,collection):
+    """Per item path, returns list of values.
+    """
+    if isinstance(collection,Mapping):
+        keys = list(collection.keys())
+        collection = (dict(zip(keys,row)) for row in zip(*collection.values()))
+    
+    values = []
+    for item in collection:
+        engine.set_local(var,item)
+        values.append(engine.context.eval_expression(expression))
+    return values
+        
+def map_vectorized(engine,expression:str,var:str,collection):
+    """Evaluates expression once over arrays, returns list of values or None
+       when the collection or expression can't be vectorized.
+    """
+    tree = vector_tree(expression,var)
+    if tree is None:
+        return None
+    fields = referenced_fields(expression,var)
+    if isinstance(collection,Mapping):
+        names = fields if fields is not None else list(collection.keys())
+        if not all(name in collection for name in names):
+            return None
+        bound = {name:numpy.asarray(collection[name]) for name in names}
+        columns = list(bound.values())
+    elif isinstance(collection,(list,tuple)) and len(collection) > 0:
+        if isinstance(collection[0],Mapping):
+            if fields is None:
+                return None
+            try:
+                bound = {name:numpy.asarray([record[name] for record in collection]) for name in fields}
+            except (KeyError,TypeError):
+                return None
+            columns = list(bound.values())
+        else:
+            bound = numpy.asarray(collection)
+            columns = [bound]
+    else:
+        return None
+    
+    # bool arithmetic and unsigned wrap around differ from Python's
+    if not columns or any(column.dtype.kind not in "ifc" or column.ndim != 1 for column in columns):
+        return None
+    size = len(columns[0])
+    if any(len(column) != size for column in columns):
+        return None
+    
+    try:
+        with numpy.errstate(all="raise"):
+            result = evaluate_vectorized(tree.body,var,bound,engine.context)
+    except Exception:
+        return None
+    
+    # results that aren't one value per item, such as a constant, run per item
+    if not isinstance(result,numpy.ndarray) or result.shape != (size,) or result.dtype.kind not in "bifc":
+        return None
+    return result.tolist()
+    
+def vector_tree(expression:str,var:str):
+    """Parsed expression when it only uses nodes that can run over arrays and
+       reads the item, None otherwise.
+    """
+    try:
+        tree = ast.parse(expression,mode="eval")
+    except SyntaxError:
+        return None
+    uses_var = False
+    for node in ast.walk(tree):
+        if is_var_node(node,var):
+            uses_var = True
+        elif isinstance(node,ast.Attribute):
+            # only locals.var and its fields, numeric context values are bare names
+            if not is_var_node(node.value,var):
+                return None
+        elif isinstance(node,ast.Name):
+            continue
+        elif isinstance(node,ast.Constant):
+            if type(node.value) not in (int,float,complex):
+                return None
+        elif isinstance(node,ast.BinOp):
+            if type(node.op) not in VECTOR_BINARY:
+                return None
+        elif isinstance(node,ast.UnaryOp):
+            if type(node.op) not in VECTOR_UNARY:
+                return None
+        elif isinstance(node,ast.Compare):
+            # chained comparisons need the truth value of an array
+            if len(node.ops) != 1 or type(node.ops[0]) not in VECTOR_COMPARE:
+                return None
+        elif isinstance(node,ast.Call):
+            if (not isinstance(node.func,ast.Name) or node.func.id not in VECTOR_CALLS
+                    or len(node.args) != 1 or node.keywords):
+                return None
+        elif not isinstance(node,(ast.Expression,ast.Load,ast.operator,ast.unaryop,ast.cmpop)):
+            return None
+    return tree if uses_var else None
+    
+def evaluate_vectorized(node,var:str,bound,context):
+    """Evaluates a node of a tree accepted by vector_tree over the bound arrays.
+    """
+    if isinstance(node,ast.Constant):
+        return node.value
+    if isinstance(node,ast.Name):
+        value = context[node.id]
+        if type(value) not in (int,float,complex):
+            raise NotVectorizable(node.id)
+        return value
+    if isinstance(node,ast.Attribute):
+        if is_var_node(node,var):
+            if isinstance(bound,Mapping):
+                raise NotVectorizable(var)
+            return bound
+        if is_var_node(node.value,var):
+            return bound[node.attr]
+        raise NotVectorizable(node.attr)
+    if isinstance(node,ast.BinOp):
+        op = VECTOR_BINARY[type(node.op)]
+        operands = (evaluate_vectorized(node.left,var,bound,context),
+                    evaluate_vectorized(node.right,var,bound,context))
+        if op is operator.truediv and not all(map(exact_as_float,operands)):
+            raise NotVectorizable("division of large ints")
+        return checked(op,operands)
+    if isinstance(node,ast.UnaryOp):
+        return checked(VECTOR_UNARY[type(node.op)],(evaluate_vectorized(node.operand,var,bound,context),))
+    if isinstance(node,ast.Compare):
+        return VECTOR_COMPARE[type(node.ops[0])](evaluate_vectorized(node.left,var,bound,context),
+                                                 evaluate_vectorized(node.comparators[0],var,bound,context))
+    if isinstance(node,ast.Call):
+        return checked(VECTOR_CALLS[node.func.id],(evaluate_vectorized(node.args[0],var,bound,context),))
+    raise NotVectorizable(type(node).__name__)
+    
+def checked(op,operands):
+    """Applies op, raising NotVectorizable when an int64 result overflowed.
+    """
+    result = op(*operands)
+    if op in OVERFLOWING and isinstance(result,numpy.ndarray) and result.dtype.kind == "i":
+        shadow = op(*(as_float(operand) for operand in operands))
+        if not (numpy.abs(shadow) < INT_LIMIT).all():
+            raise NotVectorizable("int64 overflow")
+    return result
+    
+def as_float(value):
+    if isinstance(value,numpy.ndarray):
+        return value.astype(numpy.float64)
+    return float(value)
+    
+def exact_as_float(value) -> bool:
+    if isinstance(value,numpy.ndarray):
+        return value.dtype.kind != "i" or bool((numpy.abs(value.astype(numpy.float64)) < EXACT_FLOAT_INT).all())
+    return not isinstance(value,int) or abs(value) < EXACT_FLOAT_INT
+    
+def referenced_fields(expression:str,var:str):
+    """Fields read as locals.var.field in expression, None when var is used any
+       other way so columns can't be worked out.
+    """
+    fields = []
+    used = 0
+    field_uses = 0
+    for node in ast.walk(ast.parse(expression,mode="eval")):
+        if is_var_node(node,var):
+            used += 1
+        elif isinstance(node,ast.Attribute) and is_var_node(node.value,var):
+            field_uses += 1
+            node.attr in fields or fields.append(node.attr)
+    return fields if used == field_uses else None
+
+def load_numpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError: # pragma: no cover - numpy is optional
+            numpy = False
+    return numpy or None
+
+def is_var_node(node,var:str) -> bool:
+    return (isinstance(node,ast.Attribute) and node.attr == var
+            and isinstance(node.value,ast.Name) and node.value.id == "locals")
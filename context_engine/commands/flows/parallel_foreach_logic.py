@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import contextvars
+import os
+
+from .foreach_logic import foreach_bindings
+
+
+class ForEachError(Exception):
+    """Raised by parallel for each with fail_on_error false after every item ran.
+       errors holds (item index, exception) pairs in collection order.
+    """
+    def __init__(self, errors) -> None:
+        self.errors = errors
+        super().__init__(f"{len(errors)} item(s) failed: {errors[0][1]!r}")
+
+
+def parallel_foreach_logic(engine,flow_step):
+    """Runs the for each body for items concurrently on a thread pool.
+
+       Each item runs on forked frame stacks with its own copy of the flow
+       locals. Optional members:
+            max_workers: pool size
+            results: context key receiving each item's locals
+            ordered: results in collection order (default) or completion order
+            fail_on_error: false runs every item and raises ForEachError
+    """
+    frame = engine.frame
+    parent = frame.current_flow
+    steps = flow_step.steps
+    ordered = flow_step.get("ordered",True)
+    fail_fast = flow_step.fail_on_error is not False
+    max_workers = flow_step.get("max_workers") or min(32,(os.cpu_count() or 1) + 4)
+    
+    def run_item(bindings):
+        token = frame.fork(parent)
+        try:
+            for var,value in bindings:
+                engine.set_local(var,value)
+            engine.do_steps(steps)
+            return engine.context.locals
+        finally:
+            frame.join(token)
+    
+    results = []
+    errors = []
+    
+    def collect(done):
+        for future in done:
+            index = future.index
+            error = future.exception()
+            if error is None:
+                results.append((index,future.result()))
+            elif fail_fast:
+                raise error
+            else:
+                errors.append((index,error))
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # bound in flight items so lazy collections are not drained up front
+        window = max_workers * 2
+        pending = set()
+        try:
+            for index,bindings in enumerate(foreach_bindings(engine,flow_step)):
+                if len(pending) >= window:
+                    done, pending = wait(pending,return_when=FIRST_COMPLETED)
+                    collect(done)
+                # items inherit context variables such as run_async's event loop
+                future = pool.submit(contextvars.copy_context().run,run_item,bindings)
+                future.index = index
+                pending.add(future)
+            
+            while pending:
+                done, pending = wait(pending,return_when=FIRST_COMPLETED)
+                collect(done)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    
+    if errors:
+        errors.sort(key=lambda error: error[0])
+        raise ForEachError(errors)
+    
+    if flow_step.get("results") is not None:
+        if ordered:
+            results.sort(key=lambda result: result[0])
+        engine.context[flow_step.get("results")] = [item_locals for _,item_locals in results]
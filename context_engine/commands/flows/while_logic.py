@@ -2,7 +2,19 @@ from ...decorators import default_var_when_none
 
 @default_var_when_none
 def while_logic(engine,flow_step):
+    if engine.checkpoints is not None:
+        return checkpointed_while(engine,flow_step,engine.checkpoints)
     engine.increment_loop_counter(flow_step)
     while engine.evaluate_flow_conditions(flow_step) is True:
         engine.do_steps(flow_step.steps)      
-        engine.increment_loop_counter(flow_step)   
\ No newline at end of file
+        engine.increment_loop_counter(flow_step)
+        
+def checkpointed_while(engine,flow_step,checkpoints):
+    # a resumed loop gets its counter back with the flow locals
+    if checkpoints.resume_loop(engine,flow_step) is None:
+        engine.increment_loop_counter(flow_step)
+    checkpoints.boundary(engine,flow_step)
+    while engine.evaluate_flow_conditions(flow_step) is True:
+        engine.do_steps(flow_step.steps)
+        engine.increment_loop_counter(flow_step)
+        checkpoints.boundary(engine,flow_step)
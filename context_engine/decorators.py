@@ -1,18 +1,45 @@
-from ast import arg
+import contextvars
+import inspect
 import types
 import typing as t
 import decorator
 
+from .cache import ResultCache, freeze
+from .paths import compile_path
+
+# event loop async commands are scheduled on, set by Engine.run_async
+event_loop:contextvars.ContextVar = contextvars.ContextVar("context_engine_event_loop",default=None)
+
+def resolve_awaitable(awaitable):
+    """Waits for the result of an async command from synchronous engine code.
+       Inside Engine.run_async the awaitable is scheduled on the caller's event
+       loop, otherwise it runs to completion on a private loop.
+    """
+    import asyncio
+    loop = event_loop.get()
+    if loop is None:
+        return asyncio.run(_await(awaitable))
+    return asyncio.run_coroutine_threadsafe(_await(awaitable),loop).result()
+
+async def _await(awaitable):
+    return await awaitable
+
+def is_coroutine_function(f) -> bool:
+    """True for async functions, partials of them and objects with an async __call__.
+    """
+    return inspect.iscoroutinefunction(f) or (
+        not inspect.isroutine(f) and inspect.iscoroutinefunction(getattr(f,"__call__",None)))
+
 
 def get_composite_key_value(dictionary:dict,key:str,value:any=None):
-    next_key = key.split(".",1)
-    
-    if len(next_key) == 2:
-        get_composite_key_value(dictionary[next_key[0]],next_key[1],value)
-    elif value is not None:
-        dictionary[next_key[0]] = value
+    """Gets the value at dotted path key or sets it when value is not None.
+       See paths.compile_path for the path syntax.
+    """
+    path = compile_path(key)
+    if value is not None:
+        path.set(dictionary,value)
     else:
-        return dictionary[next_key[0]]
+        return path.get(dictionary)
 
 @decorator.decorator
 def default_var_when_none(f, engine, step,*args,**kwargs):
@@ -60,6 +87,12 @@ class Command:
         self.name = name
         self.command:F = command
         self.context = None
+        self.is_async:bool = is_coroutine_function(command)
+        # set by cache=True, see memoize
+        self.result_cache:t.Optional[ResultCache] = None
+        # context keys declared with reads=/writes=, None when not declared
+        self.reads:t.Optional[t.FrozenSet[str]] = None
+        self.writes:t.Optional[t.FrozenSet[str]] = None
                
     def set_context(self,context):
         self.context = context               
@@ -75,14 +108,42 @@ class Component(Command):
     def set_engine(self,engine):
         self.engine = engine  
     def __call__(self,*args, **kwargs):
-        return self.command(self.engine,self.context,*args,**kwargs)    
+        if self.result_cache is not None:
+            return self.invoke_cached(self.engine,self.result_cache,*args,**kwargs)
+        result = self.command(self.engine,self.context,*args,**kwargs)
+        return resolve_awaitable(result) if self.is_async else result
+    def invoke(self,engine,*args, **kwargs):
+        """Calls the component for engine instead of the engine it is bound to.
+           Compiled plans use this so engines spawned from one another can share them.
+        """
+        result = self.command(engine,engine.context,*args,**kwargs)
+        return resolve_awaitable(result) if self.is_async else result
+    def invoke_cached(self,engine,cache:ResultCache,*args, **kwargs):
+        """invoke memoized in cache, keyed by the step args (context.args) and
+           any call arguments or by cache.key(context.args).
+        """
+        step_args = engine.context.args
+        if cache.key is not None:
+            key = cache.key(step_args)
+        else:
+            key = freeze((step_args,args,kwargs))
+        return cache.call(key,self.invoke,engine,*args,**kwargs)
         
 class Expression(Command):
     def __init__(self, name: t.Optional[str], command) -> None:
         super().__init__(name, command)
     
     def __call__(self,*args, **kwargs):
-        return self.command(self.context,*args,**kwargs)
+        cache = self.result_cache
+        if cache is not None:
+            key = cache.key(*args,**kwargs) if cache.key is not None else freeze((args,kwargs))
+            return cache.call(key,self.call,*args,**kwargs)
+        result = self.command(self.context,*args,**kwargs)
+        return resolve_awaitable(result) if self.is_async else result
+    
+    def call(self,*args, **kwargs):
+        result = self.command(self.context,*args,**kwargs)
+        return resolve_awaitable(result) if self.is_async else result
     
 class FlowComponent(Component):
     def __init__(self, name: t.Optional[str], command) -> None:
@@ -91,6 +152,9 @@ class FlowComponent(Component):
     def __call__(self,*args, **kwargs):
         return self.command(self.engine,*args,**kwargs)
     
+    def invoke(self,engine,*args, **kwargs):
+        return self.command(engine,*args,**kwargs)
+    
 
 
 F = t.TypeVar("F", bound=t.Callable[..., t.Any])
@@ -100,6 +164,13 @@ FC = t.TypeVar("FC", bound=t.Union[t.Callable[..., t.Any], Command])
 def expression(
     name: t.Optional[str] = None,
     cls: t.Optional[t.Type[Command]] = None,
+    *,
+    cache: bool = False,
+    maxsize: int = 128,
+    ttl: t.Optional[float] = None,
+    key: t.Optional[t.Callable[..., t.Hashable]] = None,
+    reads: t.Optional[t.Iterable[str]] = None,
+    writes: t.Optional[t.Iterable[str]] = None,
     **attrs: t.Any,
 )-> t.Callable[[F], Expression]: #-----------------------------------------
     
@@ -109,6 +180,9 @@ def expression(
     def decorator(f: t.Callable[..., t.Any]) -> Command:
         cmd = _make_command(f,name,attrs, cls)
         cmd.__doc__ = __doc__
+        if cache:
+            memoize(cmd,maxsize,ttl,key)
+        declare_effects(cmd,reads,writes)
         return cmd
     
     return decorator
@@ -117,6 +191,12 @@ def component(
     name: t.Optional[str] = None,
     cls: t.Optional[t.Type[Command]] = None,
     *attrs: t.Any,
+    cache: bool = False,
+    maxsize: int = 128,
+    ttl: t.Optional[float] = None,
+    key: t.Optional[t.Callable[..., t.Hashable]] = None,
+    reads: t.Optional[t.Iterable[str]] = None,
+    writes: t.Optional[t.Iterable[str]] = None,
 )-> t.Callable[[F], Component]: #-----------------------------------------
     
     if cls is None:
@@ -125,9 +205,37 @@ def component(
     def decorator(f: t.Callable[..., t.Any]) -> Command:
         cmd = _make_command(f,name,attrs,cls)
         cmd.__doc__ = __doc__
+        if cache:
+            memoize(cmd,maxsize,ttl,key)
+        declare_effects(cmd,reads,writes)
         return cmd
     return decorator
 
+def declare_effects(cmd:Command, reads:t.Optional[t.Iterable[str]]=None,
+                    writes:t.Optional[t.Iterable[str]]=None) -> Command:
+    """Records the context keys cmd reads and writes so independent steps can
+       run concurrently (see Engine.enable_parallel_steps). Paths are reduced to
+       their top-level key. Declaring either one declares both, the other as
+       empty, commands declaring neither are treated as touching anything.
+    """
+    if reads is None and writes is None:
+        return cmd
+    cmd.reads = frozenset(compile_path(path).keys[0] for path in (reads or ()))
+    cmd.writes = frozenset(compile_path(path).keys[0] for path in (writes or ()))
+    return cmd
+
+def memoize(cmd:Command, maxsize:int=128, ttl:t.Optional[float]=None,
+            key:t.Optional[t.Callable[..., t.Hashable]]=None) -> Command:
+    """Caches results of cmd in a ResultCache.
+    
+       Components are keyed by their step args (context.args), expressions by
+       their call arguments. key replaces the default, it is called with the
+       step args for components and the call arguments for expressions.
+       Only cache commands whose result depends on nothing but those arguments.
+    """
+    cmd.result_cache = ResultCache(maxsize,ttl,key)
+    return cmd
+
 def flow_component(
     name: t.Optional[str] = None,
     cls: t.Optional[t.Type[Command]] = None,
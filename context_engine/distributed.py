@@ -0,0 +1,476 @@
+"""
+Runs for each bodies on worker processes, on this machine or others.
+
+A coordinator engine with workers attached (Engine.enable_workers) runs for
+each flows marked "distributed": true by shipping work to the workers. Each
+worker holds an engine built from the same process document and components.
+Per loop every worker receives the plan path of the flow, a snapshot of the
+context keys its steps use and the flow locals, then batches of (position,
+loop bindings). Items
+run isolated from each other on that starting state, the keys each item touched
+are tracked and what it wrote comes back to be merged in collection order.
+
+Transports hand out duplex connections with the multiprocessing.connection
+interface (send, recv, poll, fileno, close):
+
+    LocalTransport(factory, processes=4)    forked local worker processes
+    SocketTransport(("0.0.0.0",6000), 8)    workers connecting over TCP
+
+Remote workers are started with the command line runner:
+
+    CONTEXT_ENGINE_AUTHKEY=secret context-engine process.jsonc -m components --worker host:6000
+"""
+import multiprocessing
+from multiprocessing.connection import Client, Listener, wait
+import os
+import pickle
+import threading
+import typing as t
+
+from .analysis import step_effects
+from .decorators import Command
+from .incremental import LOCALS, tracking
+from .plan import Plan
+from .snapshot import Snapshot, snapshot
+
+# messages coordinator -> worker
+JOB = "job"
+ITEMS = "items"
+END = "end"
+# message worker -> coordinator
+DONE = "done"
+# what an item did to a context key
+VALUE = "value"
+DELETE = "delete"
+EXTEND = "extend"
+ADD = "add"
+UNION = "union"
+
+
+class WorkerError(Exception):
+    """Raised when a worker disconnects or can not run a job.
+    """
+
+
+class Transport():
+    """Connections to workers. Subclasses implement channels and close.
+    """
+    def __init__(self) -> None:
+        # one distributed loop at a time uses the workers
+        self.lock = threading.Lock()
+
+    def channels(self) -> t.List[t.Any]:
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def __enter__(self) -> "Transport":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LocalTransport(Transport):
+    """Worker processes forked on this machine talking over pipes.
+
+       factory is called in each worker and returns (engine, context) built the
+       same way as the coordinator's, for example a function calling
+       init_engine and registering components.
+    """
+    def __init__(self, factory:t.Callable[[],t.Tuple[t.Any,t.Any]], processes:t.Optional[int]=None) -> None:
+        super().__init__()
+        fork = multiprocessing.get_context("fork")
+        self.__channels = []
+        self.__processes = []
+        for _ in range(processes or os.cpu_count() or 1):
+            parent, child = fork.Pipe()
+            # the worker closes its copies of the coordinator's ends so closing
+            # them here ends every worker
+            process = fork.Process(target=_serve_local,args=(child,factory,self.__channels + [parent]),
+                                   daemon=True)
+            process.start()
+            child.close()
+            self.__channels.append(parent)
+            self.__processes.append(process)
+
+    def channels(self) -> t.List[t.Any]:
+        return self.__channels
+
+    def close(self):
+        for channel in self.__channels:
+            channel.close()
+        for process in self.__processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self.__channels = []
+        self.__processes = []
+
+
+class SocketTransport(Transport):
+    """Listens on address and waits for `workers` workers to connect.
+
+       authkey authenticates both sides, defaults to CONTEXT_ENGINE_AUTHKEY.
+       Connections are accepted the first time a distributed loop runs.
+    """
+    def __init__(self, address:t.Tuple[str,int], workers:int,
+                 authkey:t.Optional[bytes]=None) -> None:
+        super().__init__()
+        self.workers:int = workers
+        self.listener = Listener(address,authkey=authkey or default_authkey())
+        self.address = self.listener.address
+        self.__channels:t.List[t.Any] = []
+
+    def channels(self) -> t.List[t.Any]:
+        while len(self.__channels) < self.workers:
+            self.__channels.append(self.listener.accept())
+        return self.__channels
+
+    def close(self):
+        for channel in self.__channels:
+            channel.close()
+        self.__channels = []
+        self.listener.close()
+
+
+def default_authkey() -> bytes:
+    key = os.environ.get("CONTEXT_ENGINE_AUTHKEY")
+    if not key:
+        raise WorkerError("set CONTEXT_ENGINE_AUTHKEY or pass authkey")
+    return key.encode("utf-8")
+
+
+def connect_worker(address:t.Tuple[str,int], engine, authkey:t.Optional[bytes]=None):
+    """Connects engine as a worker to a SocketTransport coordinator and serves
+       until the coordinator closes the connection.
+    """
+    channel = Client(address,authkey=authkey or default_authkey())
+    try:
+        serve(channel,engine)
+    finally:
+        channel.close()
+
+
+def _serve_local(channel, factory, inherited):
+    for connection in inherited:
+        connection.close()
+    engine, _ = factory()
+    serve(channel,engine)
+
+
+def serve(channel, engine):
+    """Worker loop, runs jobs sent over channel on engine.
+    """
+    if engine.plan is None:
+        engine.compile()
+    jobs:t.Dict[int,_Job] = {}
+    while True:
+        try:
+            message = channel.recv()
+        except (EOFError,OSError):
+            return
+        kind, job_id = message[0], message[1]
+        if kind == JOB:
+            # the context slice follows the job message
+            values = Snapshot.recv(channel)
+            try:
+                jobs[job_id] = _Job(engine,values,*message[2:])
+            except Exception as x:
+                jobs[job_id] = x
+        elif kind == ITEMS:
+            job = jobs.get(job_id)
+            if isinstance(job,_Job):
+                outcomes = [job.run(position,bindings) for position, bindings in message[2]]
+            else:
+                outcomes = [(position,None,None,WorkerError(f"job failed to start: {job!r}"))
+                            for position, _ in message[2]]
+            _send_outcomes(channel,job_id,outcomes)
+        elif kind == END:
+            jobs.pop(job_id,None)
+
+
+def _send_outcomes(channel, job_id:int, outcomes:t.List[t.Tuple]):
+    try:
+        data = pickle.dumps((DONE,job_id,outcomes),protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as x:
+        # writes, locals or errors that can't travel fail their items instead
+        outcomes = [(position,None,None,WorkerError(f"result can not be sent: {x!r}"))
+                    for position, *_ in outcomes]
+        data = pickle.dumps((DONE,job_id,outcomes),protocol=pickle.HIGHEST_PROTOCOL)
+    channel.send_bytes(data)
+
+
+class _Job():
+    """One distributed loop on a worker.
+    """
+    def __init__(self, engine, values:Snapshot, path:str, flow_locals:bytes, want_locals:bool) -> None:
+        self.engine = engine
+        self.node = find_node(engine.plan,path)
+        self.steps = self.node.fields["steps"]
+        # items restart from these, their pickles also tell what an item changed
+        self.base:t.Dict[str,bytes] = {key:pickle.dumps(value,protocol=pickle.HIGHEST_PROTOCOL)
+                                       for key, value in values.load().items()}
+        self.flow_locals:t.Dict[str,t.Any] = pickle.loads(flow_locals)
+        self.want_locals:bool = want_locals
+        # keys to restore before the next item, every key of the slice at first
+        self.touched:t.Set[str] = set(self.base)
+
+    def reset(self):
+        context = self.engine.context
+        for key in self.touched:
+            data = self.base.get(key)
+            if data is None:
+                context.pop(key,None)
+            else:
+                context[key] = pickle.loads(data)
+        self.touched = set()
+
+    def run(self, position:int, bindings) -> t.Tuple:
+        engine = self.engine
+        self.reset()
+        context = engine.context
+        frame = engine.frame
+        step = frame.push_step(self.node)
+        recorder = None
+        try:
+            flow = frame.push_flow(step)
+            try:
+                flow.locals.update(self.flow_locals)
+                for var, value in bindings:
+                    engine.set_local(var,value)
+                with tracking(context,flow.locals) as recorder:
+                    engine.do_steps(self.steps)
+                item_locals = dict(flow.locals) if self.want_locals else None
+            finally:
+                frame.pop_flow()
+        except Exception as x:
+            if recorder is not None:
+                self.touched = self.__candidates(recorder)
+            return (position,None,None,x)
+        finally:
+            frame.pop_step()
+
+        self.touched = self.__candidates(recorder)
+        writes = {}
+        for key in self.touched:
+            if not dict.__contains__(context,key):
+                if key in self.base:
+                    writes[key] = (DELETE,None)
+                continue
+            value = dict.__getitem__(context,key)
+            data = self.base.get(key)
+            if data is None:
+                writes[key] = (VALUE,value)
+                continue
+            try:
+                if pickle.dumps(value,protocol=pickle.HIGHEST_PROTOCOL) == data:
+                    continue
+            except Exception:
+                pass
+            writes[key] = item_delta(pickle.loads(data),value)
+        return (position,writes,item_locals,None)
+
+    def __candidates(self, recorder) -> t.Set[str]:
+        """Keys the item wrote or read (and may have changed in place).
+        """
+        keys = recorder.written | set(recorder.inputs)
+        if recorder.all_keys:
+            keys |= set(self.base)
+        return {key for key in keys
+                if key != LOCALS and not key.startswith("_Context__")
+                and not isinstance(dict.get(self.engine.context,key),Command)}
+
+
+def item_delta(base:t.Any, value:t.Any) -> t.Tuple[str,t.Any]:
+    """What an item did to a context value, as a delta when it only appended to
+       a list, added keys to a dict or members to a set.
+    """
+    if type(value) is type(base):
+        if isinstance(value,list) and len(value) >= len(base) and \
+                all(same_value(a,b) for a, b in zip(value,base)):
+            return (EXTEND,value[len(base):])
+        if isinstance(value,dict) and all(key in value and same_value(value[key],member)
+                                          for key, member in base.items()):
+            return (ADD,{key:member for key, member in value.items() if key not in base})
+        if isinstance(value,set) and value >= base:
+            return (UNION,value - base)
+    return (VALUE,value)
+
+
+def merge_writes(context, outcomes:t.Iterable[t.Tuple]):
+    """Applies the writes of items in collection order. Deltas of the same kind
+       accumulate like the items running one after another would, a value
+       written by one item conflicts with a different value or any delta from
+       another.
+    """
+    per_key:t.Dict[str,t.List[t.Tuple[int,str,t.Any]]] = {}
+    for position, writes, _, error in outcomes:
+        if error is None:
+            for key, (kind, value) in writes.items():
+                per_key.setdefault(key,[]).append((position,kind,value))
+
+    for key, writes in per_key.items():
+        first, kind, value = writes[0]
+        added = dict(value) if kind == ADD else None
+        for position, other_kind, other in writes[1:]:
+            if other_kind != kind or (kind == VALUE and not same_value(value,other)) or \
+                    (kind == ADD and any(name in added and not same_value(added[name],member)
+                                         for name, member in other.items())):
+                # items start from the same state, keeping one of the values
+                # would drop what the others did
+                raise WorkerError(f"items {first} and {position} both wrote '{key}' differently, "
+                                  "distributed items can only append to lists and add to dicts and sets")
+            if kind == ADD:
+                added.update(other)
+
+    for key, writes in per_key.items():
+        kind = writes[0][1]
+        if kind == VALUE:
+            context[key] = writes[0][2]
+        elif kind == DELETE:
+            context.pop(key,None)
+        else:
+            target = context[key]
+            for _, _, value in writes:
+                if kind == EXTEND:
+                    target.extend(value)
+                else:
+                    target.update(value)
+
+
+def find_node(plan:Plan, path:str):
+    """Looks up the compiled node at plan path such as process[2].steps[0].
+    """
+    from .plan import iter_nodes
+    for node in iter_nodes(plan):
+        if node.path == path:
+            return node
+    raise WorkerError(f"no step at {path}, workers need the coordinator's process")
+
+
+def context_slice(engine, flow_step) -> Snapshot:
+    """Snapshot of the context values the loop body can reach, every value when
+       the keys it uses can't be worked out.
+    """
+    keys = None
+    steps = flow_step.node.fields.get("steps")
+    if type(steps) is Plan:
+        keys = set()
+        for node in steps:
+            effects = step_effects(node,engine.context)
+            if effects is None:
+                keys = None
+                break
+            keys |= effects.reads | effects.writes
+    return snapshot(engine.context,keys)
+
+
+def same_value(a, b) -> bool:
+    try:
+        return bool(a == b)
+    except Exception:
+        return False
+
+
+_job_ids = iter(range(1,1 << 62))
+
+def distributed_foreach_logic(engine,flow_step):
+    """Runs the for each body for every item on the engine's workers.
+
+       Each item only sees the state the loop started with. Items appending
+       to a list or adding to a dict or set are merged in collection order,
+       items writing different values to the same context key raise
+       WorkerError.
+
+       Optional members:
+            chunk_size: items sent to a worker per message (default 1)
+            results: context key receiving each item's locals in collection order
+            fail_on_error: false runs every item and raises ForEachError
+    """
+    from .commands.flows.foreach_logic import foreach_bindings
+    from .commands.flows.parallel_foreach_logic import ForEachError
+
+    transport = engine.workers
+    if transport is None:
+        raise WorkerError("distributed for each needs workers, see Engine.enable_workers")
+    if flow_step.node is None:
+        raise WorkerError("distributed for each needs a compiled process")
+
+    chunk_size = flow_step.get("chunk_size") or 1
+    results_key = flow_step.get("results")
+    fail_fast = flow_step.fail_on_error is not False
+    job_id = next(_job_ids)
+    job = (JOB,job_id,flow_step.node.path,pickle.dumps(dict(flow_step.locals)),
+           results_key is not None)
+    values = context_slice(engine,flow_step)
+
+    outcomes:t.Dict[int,t.Tuple] = {}
+    with transport.lock:
+        channels = transport.channels()
+        if not channels:
+            raise WorkerError("transport has no workers")
+        for channel in channels:
+            channel.send(job)
+            values.send(channel)
+
+        items = iter(foreach_bindings(engine,flow_step))
+        position = 0
+        def next_chunk():
+            nonlocal position
+            chunk = []
+            for bindings in items:
+                chunk.append((position,bindings))
+                position += 1
+                if len(chunk) >= chunk_size:
+                    break
+            return chunk
+
+        # two chunks in flight per worker keeps them busy while results travel
+        in_flight = {channel:0 for channel in channels}
+        for channel in channels:
+            for _ in range(2):
+                chunk = next_chunk()
+                if chunk:
+                    channel.send((ITEMS,job_id,chunk))
+                    in_flight[channel] += 1
+        try:
+            while any(in_flight.values()):
+                for channel in wait([channel for channel, count in in_flight.items() if count]):
+                    try:
+                        kind, done_id, done = channel.recv()
+                    except (EOFError,OSError) as x:
+                        raise WorkerError("worker disconnected") from x
+                    in_flight[channel] -= 1
+                    for outcome in done:
+                        outcomes[outcome[0]] = outcome
+                        if fail_fast and outcome[3] is not None:
+                            raise outcome[3]
+                    chunk = next_chunk()
+                    if chunk:
+                        channel.send((ITEMS,job_id,chunk))
+                        in_flight[channel] += 1
+        finally:
+            # drain replies still on the way so the next loop starts clean
+            for channel, count in in_flight.items():
+                for _ in range(count):
+                    try:
+                        channel.recv()
+                    except (EOFError,OSError):
+                        break
+            for channel in channels:
+                try:
+                    channel.send((END,job_id))
+                except OSError:
+                    pass
+
+    ordered = [outcomes[position] for position in sorted(outcomes)]
+    errors = [(position,error) for position, _, _, error in ordered if error is not None]
+    results = [item_locals for _, _, item_locals, error in ordered if error is None]
+    context = engine.context
+    merge_writes(context,ordered)
+    if errors:
+        raise ForEachError(errors)
+    if results_key is not None:
+        context[results_key] = results
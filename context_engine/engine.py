@@ -1,90 +1,203 @@
 from array import array
+import contextvars
+import copy
+import os
 
 from ctx import Ctx
 import typing as t
 import context_engine.commands.command_map as sys_map
+from .cache import ExpressionCache, expression_cache
+from .plan import Plan, PlanNode, compile_plan, iter_nodes
+from .scope import Scope
+from .views import AttrView
+
+if t.TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from .batch import RunResult
+    from .checkpoint import Checkpointer
+    from .distributed import Transport
+    from .incremental import UnitReport
+    from .profiler import Profiler
+    from .replay import Recorder, ReplayReport
+    from .scheduler import StepScheduler
+    from .spill import SpillStore
 
 F = t.TypeVar("F", bound=t.Callable[..., t.Any])
     
-class Step(Ctx):
-    """Base class for step and flow ops build on ctx dictionary
+class Step():
+    """Base class for step and flow ops. 
+       Fixed slot layout bound to a step document by reference, frames reuse
+       popped instances so pushing a step allocates nothing per iteration.
+       Members of the document not in the layout are readable as attributes,
+       other attributes components set on a step are dropped when it is rebound.
     """
-    def __init__(self,step:t.Dict):
-        # not a flow
-        self.flow = None
-            
-        self.step = None
-        self.expressions = None
-        self.args = None
-        self.locals = Ctx()
+    __slots__ = ("node","fields","flow","step","expressions","args","locals","error","__dict__")
+    
+    def __init__(self,step:t.Union[t.Dict,PlanNode],locals:t.Optional[Ctx]=None):
+        self.bind(step,locals)
+        
+    def bind(self,step:t.Union[t.Dict,PlanNode],locals:t.Optional[Ctx]=None) -> "Step":
+        """Points this step at a step document or compiled plan node.
+        """
+        # compiled steps carry their resolved document
+        if type(step) is PlanNode:
+            self.node = step
+            step = step.fields
+        else:
+            self.node = None
+        
+        self.fields = step
+        self.flow = step.get("flow")
+        self.step = step.get("step")
+        self.expressions = step.get("expressions")
+        self.args = step.get("args")
+        self.locals = Ctx() if locals is None else locals
         self.error = None
+        # attributes set by the components that ran with this instance before
+        extras = self.__dict__
+        if extras:
+            extras.clear()
+        return self
         
-        for k, v in step.items():
-            self[k] = v
+    def __getattr__(self,name):
+        if name == "fields":
+            raise AttributeError(name)
+        try:
+            return self.fields[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        
+    def __getitem__(self,name):
+        return getattr(self,name)
+    
+    def get(self,name:str,default:t.Any=None) -> t.Any:
+        """Reads a member of the step document with a default.
+        """
+        return self.fields.get(name,default)
         
 class Flow(Step):
-    def __init__(self, step:t.Dict):
-        self.conditions = None
-        self.elsesteps = None
-        self.collection = None
-        self.var = None
-        self.fail_on_error = None
-        self.catchsteps = None
-        super().__init__(step)
+    __slots__ = ("conditions","elsesteps","collection","var","fail_on_error","catchsteps","steps")
+    
+    def bind(self,step:t.Union[t.Dict,PlanNode,Step],locals:t.Optional[Ctx]=None) -> "Flow":
+        # flows pushed from a step share the step's document and locals
+        if isinstance(step,Step):
+            locals = step.locals if locals is None else locals
+            step = step.node or step.fields
+        
+        super().bind(step,locals)
+        fields = self.fields
+        self.conditions = fields.get("conditions")
+        self.elsesteps = fields.get("elsesteps")
+        self.collection = fields.get("collection")
+        self.var = fields.get("var")
+        self.fail_on_error = fields.get("fail_on_error")
+        self.catchsteps = fields.get("catchsteps")
+        self.steps = fields.get("steps")
+        return self
         
     def __var_is_list(self):
         return type(self.var) == list
     
     is_var_list:bool = property(__var_is_list)
     
+class FrameState():
+    """Step and flow stacks for one thread of execution.
+    """
+    __slots__ = ("step_stack","flow_stack","step_pool","flow_pool")
+    
+    def __init__(self) -> None:
+        self.step_stack:t.List[Step] = []
+        self.flow_stack:t.List[Flow] = []
+        # popped frames kept for reuse, bounded by the deepest nesting seen
+        self.step_pool:t.List[Step] = []
+        self.flow_pool:t.List[Flow] = []
+    
 class Frame():
+    """Stack frame for engine context.
+       Stacks live in a context variable so threads and tasks that fork the frame
+       get isolated stacks while everything else shares the root stacks.
+    """
     def __init__(self) -> None:
-        self.__step_stack:t.List[Step] = []
-        self.__flow_stack:t.List[Flow] = []
+        self.__root = FrameState()
+        self.__state:contextvars.ContextVar = contextvars.ContextVar(f"frame_{id(self)}")
+        
+    def __get_state(self) -> FrameState:
+        return self.__state.get(self.__root)
+    
+    state:FrameState = property(__get_state)
+    
+    def fork(self,flow:t.Optional["Flow"]=None) -> contextvars.Token:
+        """Switches the calling thread/task to fresh stacks seeded with a copy of flow.
+           Steps run after forking see a scope layered over the flow locals so
+           writes stay isolated from other forks. Pair with join.
+
+        Args:
+            flow (Flow): flow to continue from, defaults to current flow.
+
+        Returns:
+            contextvars.Token : token to hand to join
+        """
+        if flow is None and not self.flow_stack_is_empty:
+            flow = self.current_flow
+        
+        state = FrameState()
+        if flow is not None:
+            forked = Flow(flow,Scope(flow.locals))
+            state.flow_stack.append(forked)
+            state.step_stack.append(Step(forked.node or forked.fields,forked.locals))
+        return self.__state.set(state)
+    
+    def join(self,token:contextvars.Token):
+        """Restores the stacks active before fork.
+        """
+        self.__state.reset(token)
     
     def push_step(self,step) -> Step:
-        ps = Step(step)
-        ps.locals = self.__getLocals(ps)
-        self.__step_stack.append(ps)
+        state = self.__state.get(self.__root)
+        flow_stack = state.flow_stack
+        # if in a step and flow stack not empty link locals with flow
+        locals = flow_stack[-1].locals if flow_stack else None
+        pool = state.step_pool
+        ps = pool.pop().bind(step,locals) if pool else Step(step,locals)
+        state.step_stack.append(ps)
         return ps
         
     def push_flow(self,flow) -> Flow:
-        ps = Flow(flow)
-        ps.locals = self.__getLocals(ps,True)
-        self.__flow_stack.append(ps)
+        state = self.__state.get(self.__root)
+        flow_stack = state.flow_stack
+        # if in a flow block and another flow block is on stack layer a scope over its locals
+        locals = Scope(flow_stack[-1].locals) if flow_stack else None
+        pool = state.flow_pool
+        ps = pool.pop().bind(flow,locals) if pool else Flow(flow,locals)
+        flow_stack.append(ps)
         return ps
     
     def __flow_stack_empty(self):
-        return len(self.__flow_stack) == 0
+        return len(self.__state.get(self.__root).flow_stack) == 0
     
     def __step_stack_empty(self):
-        return len(self.__flow_stack) == 0
+        return len(self.__state.get(self.__root).step_stack) == 0
     
     flow_stack_is_empty:bool = property(__flow_stack_empty)
     step_stack_is_empty:bool = property(__step_stack_empty)
         
-    def __getLocals(self,step,is_flow:bool=False) -> Ctx:
-        # if in a flow block and another flow block is on stack shallow copy locals
-        if is_flow and not self.flow_stack_is_empty:
-            return Ctx(self.current_flow.locals)
-        # if in a step and flow stack not empty link locals with flow
-        elif not is_flow and not self.flow_stack_is_empty:
-            return self.current_flow.locals
-        # use step/flow locals
-        else:
-            return step.locals
-        
     def pop_step(self) -> Step:
-        return self.__step_stack.pop()
+        state = self.__state.get(self.__root)
+        ps = state.step_stack.pop()
+        state.step_pool.append(ps)
+        return ps
         
     def pop_flow(self) -> Flow:
-        return self.__flow_stack.pop()
+        state = self.__state.get(self.__root)
+        ps = state.flow_stack.pop()
+        state.flow_pool.append(ps)
+        return ps
     
     def __get_current_step(self) -> Step:
-        return self.__step_stack[-1]
+        return self.__state.get(self.__root).step_stack[-1]
     
     def __get_current_flow(self) -> Flow:
-        return self.__flow_stack[-1]
+        return self.__state.get(self.__root).flow_stack[-1]
         
     current_step:Step = property(__get_current_step)
     current_flow:Flow = property(__get_current_flow)
@@ -114,14 +227,24 @@ class Context(Ctx):
     Args:
         Ctx (_type_): _description_
     """
-    def __init__(self,frame:"Frame") -> None:
+    def __init__(self,frame:"Frame",parent:t.Optional["Context"]=None) -> None:
         """_summary_
             Do not use. Use factory method.
         Args:
             frame (Frame): stack frame for engine context.
+            parent (Context): context whose expressions are copied instead of 
+                attaching the basic expressions.
         """
         self.__frame = frame
-        sys_map.map_command("expressions",self,self)
+        if parent is None:
+            sys_map.map_command("expressions",self,self)
+        else:
+            from .decorators import Command
+            for name, cmd in parent.items():
+                if isinstance(cmd,Command):
+                    cmd = copy.copy(cmd)
+                    cmd.set_context(self)
+                    self[name] = cmd
         super().__init__()
         
     def __get_current_step(self) -> Step:
@@ -136,20 +259,37 @@ class Context(Ctx):
     def __get_current_locals(self):
         return self.__frame.current_step.locals
     
+    def __get_spill_store(self) -> "SpillStore":
+        store = dict.get(self,"_Context__spill")
+        if store is None:
+            from .spill import default_store
+            store = default_store()
+        return store
+    
     current_step:Step = property(__get_current_step)
     current_flow:Flow = property(__get_current_flow)
     args = property(__get_current_args)
     locals:Ctx = property(__get_current_locals)
+    spill_store:"SpillStore" = property(__get_spill_store)
+    
+    def use_spill_store(self,store:t.Optional["SpillStore"]):
+        """Sets the store lists created by new_spill_list use, see Engine.enable_spill.
+        """
+        self.__spill = store
     
     def eval_expression(self,expression):
         """Executes an expression in the context of this context/engine.
 
+        Source strings are compiled once through the shared expression cache.
+
         Args:
             expression (str): python expression to evaluate
 
         Returns:
             any : result of evaluation
         """
+        if type(expression) is str:
+            expression = expression_cache.compile(expression)
         return eval(expression,globals(),self)
 
 
@@ -176,6 +316,17 @@ class Context(Ctx):
         return decorator
      
 
+class _Registry():
+    """Version of the component and flow tables an engine shares with the
+       engines spawned from it. Registering on any of them bumps it, which
+       drops the compiled plan of all of them.
+    """
+    __slots__ = ("version",)
+
+    def __init__(self) -> None:
+        self.version:int = 0
+
+
 class Engine():
     """ Engine processing class for context engine. 
     It's best to use builder method to construct engine and context at same time.
@@ -183,9 +334,12 @@ class Engine():
     def __init__(
         self,
         context: "Context",
-        frame: "Frame"
+        frame: "Frame",
+        parent: t.Optional["Engine"] = None
         ) -> None:
-        self.steps:t.List[Step] = []
+        self.__registry:_Registry = _Registry() if parent is None else parent.__registry
+        self.__steps:t.List[t.Dict] = []
+        self.plan:t.Optional[Plan] = None
         self.context:Context = context
         self.frame:Frame = frame
         self.has_started:bool = False
@@ -195,9 +349,236 @@ class Engine():
         self.flow_functions: t.Dict[str,"FlowComponent"]=dict()
         self.run_once:bool = False
         self.repeat_run:bool = False
+        self.profiler:t.Optional["Profiler"] = None
+        # loop flows call into it at iteration boundaries when set
+        self.checkpoints:t.Optional["Checkpointer"] = None
+        # runs independent top-level steps concurrently when set
+        self.scheduler:t.Optional["StepScheduler"] = None
+        # workers running "distributed" for each bodies
+        self.workers:t.Optional["Transport"] = None
+        # memory limit of lists created by new_spill_list
+        self.spill:t.Optional["SpillStore"] = None
         
-        sys_map.map_command("flows",self.flow_functions,self.context,self)
-        sys_map.map_command("components",self.step_functions,self.context,self)
+        if parent is None:
+            sys_map.map_command("flows",self.flow_functions,self.context,self)
+            sys_map.map_command("components",self.step_functions,self.context,self)
+        else:
+            # spawned engines share the parent's registry and compiled plan
+            self.step_functions = parent.step_functions
+            self.flow_functions = parent.flow_functions
+            self.__steps = parent.steps
+            self.plan = parent.plan
+            if parent.spill is not None:
+                self.spill = parent.spill
+                context.use_spill_store(parent.spill)
+    
+    def spawn(self) -> t.Tuple["Engine","Context"]:
+        """Creates an engine with a fresh context sharing this engine's components,
+           flows, context expressions and compiled plan. Nothing is re-registered
+           or recompiled, components registered on either engine are visible to both
+           and drop the compiled plan of both so their next run recompiles.
+
+        Returns:
+            (Engine, Context) : spawned engine and its empty context
+        """
+        if self.plan is None:
+            self.compile()
+        frame = Frame()
+        context = Context(frame,self.context)
+        return (Engine(context,frame,self),context)
+    
+    def enable_profiler(self) -> "Profiler":
+        """Attaches a new profiler to the engine and returns it.
+           Only engines with a profiler attached pay for timing.
+        """
+        from .profiler import Profiler
+        self.disable_profiler()
+        return Profiler().attach(self)
+    
+    def disable_profiler(self) -> t.Optional["Profiler"]:
+        """Detaches the current profiler returning it with its collected timings.
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.detach()
+        return profiler
+    
+    def enable_spill(self,memory_limit:int,directory:t.Optional[t.Union[str,os.PathLike]]=None) -> "SpillStore":
+        """Sets how much memory the lists created by new_spill_list on this
+           engine's context may hold together before their oldest items are
+           moved to a temporary file in directory.
+
+        Args:
+            memory_limit (int): bytes of pickled items kept in memory
+            directory (str): where spill files go, the system temp directory by default
+
+        Returns:
+            SpillStore : store shared by the engine's spill lists
+        """
+        from .spill import SpillStore
+        self.spill = SpillStore(memory_limit,directory)
+        self.context.use_spill_store(self.spill)
+        return self.spill
+    
+    def disable_spill(self) -> t.Optional["SpillStore"]:
+        """Lists created afterwards use the default 64MB store, existing lists keep theirs.
+        """
+        store = self.spill
+        self.spill = None
+        self.context.use_spill_store(None)
+        return store
+    
+    def enable_workers(self,transport:"Transport") -> "Transport":
+        """Attaches workers that run for each flows marked "distributed": true.
+           Workers build their engines from the same process and components,
+           see distributed.LocalTransport and distributed.SocketTransport.
+        """
+        self.workers = transport
+        return transport
+    
+    def disable_workers(self) -> t.Optional["Transport"]:
+        transport = self.workers
+        self.workers = None
+        return transport
+    
+    def enable_parallel_steps(self,max_workers:t.Optional[int]=None) -> "StepScheduler":
+        """Runs top-level steps that don't touch the same context keys concurrently.
+           Components take part when they declare reads= and writes=, steps with
+           effects that can't be worked out run alone in document order.
+           Checkpointed runs stay serial.
+
+        Args:
+            max_workers (int): thread pool size
+
+        Returns:
+            StepScheduler : scheduler attached to the engine
+        """
+        from .scheduler import StepScheduler
+        self.scheduler = StepScheduler(max_workers)
+        return self.scheduler
+    
+    def disable_parallel_steps(self) -> t.Optional["StepScheduler"]:
+        scheduler = self.scheduler
+        self.scheduler = None
+        return scheduler
+    
+    def enable_checkpoints(self,directory:t.Union[str,os.PathLike],every:int=1,
+                           loop_every:t.Optional[int]=None) -> "Checkpointer":
+        """Checkpoints runs of this engine into directory so they can be resumed.
+
+        Args:
+            directory (str): checkpoint directory, created on first save
+            every (int): checkpoint before every N top-level steps, 0 for loops only
+            loop_every (int): also checkpoint every N iterations of top-level loops
+
+        Returns:
+            Checkpointer : checkpointer attached to the engine
+        """
+        from .checkpoint import Checkpointer
+        self.checkpoints = Checkpointer(directory,every,loop_every)
+        return self.checkpoints
+    
+    def disable_checkpoints(self) -> t.Optional["Checkpointer"]:
+        checkpoints = self.checkpoints
+        self.checkpoints = None
+        return checkpoints
+    
+    def resume(self,checkpoint:t.Union[str,os.PathLike]):
+        """Continues a process from the latest checkpoint in directory checkpoint.
+           The engine needs the same process and components as the one that wrote
+           it, saved context values are restored before running. Checkpointing
+           continues into the same directory when enabled.
+
+        Raises:
+            CheckpointError: no readable checkpoint in the directory or one
+                taken with a different process or components
+        """
+        from .checkpoint import Checkpointer
+        self.has_started = True
+        if self.plan is None:
+            self.compile()
+        checkpoints = self.checkpoints
+        if checkpoints is None or checkpoints.directory != os.fspath(checkpoint):
+            # resume without checkpointing further
+            checkpoints = Checkpointer(checkpoint,every=0)
+            self.checkpoints, previous = checkpoints, self.checkpoints
+            try:
+                checkpoints.resume(self)
+            finally:
+                self.checkpoints = previous
+        else:
+            checkpoints.resume(self)
+    
+    def run_incremental(self,state:t.Union[str,os.PathLike]) -> t.List["UnitReport"]:
+        """Runs the process skipping top-level and block steps whose inputs are
+           unchanged since the run that wrote state, their recorded outputs are
+           restored instead. See incremental.Incremental.
+
+        Args:
+            state (str): state file, created or replaced after the run
+
+        Returns:
+            List[UnitReport] : which steps ran or were skipped and why
+        """
+        from .incremental import Incremental
+        return Incremental(state).run(self)
+    
+    def run_recorded(self,trace:t.Union[str,os.PathLike]) -> "Recorder":
+        """Runs the process recording every component and expression call to
+           trace, see replay.Recorder.
+
+        Args:
+            trace (str): trace file, created or replaced
+
+        Returns:
+            Recorder : how many calls were recorded and the time they took
+        """
+        from .replay import Recorder
+        recorder = Recorder(os.fspath(trace)).attach(self)
+        try:
+            self.run()
+        finally:
+            recorder.detach()
+        return recorder
+    
+    def run_replay(self,trace:t.Union[str,os.PathLike],check_inputs:bool=False) -> "ReplayReport":
+        """Runs the process substituting the calls recorded in trace by
+           run_recorded for the real ones, see replay.Replayer.
+
+        Args:
+            trace (str): trace file written by run_recorded
+            check_inputs (bool): count calls reading different context values than recorded
+
+        Returns:
+            ReplayReport : engine overhead against recorded command time
+        """
+        from .replay import Replayer
+        replayer = Replayer(os.fspath(trace),check_inputs).attach(self)
+        try:
+            self.run()
+        finally:
+            replayer.detach()
+        return replayer.report
+    
+    def run_many(self,inputs:t.Iterable[t.Mapping],workers:t.Optional[int]=None,mode:str="thread") -> t.List["RunResult"]:
+        """Runs the process once per input on spawned engines.
+           Each input seeds a fresh context. thread mode suits I/O bound components,
+           process mode shards inputs across forked worker processes for CPU bound
+           work and returns plain copies of each context.
+
+        Args:
+            inputs (Iterable[Mapping]): values seeding each run's context
+            workers (int): pool size, 1 runs serially in this thread
+            mode (str): "thread" or "process"
+
+        Returns:
+            List[RunResult] : context and error of each run in input order
+
+        Raises:
+            ValueError: unknown mode, or process mode where fork isn't available
+        """
+        from .batch import run_many
+        return run_many(self,inputs,workers,mode)
         
     
     def __is_finished__(self):
@@ -205,29 +586,129 @@ class Engine():
     
     is_finished:bool = property(__is_finished__)
     
+    def __get_expression_cache(self) -> ExpressionCache:
+        return expression_cache
+    
+    # shared compiled expression cache, hits/misses/evictions counters live here
+    expression_cache:ExpressionCache = property(__get_expression_cache)
+    
+    def __get_cache_stats(self) -> t.Dict[str,t.Dict[str,int]]:
+        from .decorators import Command
+        stats = {}
+        for name, cmd in self.step_functions.items():
+            if cmd.result_cache is not None:
+                stats[name] = cmd.result_cache.stats
+        for name, value in self.context.items():
+            if isinstance(value,Command) and value.result_cache is not None:
+                stats[name] = value.result_cache.stats
+        if self.plan is not None:
+            for node in iter_nodes(self.plan):
+                if node.cache is not None and node.cache is not node.component.result_cache:
+                    stats[node.path] = node.cache.stats
+        return stats
+    
+    # result cache statistics of memoized components and expressions by name
+    # and of steps with their own "cache" by plan path
+    cache_stats:t.Dict[str,t.Dict[str,int]] = property(__get_cache_stats)
+    
+    def __get_steps(self) -> t.List[t.Dict]:
+        return self.__steps
+    
+    def __set_steps(self,steps:t.List[t.Dict]):
+        self.__steps = steps
+        self.plan = None
+    
+    # process document steps, replacing them drops the compiled plan
+    steps:t.List[t.Dict] = property(__get_steps,__set_steps)
+    
+    def __get_plan(self) -> t.Optional[Plan]:
+        if self.__plan_version != self.__registry.version:
+            return None
+        return self.__plan
+    
+    def __set_plan(self,plan:t.Optional[Plan]):
+        self.__plan = plan
+        self.__plan_version = self.__registry.version
+    
+    # compiled process, None when not compiled yet or a component or flow was
+    # registered on this engine, its parent or an engine spawned from either since
+    plan:t.Optional[Plan] = property(__get_plan,__set_plan)
+    
+    def compile(self) -> Plan:
+        """Compiles engine steps into an immutable plan.
+           Components, flow handlers and expressions are resolved once so repeated
+           runs and loop bodies skip all name lookups. Registering components after
+           compiling drops the plan and it is rebuilt on next run.
+
+        Raises:
+            CompileError: unknown step or flow names and expression syntax errors.
+
+        Returns:
+            Plan : compiled process
+        """
+        self.plan = compile_plan(self.steps,self)
+        return self.plan
+    
     def run(self):
         # while not( self.is_finished and self.is_error and self.halt) and len(self.steps) > 0:
         self.has_started = True
-        # (  for step in self.steps)
         
-        self.do_steps(self.steps)
+        if self.plan is None:
+            self.compile()
+        
+        if self.checkpoints is not None:
+            self.checkpoints.run(self)
+        elif self.scheduler is not None:
+            self.scheduler.run(self)
+        else:
+            self.do_steps(self.plan)
+    
+    async def run_async(self,executor:t.Optional["Executor"]=None):
+        """Runs the process without blocking the running event loop.
+           Steps execute on an executor thread, components and expressions defined
+           with async def are awaited on the calling loop so they can share its
+           resources. Sync components run unchanged on the executor thread.
+
+        Args:
+            executor (Executor): executor running the steps, defaults to the loop's.
+        """
+        import asyncio
+        from .decorators import event_loop
+        loop = asyncio.get_running_loop()
+        run_context = contextvars.copy_context()
+        run_context.run(event_loop.set,loop)
+        await loop.run_in_executor(executor,run_context.run,self.run)
+        
+    def do_steps(self,list_steps:t.Union[Plan,t.List]):
+        # raw step lists from custom flows are compiled on the fly
+        if type(list_steps) is not Plan:
+            list_steps = compile_plan(list_steps,self)
         
-    def do_steps(self,list_steps:t.List):
-        all( self.do_step(self.frame.push_step(step)) or True for step in list_steps)
+        push_step = self.frame.push_step
+        do_step = self.do_step
+        for node in list_steps.nodes:
+            do_step(push_step(node))
         
     def do_step(self,step:Step):
-        # Is flow step?
-        if step.flow is not None:
-            self.do_flow(step)
-        else:
-            # Do we have an expression?
-            if step.expressions is not None:
-                self.eval_step_expressions(step.expressions)
-            # if step present run engine component code.
-            if step.step is not None:
-                # test for missing step   
-                self.step_functions[step.step]()
-                
+        node = step.node
+        try:
+            # Is flow step?
+            if node.flow_function is not None:
+                self.do_flow(step)
+            else:
+                # Do we have an expression?
+                if node.expressions is not None:
+                    self.eval_step_expressions(node.expressions)
+                # if step present run engine component code.
+                component = node.component
+                if component is not None:
+                    if node.cache is None:
+                        value = component.invoke(self)
+                    else:
+                        value = component.invoke_cached(self,node.cache)
+                    if node.result is not None:
+                        node.result.set(self.context,value)
+        finally:
             self.frame.pop_step()
             
     def eval_step_expressions(self,expression_list):
@@ -239,30 +720,34 @@ class Engine():
     def do_flow(self,flow_step):
         """Base processing for flow step blocks.
         """
-        flow_step = self.frame.push_flow(flow_step)
-        
-        # Flow step expressions are executed once before flow logic so no
-        # access to loop variables useful for setting up locals for processing.
-        flow_step.expressions and self.eval_step_expressions(flow_step.expressions)
+        node = flow_step.node
+        step = flow_step
+        flow_step = self.frame.push_flow(step)
+        # flow logic writes loop variables through context.locals
+        step.locals = flow_step.locals
         
-        for flow_logic in self.get_flow_function_for_flow(flow_step):
-            flow_logic(flow_step)
-                 
-        self.frame.pop_flow()
+        try:
+            # Flow step expressions are executed once before flow logic so no
+            # access to loop variables useful for setting up locals for processing.
+            node.expressions and self.eval_step_expressions(node.expressions)
+            
+            node.flow_function.invoke(self,flow_step)
+        finally:
+            self.frame.pop_flow()
                 
     def evaluate_flow_conditions(self,flow_step) -> bool:         
         return all(( self.context.eval_expression(condition) for condition in flow_step.conditions))
     
             
     def increment_loop_counter(self,flow_step:Flow):
-        if flow_step.var in self.context.locals.keys():
+        if flow_step.var in self.context.locals:
             self.set_local(flow_step.var,self.context.locals[flow_step.var] + 1)
         else:
             self.set_local(flow_step.var,0)
         
     def set_local(self,var_name:str,value:any):
         if type(value) is dict:
-            self.context.locals[var_name] = Ctx(value)
+            self.context.locals[var_name] = AttrView(value)
         else:
             self.context.locals[var_name] = value       
         
@@ -280,6 +765,7 @@ class Engine():
             self.step_functions[cmd.name] = cmd
             cmd.set_context(self.context)
             cmd.set_engine(self)
+            self.__registry.version += 1
             return cmd
         return decorator
     
@@ -296,14 +782,19 @@ class Engine():
             cmd = flow_component(*args, **kwargs)(f)
             self.flow_functions[cmd.name] = cmd
             cmd.set_engine(self)
+            self.__registry.version += 1
             return cmd
         return decorator
         
     
-def init_engine(processJSON:t.Dict=None):
+def init_engine(processJSON:t.Union[t.Dict,str,"os.PathLike"]=None):
     """Builds Engine and Context objects.
         Attaches basic context expressions. Add more specific engine components and expressions
         to objects returned from this function.
+        
+        processJSON can also be the path of a JSON/JSONC process document, it is
+        loaded through the on disk document cache so parsing and validation only
+        happen once per document content.
     """
     # create and link frame and context
     frame = Frame()
@@ -313,6 +804,9 @@ def init_engine(processJSON:t.Dict=None):
     engine = Engine(context,frame)
                        
     # set engine steps to process section of json file
+    if isinstance(processJSON,(str,os.PathLike)):
+        from .loader import load_process
+        processJSON = load_process(processJSON)
     if processJSON is not None: 
         engine.steps = processJSON["process"]
          
@@ -0,0 +1,508 @@
+import builtins
+from contextlib import contextmanager
+import contextvars
+import hashlib
+import json
+import os
+import pickle
+import re
+import tempfile
+import threading
+import typing as t
+
+from . import engine as engine_module
+from .decorators import Command
+from .engine import Context
+from .plan import STEP_BLOCKS, Plan, PlanNode, iter_nodes
+from .views import AttrView
+
+# bump when the state file layout changes
+STATE_FORMAT = 1
+
+# fingerprint of a key that is not on the context
+MISSING = "-"
+
+# pseudo key for the locals a unit shares with the rest of its block
+LOCALS = "<locals>"
+
+# names an expression can resolve outside the context, only tracked when on it
+_GLOBAL_NAMES = frozenset(vars(builtins)) | frozenset(vars(engine_module))
+
+
+class UnitReport():
+    """Whether one step ran or was skipped by an incremental run and why.
+    """
+    __slots__ = ("path","name","skipped","reason")
+
+    def __init__(self, path:str, name:t.Optional[str], skipped:bool, reason:str) -> None:
+        self.path = path
+        self.name = name
+        self.skipped = skipped
+        self.reason = reason
+
+    def __repr__(self) -> str:
+        status = "skipped" if self.skipped else "ran"
+        return f"<UnitReport {self.path} {self.name} {status}: {self.reason}>"
+
+
+class _Recorder():
+    """Keys read and written by the unit currently running.
+    """
+    __slots__ = ("context","locals","locals_fingerprint","inputs","written","all_keys",
+                 "fingerprintable","fingerprints","outer")
+
+    def __init__(self, context:Context, locals:t.Mapping, outer:t.Optional["_Recorder"]=None,
+                 fingerprints:bool=True) -> None:
+        self.context = context
+        # recorder this one is nested in, it sees the same accesses
+        self.outer = outer
+        # False only records the names of the keys read, inputs map them to None
+        self.fingerprints = fingerprints
+        # locals of the unit step as they were when it started
+        self.locals = locals
+        self.locals_fingerprint = fingerprint(dict(locals)) if fingerprints else None
+        self.inputs:t.Dict[str,t.Optional[str]] = {}
+        self.written:t.Set[str] = set()
+        self.all_keys:bool = False
+        self.fingerprintable:bool = True
+
+    def read(self, key:t.Any):
+        if key in self.inputs or key in self.written or type(key) is not str:
+            return
+        if key == "locals":
+            if LOCALS not in self.inputs:
+                self.inputs[LOCALS] = self.locals_fingerprint
+                self.fingerprintable = self.fingerprintable and self.locals_fingerprint is not None
+            return
+        if key.startswith("_Context__"):
+            return
+        if not self.fingerprints:
+            self.inputs[key] = None
+            self.fingerprintable = False
+            return
+        if dict.__contains__(self.context,key):
+            value = dict.__getitem__(self.context,key)
+            if isinstance(value,Command):
+                return
+        elif key in _GLOBAL_NAMES or hasattr(Context,key):
+            return
+        else:
+            self.inputs[key] = MISSING
+            return
+        digest = fingerprint(value)
+        if digest is None:
+            self.fingerprintable = False
+        self.inputs[key] = digest
+
+    def write(self, key:t.Any):
+        if type(key) is str:
+            self.written.add(key)
+
+
+# recorders of the units running in this thread or task, innermost first.
+# Worker threads of parallel flows start from a copy so their accesses count
+# for the unit too, other threads and engines are not affected.
+_active:contextvars.ContextVar = contextvars.ContextVar("context_engine_recorder",default=None)
+
+# id of each tracked context -> [recorders using it, class to restore]
+_tracked:t.Dict[int,t.List] = {}
+_tracked_lock = threading.Lock()
+
+
+def _read(context:Context, key:t.Any):
+    recorder = _active.get()
+    while recorder is not None:
+        if recorder.context is context:
+            recorder.read(key)
+        recorder = recorder.outer
+
+
+def _write(context:Context, key:t.Any):
+    recorder = _active.get()
+    while recorder is not None:
+        if recorder.context is context:
+            recorder.write(key)
+        recorder = recorder.outer
+
+
+def _read_all(context:Context):
+    recorder = _active.get()
+    while recorder is not None:
+        if recorder.context is context:
+            recorder.all_keys = True
+        recorder = recorder.outer
+
+
+class TrackingContext(Context):
+    """Context class swapped in while an incremental unit runs.
+
+       Same layout as Context so an instance's class can be switched in place,
+       every key access reports to the recorders active in the calling thread
+       or task before the normal lookup.
+    """
+    def __getitem__(self, key):
+        _read(self,key)
+        return super().__getitem__(key)
+
+    def __getattr__(self, name):
+        _read(self,name)
+        return super().__getattr__(name)
+
+    def __contains__(self, key):
+        _read(self,key)
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        _read(self,key)
+        return super().get(key, default)
+
+    def __setitem__(self, key, value):
+        _write(self,key)
+        super().__setitem__(key, value)
+
+    def __setattr__(self, name, value):
+        _write(self,name)
+        super().__setattr__(name, value)
+
+    def __delitem__(self, key):
+        _write(self,key)
+        super().__delitem__(key)
+
+    def __delattr__(self, name):
+        _write(self,name)
+        super().__delattr__(name)
+
+    def pop(self, key, *default):
+        _write(self,key)
+        return super().pop(key, *default)
+
+    def setdefault(self, key, default=None):
+        _read(self,key)
+        _write(self,key)
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        for key in dict(*args, **kwargs):
+            _write(self,key)
+        super().update(*args, **kwargs)
+
+    def keys(self):
+        _read_all(self)
+        return super().keys()
+
+    def items(self):
+        _read_all(self)
+        return super().items()
+
+    def values(self):
+        _read_all(self)
+        return super().values()
+
+    def __iter__(self):
+        _read_all(self)
+        return super().__iter__()
+
+    def __get_current_locals(self):
+        _read(self,"locals")
+        return Context.locals.fget(self)
+
+    locals = property(__get_current_locals)
+
+
+@contextmanager
+def tracking(context:Context, locals:t.Mapping, fingerprints:bool=True) -> t.Iterator[_Recorder]:
+    """Records the keys read and written on context by the calling thread or
+       task (and threads it starts for parallel flows) inside the with block.
+       Blocks can be nested and run concurrently, each gets its own recorder.
+       With fingerprints False only key names are recorded and values read
+       aren't pickled, changes() can't be used then.
+    """
+    recorder = _Recorder(context,locals,_active.get(),fingerprints)
+    token = _active.set(recorder)
+    with _tracked_lock:
+        entry = _tracked.get(id(context))
+        if entry is None:
+            _tracked[id(context)] = [1,type(context)]
+            # Ctx turns attribute assignment into items so the class is set directly
+            object.__setattr__(context,"__class__",TrackingContext)
+        else:
+            entry[0] += 1
+    try:
+        yield recorder
+    finally:
+        _active.reset(token)
+        with _tracked_lock:
+            entry = _tracked[id(context)]
+            entry[0] -= 1
+            if not entry[0]:
+                del _tracked[id(context)]
+                object.__setattr__(context,"__class__",entry[1])
+
+
+def changes(context:Context, recorder:_Recorder) -> t.Optional[t.Dict]:
+    """Inputs (key fingerprints) and outputs (pickled values of keys written or
+       changed in place, keys deleted) of a tracked block, None when some of
+       them can't be pickled.
+    """
+    inputs = recorder.inputs
+    if recorder.all_keys:
+        for key in _context_keys(context):
+            if key not in inputs and key not in recorder.written:
+                inputs[key] = fingerprint(dict.__getitem__(context,key))
+    if not recorder.fingerprintable or None in inputs.values():
+        return None
+
+    outputs = {}
+    deleted = []
+    for key in set(inputs) | recorder.written:
+        if key == LOCALS:
+            value = dict(recorder.locals)
+        elif dict.__contains__(context,key):
+            value = dict.__getitem__(context,key)
+            if isinstance(value,Command):
+                continue
+        else:
+            if key in recorder.written:
+                deleted.append(key)
+            continue
+        try:
+            data = pickle.dumps(value,protocol=4)
+        except Exception:
+            return None
+        if key in recorder.written or _digest(data,value) != inputs.get(key):
+            outputs[key] = data
+    return {"inputs":inputs,"outputs":outputs,"deleted":deleted}
+
+
+def apply_changes(context:Context, outputs:t.Mapping[str,bytes], deleted:t.Iterable[str]):
+    """Writes outputs collected by changes back into context.
+    """
+    for key, data in outputs.items():
+        value = pickle.loads(data)
+        if key == LOCALS:
+            context.current_step.locals.update(value)
+        else:
+            context[key] = value
+    for key in deleted:
+        context.pop(key,None)
+
+
+def fingerprint(value:t.Any) -> t.Optional[str]:
+    """Hash of the pickled value, None when it can't be pickled. Equal values
+       give the same hash in every process, set members are hashed in a
+       canonical order rather than the per-process hash order.
+    """
+    try:
+        return _digest(pickle.dumps(value,protocol=4),value)
+    except Exception:
+        return None
+
+
+def _digest(data:bytes, value:t.Any) -> str:
+    # data is value pickled, it is pickled again in canonical form when it has sets
+    if _SET_OPCODES[0] in data or _SET_OPCODES[1] in data:
+        data = pickle.dumps(canonical(value),protocol=4)
+    return hashlib.blake2b(data,digest_size=16).hexdigest()
+
+
+# EMPTY_SET and FROZENSET, sets pickle through one of them at protocol 4
+_SET_OPCODES = (pickle.EMPTY_SET,pickle.FROZENSET)
+# memory addresses in default reprs
+_ADDRESS = re.compile(r" at 0x[0-9a-fA-F]+")
+
+
+def canonical(value:t.Any) -> t.Any:
+    """Value with every set, at any depth of builtin containers, replaced by
+       its members sorted by their pickle (repr without addresses when they
+       can't be pickled), so it pickles the same way in every process.
+    """
+    kind = type(value)
+    if kind is set or kind is frozenset:
+        return ("<" + kind.__name__ + ">",sorted((canonical(member) for member in value),key=_sort_key))
+    if kind is list or kind is tuple:
+        return kind(canonical(item) for item in value)
+    if isinstance(value,(dict,AttrView)):
+        return ("<" + kind.__name__ + ">",[(canonical(key),canonical(item)) for key, item in value.items()])
+    return value
+
+
+def _sort_key(value:t.Any) -> bytes:
+    try:
+        return pickle.dumps(value,protocol=4)
+    except Exception:
+        return _ADDRESS.sub("",repr(value)).encode("utf-8","backslashreplace")
+
+
+def node_fingerprint(node:PlanNode) -> str:
+    """Hash of a step document and the code of every component it runs, so
+       editing the process or a component invalidates recorded outputs.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps(node.source,sort_keys=True,default=repr).encode("utf-8"))
+    for each in _nodes_of(node):
+        component = each.component or each.flow_function
+        code = getattr(getattr(component,"command",None),"__code__",None)
+        if code is not None:
+            digest.update(code.co_code)
+            digest.update(repr(code.co_consts).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _nodes_of(node:PlanNode) -> t.Iterator[PlanNode]:
+    yield node
+    for block in STEP_BLOCKS:
+        nested = node.fields.get(block)
+        if type(nested) is Plan:
+            yield from iter_nodes(nested)
+
+
+class Incremental():
+    """Runs a process skipping steps whose inputs did not change since the last run.
+
+       Steps of the top-level process list and of block flows (at any depth of
+       blocks) are units. While a unit runs the context records which keys it
+       reads and writes, values read before being written are its inputs and
+       keys written, or read and changed in place, are its outputs. Inputs are
+       fingerprinted by hashing their pickled value and outputs are stored in
+       the state file. On the next run a unit whose document, component code and
+       input fingerprints all match is skipped and its outputs are restored.
+
+       Units whose inputs can't be pickled always run. A step with
+       "incremental": false always runs, use it for steps with effects outside
+       the context or results that depend on time or randomness.
+    """
+    def __init__(self, state:t.Union[str,os.PathLike]) -> None:
+        self.state:str = os.fspath(state)
+        self.report:t.List[UnitReport] = []
+        self.__records:t.Dict[str,t.Dict] = {}
+        self.__units:t.Dict[str,PlanNode] = {}
+
+    def run(self, engine) -> t.List[UnitReport]:
+        """Runs engine's process incrementally and saves the new state.
+
+        Returns:
+            List[UnitReport] : one entry per unit in execution order
+        """
+        if engine.plan is None:
+            engine.compile()
+        self.report = []
+        self.__units = dict(_units(engine.plan))
+        self.__records = self.load()
+        records = self.__records
+        self.__records = {}
+
+        # an override already on the instance (the profiler's) is wrapped and put back
+        previous = engine.__dict__.get("do_step")
+        do_step = engine.do_step
+        def incremental_do_step(step):
+            node = step.node
+            if node is None or node.path not in self.__units:
+                return do_step(step)
+            return self.do_unit(engine,step,do_step,records.get(node.path))
+
+        engine.do_step = incremental_do_step
+        try:
+            # units are tracked one at a time so steps always run serially here
+            engine.has_started = True
+            engine.do_steps(engine.plan)
+        finally:
+            if previous is None:
+                engine.__dict__.pop("do_step",None)
+            else:
+                engine.do_step = previous
+            self.save()
+        return self.report
+
+    def do_unit(self, engine, step, do_step, record:t.Optional[t.Dict]):
+        node = step.node
+        context = engine.context
+        source = node_fingerprint(node)
+
+        name = node.step or node.flow
+        reason = self.stale_reason(context,node,source,record)
+        if reason is None:
+            try:
+                self.restore(context,record)
+            finally:
+                engine.frame.pop_step()
+            self.__records[node.path] = record
+            self.report.append(UnitReport(node.path,name,True,"inputs unchanged"))
+            return
+        if node.source.get("incremental") is False:
+            do_step(step)
+            self.report.append(UnitReport(node.path,name,False,reason))
+            return
+
+        with tracking(context,step.locals) as recorder:
+            do_step(step)
+        record = self.record(context,recorder,source)
+        if record is not None:
+            self.__records[node.path] = record
+        self.report.append(UnitReport(node.path,name,False,reason))
+
+    def stale_reason(self, context:Context, node:PlanNode, source:str,
+                     record:t.Optional[t.Dict]) -> t.Optional[str]:
+        """Why the unit has to run, None when it can be skipped.
+        """
+        if node.source.get("incremental") is False:
+            return "incremental disabled"
+        if record is None:
+            return "no previous run"
+        if record["source"] != source:
+            return "step or component changed"
+        changed = [key for key, digest in record["inputs"].items()
+                   if _current_fingerprint(context,key) != digest]
+        changed = ["locals" if key == LOCALS else key for key in changed]
+        if changed:
+            return "inputs changed: " + ", ".join(sorted(changed))
+        return None
+
+    def record(self, context:Context, recorder:_Recorder, source:str) -> t.Optional[t.Dict]:
+        record = changes(context,recorder)
+        if record is not None:
+            record["source"] = source
+        return record
+
+    def restore(self, context:Context, record:t.Dict):
+        apply_changes(context,record["outputs"],record["deleted"])
+
+    def load(self) -> t.Dict[str,t.Dict]:
+        try:
+            with open(self.state,"rb") as source:
+                state = pickle.load(source)
+        except (OSError,EOFError,pickle.UnpicklingError):
+            return {}
+        if state.get("format") != STATE_FORMAT:
+            return {}
+        return state["units"]
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.state))
+        os.makedirs(directory,exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory,suffix=".tmp")
+        with os.fdopen(fd,"wb") as out:
+            pickle.dump({"format":STATE_FORMAT,"units":self.__records},out,protocol=4)
+        os.replace(temp_path,self.state)
+
+
+def _units(plan:Plan) -> t.Iterator[t.Tuple[str,PlanNode]]:
+    # block flows are containers, their steps are the units
+    for node in plan:
+        if node.flow == "block" and type(node.fields.get("steps")) is Plan:
+            yield from _units(node.fields["steps"])
+        else:
+            yield node.path, node
+
+
+def _context_keys(context:Context) -> t.Iterator[str]:
+    for key, value in dict.items(context):
+        if type(key) is str and not key.startswith("_Context__") and not isinstance(value,Command):
+            yield key
+
+
+def _current_fingerprint(context:Context, key:str) -> t.Optional[str]:
+    if key == LOCALS:
+        return fingerprint(dict(context.current_step.locals))
+    if not dict.__contains__(context,key):
+        return MISSING
+    return fingerprint(dict.__getitem__(context,key))
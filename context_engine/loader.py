@@ -0,0 +1,174 @@
+import hashlib
+import json
+import marshal
+import os
+import re
+import sys
+import tempfile
+import typing as t
+
+# strings are matched first so comment markers and commas inside them are kept
+_COMMENTS = re.compile(r'"(?:\\.|[^"\\])*"|//[^\n]*|/\*.*?\*/',re.S)
+_TRAILING_COMMAS = re.compile(r'"(?:\\.|[^"\\])*"|,(?=\s*[\]}])',re.S)
+
+# bump when validation rules or the cached layout change
+CACHE_FORMAT = 2
+
+# members every built-in flow needs, custom flows are only checked for nested steps
+FLOW_REQUIREMENTS = {
+    "block": ("steps",),
+    "do while": ("conditions","steps"),
+    "for each": ("collection","steps"),
+    "if": ("conditions","steps"),
+    "map": ("collection","expression"),
+    "parallel for each": ("collection","steps"),
+    "try": ("steps",),
+    "while": ("conditions","steps"),
+}
+STEP_BLOCKS = ("steps","elsesteps","catchsteps")
+
+
+class ProcessValidationError(ValueError):
+    """Raised when a process document is not structurally valid.
+    """
+    def __init__(self, message:str, path:str) -> None:
+        self.path = path
+        super().__init__(f"{path}: {message}")
+
+
+def parse_jsonc(text:str) -> t.Any:
+    """Parses JSON allowing // and /* */ comments and trailing commas as used in
+       the process documents of the readme.
+    """
+    text = _COMMENTS.sub(_keep_strings,text)
+    text = _TRAILING_COMMAS.sub(_keep_strings,text)
+    return json.loads(text)
+
+
+def _keep_strings(match) -> str:
+    token = match.group(0)
+    return token if token.startswith('"') else ""
+
+
+def validate_process(document:t.Any) -> t.Dict:
+    """Checks a process document has a process list of well formed steps.
+
+    Raises:
+        ProcessValidationError: first problem found with its document path
+
+    Returns:
+        dict : document
+    """
+    if not isinstance(document,dict) or not isinstance(document.get("process"),list):
+        raise ProcessValidationError("document needs a process list","process")
+    _validate_steps(document["process"],"process")
+    return document
+
+
+def _validate_steps(steps:t.Any, path:str):
+    if not isinstance(steps,list):
+        raise ProcessValidationError("expected a list of steps",path)
+    for i, step in enumerate(steps):
+        _validate_step(step,f"{path}[{i}]")
+
+
+def _validate_step(step:t.Any, path:str):
+    if not isinstance(step,dict):
+        raise ProcessValidationError("step must be an object",path)
+    for member in ("expressions","conditions"):
+        expressions = step.get(member)
+        if expressions is not None and (not isinstance(expressions,list)
+                                        or not all(isinstance(x,str) for x in expressions)):
+            raise ProcessValidationError(f"{member} must be a list of strings",f"{path}.{member}")
+
+    cache = step.get("cache")
+    if cache is not None and not isinstance(cache,(bool,dict)):
+        raise ProcessValidationError("cache must be true, false or an object",f"{path}.cache")
+    if step.get("result") is not None and not isinstance(step["result"],str):
+        raise ProcessValidationError("result must be a context path",f"{path}.result")
+
+    flow = step.get("flow")
+    if flow is None:
+        if step.get("step") is not None and not isinstance(step["step"],str):
+            raise ProcessValidationError("step name must be a string",f"{path}.step")
+        return
+    if not isinstance(flow,str):
+        raise ProcessValidationError("flow name must be a string",f"{path}.flow")
+    for member in FLOW_REQUIREMENTS.get(flow,()):
+        if step.get(member) is None:
+            raise ProcessValidationError(f"{flow} flow requires {member}",path)
+    for block in STEP_BLOCKS:
+        if step.get(block) is not None:
+            _validate_steps(step[block],f"{path}.{block}")
+
+
+def default_cache_dir() -> str:
+    """CONTEXT_ENGINE_CACHE_DIR or context_engine under the user cache directory.
+    """
+    configured = os.environ.get("CONTEXT_ENGINE_CACHE_DIR")
+    if configured:
+        return configured
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"),".cache")
+    return os.path.join(base,"context_engine")
+
+
+# documents already loaded by this process keyed by (path, mtime, size)
+_loaded:t.Dict[t.Tuple[str,int,int],t.Dict] = {}
+
+def load_process(path:t.Union[str,os.PathLike], cache_dir:t.Optional[str]=None,
+                 use_cache:bool=True) -> t.Dict:
+    """Loads, validates and caches a JSON or JSONC process document.
+
+       The validated document is stored on disk in marshal format keyed by a hash
+       of the file content so later loads, in any process, skip parsing and
+       validation. Loads within one process return the same document object
+       while the file is unchanged, treat it as read only.
+
+    Args:
+        path (str): process document path
+        cache_dir (str): cache directory, defaults to default_cache_dir()
+        use_cache (bool): False always parses and validates
+
+    Raises:
+        ProcessValidationError: document is not structurally valid
+
+    Returns:
+        dict : process document
+    """
+    if not use_cache:
+        with open(path,encoding="utf-8") as source:
+            return validate_process(parse_jsonc(source.read()))
+
+    stat = os.stat(path)
+    memo_key = (os.path.realpath(path),stat.st_mtime_ns,stat.st_size)
+    document = _loaded.get(memo_key)
+    if document is not None:
+        return document
+
+    with open(path,"rb") as source:
+        content = source.read()
+    digest = hashlib.sha256(content).hexdigest()
+    cache_path = os.path.join(cache_dir or default_cache_dir(),
+                              f"{digest}-{CACHE_FORMAT}-py{sys.version_info[0]}{sys.version_info[1]}.marshal")
+    try:
+        with open(cache_path,"rb") as cached:
+            document = marshal.load(cached)
+    except (OSError,EOFError,ValueError,TypeError):
+        document = validate_process(parse_jsonc(content.decode("utf-8")))
+        _store(cache_path,document)
+
+    _loaded[memo_key] = document
+    return document
+
+
+def _store(cache_path:str, document:t.Dict):
+    # cache is an optimization, unwritable locations just skip it
+    try:
+        directory = os.path.dirname(cache_path)
+        os.makedirs(directory,exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory,suffix=".tmp")
+        with os.fdopen(fd,"wb") as out:
+            marshal.dump(document,out)
+        os.replace(temp_path,cache_path)
+    except (OSError,ValueError):
+        pass
@@ -0,0 +1,159 @@
+from functools import lru_cache
+import re
+import typing as t
+
+# dotted names and [index] / [*] selectors
+_TOKENS = re.compile(r"([^.\[\]]+)|\[(-?\d+|\*)\]|(\.)")
+
+
+class PathError(ValueError):
+    """Raised when a path string can not be parsed.
+    """
+    def __init__(self, message:str, path:str) -> None:
+        self.path = path
+        super().__init__(f"{path}: {message}")
+
+
+class _Wildcard():
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "*"
+
+# path segment selecting every item of a list
+WILDCARD = _Wildcard()
+
+
+class Path():
+    """Compiled dotted path such as project.dirs[3].name or items[*].id.
+
+       The path string is parsed once into a tuple of keys, names are looked up
+       as items, [n] indexes sequences and [*] projects the rest of the path
+       over every item. Objects that are not subscriptable by name fall back to
+       attribute access.
+    """
+    __slots__ = ("source","keys","wildcard")
+
+    def __init__(self, source:str, keys:t.Tuple) -> None:
+        self.source:str = source
+        self.keys:t.Tuple = keys
+        self.wildcard:bool = any(key is WILDCARD for key in keys)
+
+    def get(self, root:t.Any) -> t.Any:
+        """Returns the value at the path, a list for wildcard paths.
+        """
+        if not self.wildcard:
+            value = root
+            for key in self.keys:
+                value = _get(value,key)
+            return value
+        return _project(root,self.keys,0)
+
+    def set(self, root:t.Any, value:t.Any):
+        """Sets value at the path, wildcard paths set it on every match.
+        """
+        *parents, last = self.keys
+        if not self.wildcard:
+            target = root
+            for key in parents:
+                target = _get(target,key)
+            _set(target,last,value)
+            return
+        for target in _targets(root,parents,0):
+            _set(target,last,value)
+
+    def set_each(self, root:t.Any, values:t.Iterable):
+        """Bulk set, assigns values one per wildcard match in order.
+
+        Raises:
+            ValueError: number of values differs from number of matches
+        """
+        *parents, last = self.keys
+        targets = list(_targets(root,parents,0))
+        values = list(values)
+        if last is WILDCARD:
+            targets = [(target,index) for target in targets for index in range(len(target))]
+        else:
+            targets = [(target,last) for target in targets]
+        if len(targets) != len(values):
+            raise ValueError(f"{self.source}: {len(values)} values for {len(targets)} matches")
+        for (target,key), value in zip(targets,values):
+            _set(target,key,value)
+
+    def __repr__(self) -> str:
+        return f"<Path {self.source}>"
+
+
+@lru_cache(maxsize=4096)
+def compile_path(path:str) -> Path:
+    """Parses path into a Path, compiled paths are cached by source.
+
+    Raises:
+        PathError: path is empty or malformed
+    """
+    keys = []
+    position = 0
+    expect_name = True
+    for match in _TOKENS.finditer(path):
+        if match.start() != position:
+            break
+        name, selector, dot = match.groups()
+        if dot:
+            if expect_name:
+                break
+            expect_name = True
+        elif name is not None:
+            if not expect_name:
+                break
+            keys.append(name)
+            expect_name = False
+        else:
+            if not keys:
+                break
+            keys.append(WILDCARD if selector == "*" else int(selector))
+        position = match.end()
+    if not keys or position != len(path) or expect_name:
+        raise PathError("invalid path",path)
+    return Path(path,tuple(keys))
+
+
+def _get(value:t.Any, key:t.Any) -> t.Any:
+    try:
+        return value[key]
+    except TypeError:
+        if type(key) is not str:
+            raise
+        return getattr(value,key)
+
+
+def _set(target:t.Any, key:t.Any, value:t.Any):
+    if key is WILDCARD:
+        for index in range(len(target)):
+            target[index] = value
+        return
+    try:
+        target[key] = value
+    except TypeError:
+        if type(key) is not str:
+            raise
+        setattr(target,key,value)
+
+
+def _project(value:t.Any, keys:t.Tuple, start:int) -> t.Any:
+    for position in range(start,len(keys)):
+        key = keys[position]
+        if key is WILDCARD:
+            return [_project(item,keys,position + 1) for item in value]
+        value = _get(value,key)
+    return value
+
+
+def _targets(value:t.Any, keys:t.Sequence, start:int) -> t.Iterator:
+    for position in range(start,len(keys)):
+        key = keys[position]
+        if key is WILDCARD:
+            for item in value:
+                yield from _targets(item,keys,position + 1)
+            return
+        value = _get(value,key)
+    yield value
@@ -0,0 +1,173 @@
+import typing as t
+
+from .cache import ResultCache, expression_cache
+from .paths import PathError, compile_path
+
+# members of a flow step holding nested step lists
+STEP_BLOCKS = ("steps", "elsesteps", "catchsteps")
+
+
+class CompileError(Exception):
+    """Raised when a process document can not be compiled into a plan.
+    """
+    def __init__(self, message:str, path:str) -> None:
+        self.path = path
+        super().__init__(f"{path}: {message}")
+
+
+class PlanNode():
+    """Immutable compiled step or flow step.
+
+       Components, flow handlers and expression code objects are resolved once at
+       compile time so executing a node never looks anything up by name.
+       fields is the step document with expressions, conditions and nested step
+       blocks replaced by their compiled versions, source is the raw document.
+       cache is the ResultCache memoizing the component for this step and
+       result the compiled path its return value is written to, both optional.
+    """
+    __slots__ = ("path","source","fields","step","component","flow",
+                 "flow_function","expressions","conditions","cache","result")
+
+    def __init__(self, path:str, source:t.Dict, fields:t.Dict, component, flow_function,
+                 expressions:t.Optional[t.Tuple], conditions:t.Optional[t.Tuple],
+                 cache:t.Optional[ResultCache]=None, result=None) -> None:
+        set_attr = object.__setattr__
+        set_attr(self, "path", path)
+        set_attr(self, "source", source)
+        set_attr(self, "fields", fields)
+        set_attr(self, "step", source.get("step"))
+        set_attr(self, "component", component)
+        set_attr(self, "flow", source.get("flow"))
+        set_attr(self, "flow_function", flow_function)
+        set_attr(self, "expressions", expressions)
+        set_attr(self, "conditions", conditions)
+        set_attr(self, "cache", cache)
+        set_attr(self, "result", result)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self) -> str:
+        return f"<PlanNode {self.path} {self.flow or self.step or 'expressions'}>"
+
+
+class Plan():
+    """Immutable compiled list of steps.
+    """
+    __slots__ = ("path","nodes")
+
+    def __init__(self, path:str, nodes:t.Tuple[PlanNode,...]) -> None:
+        object.__setattr__(self, "path", path)
+        object.__setattr__(self, "nodes", nodes)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __getitem__(self, index):
+        return self.nodes[index]
+
+    def __repr__(self) -> str:
+        return f"<Plan {self.path} steps={len(self.nodes)}>"
+
+
+def compile_plan(steps:t.List[t.Dict], engine, path:str="process") -> Plan:
+    """Compiles a list of step documents into a plan for engine.
+
+    Args:
+        steps (list): step and flow step documents
+        engine (Engine): engine supplying components and flow handlers
+        path (str): position of the list in the process document
+
+    Raises:
+        CompileError: unknown step or flow names and expression syntax errors
+
+    Returns:
+        Plan : compiled steps
+    """
+    if type(steps) is Plan:
+        return steps
+    return Plan(path, tuple(compile_node(step, engine, f"{path}[{i}]")
+                            for i, step in enumerate(steps or ())))
+
+
+def compile_node(step:t.Dict, engine, path:str) -> PlanNode:
+    """Compiles a single step or flow step document.
+    """
+    fields = dict(step)
+    component = None
+    flow_function = None
+    cache = None
+    result = None
+
+    flow = step.get("flow")
+    if flow is not None:
+        flow_function = engine.flow_functions.get(flow)
+        if flow_function is None:
+            raise CompileError(f"unknown flow '{flow}'", path)
+        for block in STEP_BLOCKS:
+            if step.get(block) is not None:
+                fields[block] = compile_plan(step[block], engine, f"{path}.{block}")
+    elif step.get("step") is not None:
+        component = engine.step_functions.get(step["step"])
+        if component is None:
+            raise CompileError(f"unknown step '{step['step']}'", path)
+        cache = _step_cache(step.get("cache"), component, f"{path}.cache")
+        if step.get("result") is not None:
+            try:
+                result = compile_path(step["result"])
+            except (PathError,TypeError) as x:
+                raise CompileError(f"invalid result path {step['result']!r}", f"{path}.result") from x
+
+    expressions = _compile_expressions(step.get("expressions"), f"{path}.expressions")
+    conditions = _compile_expressions(step.get("conditions"), f"{path}.conditions")
+    if expressions is not None:
+        fields["expressions"] = expressions
+    if conditions is not None:
+        fields["conditions"] = conditions
+
+    return PlanNode(path, step, fields, component, flow_function, expressions, conditions,
+                    cache, result)
+
+
+def _step_cache(option:t.Any, component, path:str) -> t.Optional[ResultCache]:
+    # absent keeps the component's own cache, false disables it for the step
+    if option is None:
+        return component.result_cache
+    if option is False:
+        return None
+    if option is True:
+        return component.result_cache or ResultCache()
+    if isinstance(option, dict):
+        # the component's key function still decides what a call is keyed by
+        key = component.result_cache.key if component.result_cache is not None else None
+        return ResultCache(option.get("maxsize", 128), option.get("ttl"), key)
+    raise CompileError("cache must be true, false or an object with maxsize and ttl", path)
+
+
+def iter_nodes(plan:Plan) -> t.Iterator[PlanNode]:
+    """Yields every node of plan depth first including nested step blocks.
+    """
+    for node in plan:
+        yield node
+        for block in STEP_BLOCKS:
+            nested = node.fields.get(block)
+            if type(nested) is Plan:
+                yield from iter_nodes(nested)
+
+
+def _compile_expressions(expressions:t.Optional[t.List[str]], path:str) -> t.Optional[t.Tuple]:
+    if expressions is None:
+        return None
+    codes = []
+    for i, expression in enumerate(expressions):
+        try:
+            codes.append(expression_cache.compile(expression))
+        except SyntaxError as x:
+            raise CompileError(f"invalid expression {expression!r}: {x.msg}", f"{path}[{i}]") from x
+    return tuple(codes)
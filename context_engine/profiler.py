@@ -0,0 +1,173 @@
+import threading
+import time
+import typing as t
+
+
+class ProfileEntry():
+    """Timings collected for one profiled key.
+    """
+    __slots__ = ("kind","name","calls","cumulative","self_time")
+
+    def __init__(self, kind:str, name:str) -> None:
+        self.kind = kind
+        self.name = name
+        self.calls = 0
+        self.cumulative = 0.0
+        self.self_time = 0.0
+
+    def __repr__(self) -> str:
+        return f"<ProfileEntry {self.kind} {self.name!r} calls={self.calls} cumulative={self.cumulative:.6f}>"
+
+
+class Profiler():
+    """Opt-in profiler for Engine.
+       Records call counts, cumulative and self time for every step (by position
+       in the document and by step name), every flow type and every expression or
+       condition. Attaching overrides engine methods on the instance so an engine
+       without a profiler runs exactly the same code as before.
+
+        profiler = engine.enable_profiler()
+        engine.run()
+        print(profiler.report())
+        profiler.write_collapsed("engine.folded")
+    """
+    def __init__(self, clock:t.Callable[[],float]=time.perf_counter) -> None:
+        self.clock = clock
+        self.entries:t.Dict[t.Tuple[str,str],ProfileEntry] = {}
+        self.collapsed:t.Dict[str,float] = {}
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.engine = None
+
+    def attach(self, engine) -> "Profiler":
+        """Starts profiling engine.
+        """
+        if self.engine is not None:
+            raise RuntimeError("profiler already attached")
+        self.engine = engine
+        do_step = engine.do_step
+        eval_expression = engine.context.eval_expression
+        enter = self.enter
+        leave = self.leave
+
+        def profiled_do_step(step):
+            node = step.node
+            keys = [("step",node.path)]
+            if node.flow is not None:
+                keys.append(("flow",node.flow))
+            elif node.step is not None:
+                keys.append(("step name",node.step))
+            enter(keys,f"{node.path} {node.flow or node.step or 'expressions'}")
+            try:
+                return do_step(step)
+            finally:
+                leave()
+
+        def profiled_eval_step_expressions(expression_list):
+            for expression in expression_list:
+                source = expression_source(expression)
+                enter((("expression",source),),f"expression {source}")
+                try:
+                    eval_expression(expression)
+                finally:
+                    leave()
+
+        def profiled_evaluate_flow_conditions(flow_step) -> bool:
+            for condition in flow_step.conditions:
+                source = expression_source(condition)
+                enter((("condition",source),),f"condition {source}")
+                try:
+                    if not eval_expression(condition):
+                        return False
+                finally:
+                    leave()
+            return True
+
+        engine.do_step = profiled_do_step
+        engine.eval_step_expressions = profiled_eval_step_expressions
+        engine.evaluate_flow_conditions = profiled_evaluate_flow_conditions
+        engine.profiler = self
+        return self
+
+    def detach(self):
+        """Stops profiling and restores the engine's own methods.
+        """
+        engine = self.engine
+        if engine is None:
+            return
+        for name in ("do_step","eval_step_expressions","evaluate_flow_conditions"):
+            engine.__dict__.pop(name,None)
+        engine.profiler = None
+        self.engine = None
+
+    def enter(self, keys:t.Sequence[t.Tuple[str,str]], label:str):
+        """Starts timing keys, label names the frame in collapsed stacks.
+        """
+        stack = self.__stack()
+        stack.append([keys,label.replace(";",","),self.clock(),0.0])
+
+    def leave(self):
+        """Stops timing the most recent enter.
+        """
+        now = self.clock()
+        stack = self.__stack()
+        keys, _, start, child_time = stack[-1]
+        elapsed = now - start
+        self_time = elapsed - child_time
+        path = ";".join(frame[1] for frame in stack)
+        stack.pop()
+        if stack:
+            stack[-1][3] += elapsed
+        # nested frames with the same key only count once towards cumulative
+        active = {key for frame in stack for key in frame[0]}
+
+        with self.__lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    entry = self.entries[key] = ProfileEntry(*key)
+                entry.calls += 1
+                entry.self_time += self_time
+                if key not in active:
+                    entry.cumulative += elapsed
+            self.collapsed[path] = self.collapsed.get(path,0.0) + self_time
+
+    def __stack(self) -> t.List:
+        stack = getattr(self.__local,"stack",None)
+        if stack is None:
+            stack = self.__local.stack = []
+        return stack
+
+    def clear(self):
+        with self.__lock:
+            self.entries.clear()
+            self.collapsed.clear()
+
+    def sorted_entries(self, sort:str="cumulative", kind:t.Optional[str]=None) -> t.List[ProfileEntry]:
+        """Entries sorted descending by cumulative, self_time or calls.
+        """
+        entries = [entry for entry in self.entries.values() if kind is None or entry.kind == kind]
+        return sorted(entries,key=lambda entry: getattr(entry,sort),reverse=True)
+
+    def report(self, sort:str="cumulative", limit:t.Optional[int]=None, kind:t.Optional[str]=None) -> str:
+        """Formats a table of entries sorted by sort.
+        """
+        lines = [f"{'calls':>10} {'cumulative':>12} {'self':>12} {'per call':>12}  {'kind':<10} name"]
+        for entry in self.sorted_entries(sort,kind)[:limit]:
+            lines.append(f"{entry.calls:>10} {entry.cumulative:>12.6f} {entry.self_time:>12.6f} "
+                         f"{entry.cumulative / entry.calls:>12.6f}  {entry.kind:<10} {entry.name}")
+        return "\n".join(lines)
+
+    def write_collapsed(self, path:str):
+        """Writes self time per stack in microseconds in the collapsed stack format
+           read by flamegraph.pl, speedscope and similar tools.
+        """
+        with open(path,"w") as out:
+            for stack, seconds in sorted(self.collapsed.items()):
+                out.write(f"{stack} {int(seconds * 1_000_000)}\n")
+
+
+def expression_source(expression) -> str:
+    """Source of a compiled expression, compiled expressions use it as filename.
+    """
+    return expression if type(expression) is str else expression.co_filename
@@ -0,0 +1,219 @@
+from array import array
+import csv
+from itertools import accumulate, chain, compress, islice, repeat
+import json
+import mmap
+import operator
+import os
+import threading
+import typing as t
+from collections.abc import Sequence
+
+from .views import AttrView
+
+# bytes of the file split into lines at a time, bounds memory while scanning
+CHUNK_SIZE = 16 * 1024 * 1024
+# a line offset is kept for every INDEX_STRIDE records, lookups read at most
+# INDEX_STRIDE - 1 lines past the nearest one
+INDEX_STRIDE = 64
+
+FORMATS = ("jsonl","csv")
+_BLANK = frozenset((b"",b"\r"))
+# skips the encoding sniffing json.loads does for bytes
+_decode_json = json.JSONDecoder().decode
+
+
+class RecordFile(Sequence):
+    """JSONL or CSV file read through mmap as a sequence of records.
+
+       Records are parsed when they are read and dicts (JSON objects, CSV rows
+       keyed by the header) come back as AttrView so steps can use
+       locals.row.field. Iterating scans the file a chunk at a time and drops
+       the pages it is done with, so memory stays flat whatever the file size.
+       len and indexing build an offset index on first use holding one 8 byte
+       offset per INDEX_STRIDE records. Blank lines are skipped and every other
+       line is one record, CSV values with embedded newlines aren't supported.
+       The delimiter defaults to a tab for .tsv files and a comma otherwise.
+    """
+    def __init__(self, path:t.Union[str,os.PathLike], format:t.Optional[str]=None,
+                 encoding:str="utf-8", delimiter:t.Optional[str]=None,
+                 fieldnames:t.Optional[t.Sequence[str]]=None) -> None:
+        self.path:str = os.fspath(path)
+        if format is None:
+            format = "csv" if self.path.lower().endswith((".csv",".tsv")) else "jsonl"
+        if format not in FORMATS:
+            raise ValueError(f"unknown record file format '{format}'")
+        self.format:str = format
+        self.encoding:str = encoding
+        if delimiter is None:
+            delimiter = "\t" if self.path.lower().endswith(".tsv") else ","
+        self.delimiter:str = delimiter
+        self.fieldnames:t.Optional[t.List[str]] = None if fieldnames is None else list(fieldnames)
+        self.__map:t.Optional[mmap.mmap] = None
+        self.__size:int = 0
+        # offset of the first record, after the CSV header
+        self.__start:int = 0
+        self.__index:t.Optional[array] = None
+        self.__count:int = 0
+        self.__lock = threading.Lock()
+
+    def open(self) -> "RecordFile":
+        with self.__lock:
+            if self.__map is None and self.__size == 0:
+                self.__open()
+        return self
+
+    def close(self):
+        with self.__lock:
+            if self.__map is not None:
+                self.__map.close()
+            self.__map = None
+            self.__size = 0
+            self.__index = None
+
+    def __enter__(self) -> "RecordFile":
+        return self.open()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __open(self):
+        with open(self.path,"rb") as source:
+            size = os.fstat(source.fileno()).st_size
+            # empty files can't be mapped
+            self.__map = mmap.mmap(source.fileno(),0,access=mmap.ACCESS_READ) if size else None
+        self.__size = size
+        self.__start = 0
+        if self.format == "csv" and self.fieldnames is None:
+            header = next(self.__lines(0),None)
+            if header is None:
+                self.fieldnames = []
+            else:
+                line, self.__start = header
+                self.fieldnames = self.__csv_row(line)
+
+    def __chunks(self, start:int) -> t.Iterator[t.Tuple[int,int]]:
+        """Yields (start, end) of about CHUNK_SIZE bytes ending after a newline.
+        """
+        data = self.__map
+        size = self.__size
+        position = start
+        while position < size:
+            end = min(position + CHUNK_SIZE,size)
+            last = data.rfind(b"\n",position,end) if end < size else -1
+            while last == -1 and end < size:
+                # a line longer than a chunk
+                end = min(end + CHUNK_SIZE,size)
+                last = data.rfind(b"\n",position,end) if end < size else -1
+            if last != -1:
+                end = last + 1
+            yield position, end
+            _drop_pages(data,position,end)
+            position = end
+
+    def __lines(self, start:int) -> t.Iterator[t.Tuple[bytes,int]]:
+        """Yields (line, offset after it) for the non blank lines from start.
+        """
+        for position, end in self.__chunks(start):
+            offset = position
+            for line in self.__map[position:end].split(b"\n"):
+                offset += len(line) + 1
+                if line not in _BLANK:
+                    yield line, offset
+
+    def __build_index(self):
+        index = array("Q")
+        count = 0
+        for position, end in self.__chunks(self.__start):
+            lines = self.__map[position:end].split(b"\n")
+            starts = accumulate(chain((position,),map(operator.add,map(len,lines),repeat(1))))
+            keep = list(map(operator.not_,map(_BLANK.__contains__,lines)))
+            index.extend(islice(compress(starts,keep),(-count) % INDEX_STRIDE,None,INDEX_STRIDE))
+            count += sum(keep)
+        self.__index = index
+        self.__count = count
+
+    def __csv_row(self, line:bytes) -> t.List[str]:
+        return next(csv.reader((line.decode(self.encoding).rstrip("\r"),),delimiter=self.delimiter))
+
+    def parse(self, line:bytes) -> t.Any:
+        """Parses one line into a record.
+        """
+        if self.format == "csv":
+            record = dict(zip(self.fieldnames,self.__csv_row(line)))
+        else:
+            record = _decode_json(line.decode(self.encoding))
+        return AttrView(record) if type(record) is dict else record
+
+    def __iter__(self) -> t.Iterator:
+        self.open()
+        for line, _ in self.__lines(self.__start):
+            yield self.parse(line)
+
+    def __ensure_index(self):
+        self.open()
+        with self.__lock:
+            if self.__index is None:
+                self.__build_index()
+
+    def __len__(self) -> int:
+        self.__ensure_index()
+        return self.__count
+
+    def __getitem__(self, index):
+        self.__ensure_index()
+        if isinstance(index,slice):
+            return [self[position] for position in range(*index.indices(self.__count))]
+        position = index + self.__count if index < 0 else index
+        if not 0 <= position < self.__count:
+            raise IndexError("record index out of range")
+        block, skip = divmod(position,INDEX_STRIDE)
+        return self.parse(self.__line_at(self.__index[block],skip))
+
+    def __line_at(self, offset:int, skip:int) -> bytes:
+        """Line skip non blank lines after the one starting at offset.
+        """
+        data = self.__map
+        while True:
+            end = data.find(b"\n",offset)
+            if end == -1:
+                end = self.__size
+            line = data[offset:end]
+            if line not in _BLANK:
+                if not skip:
+                    return line
+                skip -= 1
+            offset = end + 1
+
+    def __reduce__(self):
+        # the file's size and modification time make pickles (and incremental
+        # fingerprints) change when the file changes
+        stat = os.stat(self.path)
+        return _reopen, (self.path,self.format,self.encoding,self.delimiter,self.fieldnames,
+                         stat.st_size,stat.st_mtime_ns)
+
+    def __repr__(self) -> str:
+        return f"<RecordFile {self.format} {self.path}>"
+
+
+def _reopen(path, format, encoding, delimiter, fieldnames, size, mtime_ns) -> RecordFile:
+    return RecordFile(path,format,encoding,delimiter,fieldnames)
+
+
+_PAGE = mmap.PAGESIZE
+
+def _drop_pages(data:mmap.mmap, start:int, end:int):
+    # pages already read are dropped from the mapping, the page cache keeps them
+    advise = getattr(data,"madvise",None)
+    dont_need = getattr(mmap,"MADV_DONTNEED",None)
+    if advise is None or dont_need is None:
+        return
+    start -= start % _PAGE
+    if end > start:
+        advise(dont_need,start,end - start)
+
+
+def open_records(path:t.Union[str,os.PathLike], format:t.Optional[str]=None, **options) -> RecordFile:
+    """Opens a JSONL or CSV file as a RecordFile, format defaults from the extension.
+    """
+    return RecordFile(path,format,**options).open()
@@ -0,0 +1,365 @@
+"""
+Records component and expression calls of a run and replays them later.
+
+A recorded run writes one entry per call to a trace file: the command name, a
+fingerprint of its arguments (context.args for components), fingerprints of
+the context values it read, the context values it wrote, its result or error
+and how long it took. A replayed run looks every call up by name and
+arguments and, instead of calling the command, writes the recorded values back
+and returns the recorded result, so the rest of the process runs at full speed
+without reaching the systems the commands talk to.
+
+    engine.run_recorded("prod.trace")          # in production
+    report = engine.run_replay("prod.trace")   # in a benchmark
+    print(report.summary())
+
+Calls made while another recorded call runs are part of it and aren't recorded
+separately. Built-in expressions (set, new_list, ...) are engine work and are
+never recorded. Calls whose result or writes can't be pickled are recorded as
+live and run for real on replay.
+
+Recording doesn't serialize anything. Calls running concurrently in parallel
+flows each track their own context reads and writes, though a call that reads
+a key another one writes at the same time may record either value.
+"""
+from collections import deque
+import contextvars
+import copy
+import pickle
+import threading
+import time
+import typing as t
+
+from .commands.command_map import registry
+from .decorators import Component, Expression, FlowComponent
+from .incremental import (_ADDRESS, _current_fingerprint, apply_changes, canonical, changes,
+                          fingerprint, tracking)
+
+# bump when the trace layout changes
+TRACE_FORMAT = 1
+
+
+class ReplayError(Exception):
+    """Raised when a replayed call has no matching recorded call or the trace
+       can't be read.
+    """
+
+
+class Call():
+    """One recorded component or expression call.
+    """
+    __slots__ = ("kind","name","key","inputs","outputs","deleted","result","error",
+                 "duration","live")
+
+    def __init__(self, kind:str, name:str, key:str, duration:float) -> None:
+        self.kind = kind
+        self.name = name
+        self.key = key
+        self.inputs:t.Dict[str,str] = {}
+        self.outputs:t.Dict[str,bytes] = {}
+        self.deleted:t.List[str] = []
+        self.result:t.Optional[bytes] = None
+        self.error:t.Optional[bytes] = None
+        self.duration = duration
+        # result or writes couldn't be pickled, replay calls the command
+        self.live:bool = False
+
+    def __getstate__(self):
+        return tuple(getattr(self,name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__,state):
+            setattr(self,name,value)
+
+    def __repr__(self) -> str:
+        status = "live" if self.live else f"{self.duration:.6f}s"
+        return f"<Call {self.kind} {self.name} {status}>"
+
+
+class ReplayReport():
+    """Where the time of a replayed run went.
+
+       engine_time is everything but the commands: step dispatch, flows,
+       expressions evaluated by the engine and writing back recorded values.
+       recorded_time is what the replayed calls took when they were recorded,
+       engine_time + recorded_time + live_time estimates the recorded run.
+    """
+    __slots__ = ("wall_time","replayed","recorded_time","live","live_time","input_mismatches")
+
+    def __init__(self) -> None:
+        self.wall_time = 0.0
+        self.replayed = 0
+        self.recorded_time = 0.0
+        self.live = 0
+        self.live_time = 0.0
+        self.input_mismatches = 0
+
+    def __get_engine_time(self) -> float:
+        return self.wall_time - self.live_time
+
+    engine_time:float = property(__get_engine_time)
+
+    def summary(self) -> str:
+        lines = [f"replayed {self.replayed} calls in {self.wall_time:.6f}s",
+                 f"engine overhead {self.engine_time:.6f}s",
+                 f"recorded command time {self.recorded_time:.6f}s"]
+        if self.live:
+            lines.append(f"{self.live} live calls {self.live_time:.6f}s")
+        if self.input_mismatches:
+            lines.append(f"{self.input_mismatches} calls read different context values than recorded")
+        return "\n".join(lines)
+
+    def __repr__(self) -> str:
+        return (f"<ReplayReport wall={self.wall_time:.6f} engine={self.engine_time:.6f} "
+                f"recorded={self.recorded_time:.6f} replayed={self.replayed}>")
+
+
+class _Hooks():
+    """Routes the engine's component invocations and the context's expressions
+       through handle(kind, name, key, call) while attached.
+    """
+    def __init__(self) -> None:
+        self.engine = None
+        # set while a handled call runs, threads of parallel flows it starts
+        # copy it so their calls belong to it too
+        self.__active:contextvars.ContextVar = contextvars.ContextVar(f"replay_hooks_{id(self)}",default=False)
+        # component -> invoke set on the instance before attaching, or None
+        self.__components:t.Dict[Component,t.Optional[t.Callable]] = {}
+        self.__expressions:t.Dict[str,Expression] = {}
+
+    def attach(self, engine):
+        if self.engine is not None:
+            raise RuntimeError("already attached")
+        self.engine = engine
+        context = engine.context
+        for component in set(engine.step_functions.values()):
+            if isinstance(component,Component) and not isinstance(component,FlowComponent):
+                self.__components[component] = component.__dict__.get("invoke")
+                component.invoke = self.__wrap_component(component)
+
+        builtins = {name for _, _, name in registry("expressions")}
+        for name, expression in list(context.items()):
+            if isinstance(expression,Expression) and name not in builtins:
+                wrapped = copy.copy(expression)
+                wrapped.command = self.__wrap_expression(name,expression.command)
+                context[name] = wrapped
+                self.__expressions[name] = expression
+        return self
+
+    def detach(self):
+        engine = self.engine
+        if engine is None:
+            return
+        for component, previous in self.__components.items():
+            if previous is None:
+                component.__dict__.pop("invoke",None)
+            else:
+                component.invoke = previous
+        engine.context.update(self.__expressions)
+        self.__components = {}
+        self.__expressions = {}
+        self.engine = None
+
+    def __wrap_component(self, component:Component):
+        # wraps an override already on the instance
+        invoke = component.invoke
+
+        def hooked_invoke(engine,*args,**kwargs):
+            if self.engine is None or engine is not self.engine:
+                return invoke(engine,*args,**kwargs)
+            key = call_key(engine.context.args,args,kwargs)
+            return self.__enter("component",component.name,key,lambda: invoke(engine,*args,**kwargs))
+        return hooked_invoke
+
+    def __wrap_expression(self, name:str, command:t.Callable):
+        def hooked_command(context,*args,**kwargs):
+            # copies made for spawned engines' contexts call through
+            if self.engine is None or context is not self.engine.context:
+                return command(context,*args,**kwargs)
+            key = call_key(None,args,kwargs)
+            return self.__enter("expression",name,key,lambda: command(context,*args,**kwargs))
+        return hooked_command
+
+    def __enter(self, kind:str, name:str, key:str, call:t.Callable[[],t.Any]):
+        # calls made inside a handled call belong to it
+        if self.__active.get():
+            return call()
+        token = self.__active.set(True)
+        try:
+            return self.handle(kind,name,key,call)
+        finally:
+            self.__active.reset(token)
+
+    def handle(self, kind:str, name:str, key:str, call:t.Callable[[],t.Any]):
+        raise NotImplementedError
+
+
+class Recorder(_Hooks):
+    """Records calls of an engine to a trace file while attached.
+    """
+    def __init__(self, path:str, clock:t.Callable[[],float]=time.perf_counter) -> None:
+        super().__init__()
+        self.path = path
+        self.clock = clock
+        self.calls:int = 0
+        self.recorded_time:float = 0.0
+        self.__out = None
+        # guards the trace file and counters, calls themselves run concurrently
+        self.__lock = threading.Lock()
+
+    def attach(self, engine) -> "Recorder":
+        self.__out = open(self.path,"wb")
+        pickle.dump({"format":TRACE_FORMAT},self.__out,protocol=pickle.HIGHEST_PROTOCOL)
+        return super().attach(engine)
+
+    def detach(self):
+        super().detach()
+        if self.__out is not None:
+            self.__out.close()
+            self.__out = None
+
+    def handle(self, kind:str, name:str, key:str, call:t.Callable[[],t.Any]):
+        context = self.engine.context
+        error = None
+        result = None
+        start = self.clock()
+        with tracking(context,_step_locals(context)) as recorder:
+            try:
+                result = call()
+            except Exception as x:
+                error = x
+        duration = self.clock() - start
+
+        entry = Call(kind,name,key,duration)
+        found = changes(context,recorder)
+        try:
+            if found is None:
+                raise pickle.PicklingError("context values can't be pickled")
+            entry.inputs = found["inputs"]
+            entry.outputs = found["outputs"]
+            entry.deleted = found["deleted"]
+            if error is None:
+                entry.result = pickle.dumps(result,protocol=pickle.HIGHEST_PROTOCOL)
+            else:
+                entry.error = pickle.dumps(error,protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            entry = Call(kind,name,key,duration)
+            entry.live = True
+        data = pickle.dumps(entry,protocol=pickle.HIGHEST_PROTOCOL)
+        with self.__lock:
+            self.__out.write(data)
+            self.calls += 1
+            self.recorded_time += duration
+        if error is not None:
+            raise error
+        return result
+
+
+class Replayer(_Hooks):
+    """Substitutes recorded calls for the calls of an engine while attached.
+
+       Calls are matched by kind, name and arguments in the order they were
+       recorded, among several such calls the first that read the same
+       context values is taken. With check_inputs the context values a call reads are compared
+       with the recorded ones and differences counted in the report.
+    """
+    def __init__(self, path:str, check_inputs:bool=False,
+                 clock:t.Callable[[],float]=time.perf_counter) -> None:
+        super().__init__()
+        self.path = path
+        self.check_inputs = check_inputs
+        self.clock = clock
+        self.report = ReplayReport()
+        self.__calls:t.Dict[t.Tuple[str,str,str],t.Deque[Call]] = {}
+        self.__lock = threading.Lock()
+        self.__started:t.Optional[float] = None
+
+    def attach(self, engine) -> "Replayer":
+        self.__calls = {}
+        for entry in load_trace(self.path):
+            self.__calls.setdefault((entry.kind,entry.name,entry.key),deque()).append(entry)
+        self.report = ReplayReport()
+        self.__started = self.clock()
+        return super().attach(engine)
+
+    def detach(self):
+        if self.__started is not None:
+            self.report.wall_time = self.clock() - self.__started
+            self.__started = None
+        super().detach()
+
+    def handle(self, kind:str, name:str, key:str, call:t.Callable[[],t.Any]):
+        context = self.engine.context
+        with self.__lock:
+            recorded = self.__calls.get((kind,name,key))
+            entry = _take(recorded,context) if recorded else None
+        if entry is None:
+            raise ReplayError(f"no recorded {kind} call of {name} with these arguments")
+
+        report = self.report
+        if entry.live:
+            start = self.clock()
+            try:
+                return call()
+            finally:
+                with self.__lock:
+                    report.live += 1
+                    report.live_time += self.clock() - start
+
+        if self.check_inputs and any(_current_fingerprint(context,key) != digest
+                                     for key, digest in entry.inputs.items()):
+            with self.__lock:
+                report.input_mismatches += 1
+        apply_changes(context,entry.outputs,entry.deleted)
+        with self.__lock:
+            report.replayed += 1
+            report.recorded_time += entry.duration
+        if entry.error is not None:
+            raise pickle.loads(entry.error)
+        return pickle.loads(entry.result)
+
+
+def _take(recorded:t.Deque[Call], context) -> Call:
+    """Removes the first of the calls with the same arguments that read what the
+       context holds now, the first one when none did. Calls of parallel flows
+       are told apart by their loop variables this way.
+    """
+    if len(recorded) > 1:
+        for index, entry in enumerate(recorded):
+            if all(_current_fingerprint(context,key) == digest for key, digest in entry.inputs.items()):
+                del recorded[index]
+                return entry
+    return recorded.popleft()
+
+
+def load_trace(path:str) -> t.Iterator[Call]:
+    """Yields the calls recorded in a trace file.
+    """
+    with open(path,"rb") as source:
+        try:
+            header = pickle.load(source)
+        except (EOFError,pickle.UnpicklingError) as x:
+            raise ReplayError(f"{path}: not a trace file") from x
+        if not isinstance(header,dict) or header.get("format") != TRACE_FORMAT:
+            raise ReplayError(f"{path}: unsupported trace format")
+        while True:
+            try:
+                yield pickle.load(source)
+            except EOFError:
+                return
+
+
+def call_key(step_args:t.Any, args:t.Tuple, kwargs:t.Dict) -> str:
+    """Fingerprint of a call's arguments, the same in every process. Arguments
+       that can't be pickled are keyed by their repr without memory addresses.
+    """
+    key = (step_args,args,sorted(kwargs.items()))
+    return fingerprint(key) or _ADDRESS.sub("",repr(canonical(key)))
+
+
+def _step_locals(context) -> t.Mapping:
+    try:
+        return context.current_step.locals
+    except IndexError:
+        return {}
+
@@ -0,0 +1,77 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import contextvars
+import os
+import typing as t
+
+from .analysis import dependencies
+from .plan import Plan
+
+
+class StepScheduler():
+    """Runs independent top-level steps of a process concurrently.
+
+       Effects of each step are worked out from its expressions, flow members
+       and the reads=/writes= declared by its components (see analysis). A step
+       starts once every earlier step it conflicts with has finished, steps
+       with unknown effects run on their own in document order. Each step runs
+       on forked frame stacks on a thread pool.
+    """
+    def __init__(self, max_workers:t.Optional[int]=None) -> None:
+        self.max_workers:int = max_workers or min(32,(os.cpu_count() or 1) + 4)
+        self.__plan:t.Optional[Plan] = None
+        self.__graph:t.List[t.FrozenSet[int]] = []
+
+    def dependencies(self, engine) -> t.List[t.FrozenSet[int]]:
+        """Indexes of the earlier top-level steps each step waits for, worked out
+           once per compiled plan.
+        """
+        if engine.plan is None:
+            engine.compile()
+        if self.__plan is not engine.plan:
+            self.__graph = dependencies(engine.plan.nodes,engine.context)
+            self.__plan = engine.plan
+        return self.__graph
+
+    def run(self, engine):
+        graph = self.dependencies(engine)
+        nodes = engine.plan.nodes
+        # every step waiting on the one before it, nothing to overlap
+        if all(index - 1 in waits for index, waits in enumerate(graph) if index):
+            engine.do_steps(engine.plan)
+            return
+
+        frame = engine.frame
+
+        def run_step(node):
+            token = frame.fork()
+            try:
+                engine.do_step(frame.push_step(node))
+            finally:
+                frame.join(token)
+
+        done:t.Set[int] = set()
+        waiting = list(range(len(nodes)))
+        running = {}
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while waiting or running:
+                if not errors:
+                    ready = [index for index in waiting if graph[index] <= done]
+                    for index in ready:
+                        waiting.remove(index)
+                        # steps inherit context variables such as run_async's event loop
+                        future = pool.submit(contextvars.copy_context().run,run_step,nodes[index])
+                        running[future] = index
+                if not running:
+                    break
+                finished, _ = wait(running,return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        done.add(index)
+                    else:
+                        errors.append((index,error))
+        if errors:
+            # the error of the first failing step in document order wins
+            raise min(errors,key=lambda error: error[0])[1]
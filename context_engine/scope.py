@@ -0,0 +1,92 @@
+import typing as t
+
+from ctx import Ctx
+
+
+class Scope(Ctx):
+    """Layered locals for nested flows.
+
+       A scope holds only the values written to it and looks everything else up
+       in its parent, so pushing a nested flow is O(1) no matter how many locals
+       the enclosing flows hold. Writes and deletes only touch the scope itself,
+       parents never see them, which matches the shallow copy nested flows used
+       to get. Reads, membership, keys and iteration see the merged view.
+    """
+    __slots__ = ("__parent",)
+
+    def __init__(self, parent:t.Optional[t.Mapping]=None) -> None:
+        super().__init__()
+        object.__setattr__(self,"_Scope__parent",parent)
+
+    def __get_parent(self) -> t.Optional[t.Mapping]:
+        return self.__parent
+
+    parent_scope:t.Optional[t.Mapping] = property(__get_parent)
+
+    def __missing__(self, key):
+        parent = self.__parent
+        if parent is None:
+            raise KeyError(key)
+        return parent[key]
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __delattr__(self, name):
+        del self[name]
+
+    def __contains__(self, key) -> bool:
+        return dict.__contains__(self,key) or (self.__parent is not None and key in self.__parent)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def flatten(self) -> Ctx:
+        """Merged copy of this scope and its parents.
+        """
+        parent = self.__parent
+        merged = Ctx() if parent is None else (parent.flatten() if type(parent) is Scope else Ctx(parent))
+        merged.update(dict.items(self))
+        return merged
+
+    def keys(self):
+        return self.flatten().keys()
+
+    def values(self):
+        return self.flatten().values()
+
+    def items(self):
+        return self.flatten().items()
+
+    def __iter__(self):
+        return iter(self.flatten())
+
+    def __len__(self) -> int:
+        return len(self.flatten())
+
+    def __eq__(self, other) -> bool:
+        return self.flatten() == other
+
+    def __ne__(self, other) -> bool:
+        return not self == other
+
+    __hash__ = None
+
+    def copy(self) -> Ctx:
+        return self.flatten()
+
+    def __repr__(self) -> str:
+        return f"Scope({dict.__repr__(self.flatten())})"
+
+    def __reduce__(self):
+        # scopes travel as plain merged locals
+        return (Ctx,(dict(self.flatten()),))
@@ -0,0 +1,251 @@
+"""
+Binary snapshots of context data for moving it between processes or to disk.
+
+A snapshot is a pickle protocol 5 stream plus the out-of-band buffers of large
+binary values (numpy arrays anywhere, bytes and bytearray stored under a key), which are
+written, sent and read without being copied into the stream. Attached
+expressions and frame bindings are left out and Ctx values, nested ones too,
+come back as Ctx.
+
+    data = snapshot(context, keys=["orders","rates"])
+    data.write(file)                 # or data.send(connection), data.to_bytes()
+    restore(other_context, Snapshot.read(file))
+
+Layout: a header with the length of the stream and of each buffer, then the
+stream and the buffers.
+"""
+import hashlib
+import io
+import pickle
+import struct
+import typing as t
+
+from ctx import Ctx
+
+from .decorators import Command
+
+MAGIC = b"CESN"
+SNAPSHOT_FORMAT = 1
+# bytes values at least this long go out of band, smaller ones stay in the stream
+OUT_OF_BAND_MIN = 64 * 1024
+_BINARY = (bytes,bytearray)
+
+# magic, format, buffer count, stream length then (length, readonly) per buffer
+_HEAD = struct.Struct("<4sBIQ")
+_BUFFER = struct.Struct("<QB")
+
+
+class SnapshotError(ValueError):
+    """Raised when data isn't a snapshot this version can read.
+    """
+
+
+class _Pickler(pickle.Pickler):
+    # Ctx is rebuilt from a plain dict, which pickles on the fast C path and
+    # never carries instance attributes
+    def reducer_override(self, obj):
+        if type(obj) is Ctx:
+            return Ctx, (dict(obj),)
+        return NotImplemented
+
+
+class Snapshot():
+    """Pickle stream and out-of-band buffers of a packed value.
+
+       Read-only buffers (the memory of bytes values) are read back as bytes,
+       writable ones into bytearrays so restored arrays stay writable.
+    """
+    __slots__ = ("stream","buffers")
+
+    def __init__(self, stream:bytes, buffers:t.Sequence[t.Any]=()) -> None:
+        self.stream = stream
+        self.buffers:t.List[memoryview] = [memoryview(buffer).cast("B") for buffer in buffers]
+
+    def __get_nbytes(self) -> int:
+        return len(self.stream) + sum(buffer.nbytes for buffer in self.buffers)
+
+    nbytes:int = property(__get_nbytes)
+
+    def load(self) -> t.Any:
+        """Unpacks the value, arrays restored from writable buffers share their memory.
+        """
+        value, raw = pickle.loads(self.stream,buffers=self.buffers)
+        for key, kind in raw:
+            if key is None:
+                return _binary(kind,value)
+            value[key] = _binary(kind,value[key])
+        return value
+
+    def header(self) -> bytes:
+        return (_HEAD.pack(MAGIC,SNAPSHOT_FORMAT,len(self.buffers),len(self.stream))
+                + b"".join(_BUFFER.pack(buffer.nbytes,buffer.readonly) for buffer in self.buffers))
+
+    def parts(self) -> t.Iterator[t.Any]:
+        yield self.header()
+        yield self.stream
+        yield from self.buffers
+
+    def digest(self) -> str:
+        """sha256 of the serialized snapshot.
+        """
+        digest = hashlib.sha256()
+        for part in self.parts():
+            digest.update(part)
+        return digest.hexdigest()
+
+    def to_bytes(self) -> bytes:
+        return b"".join(self.parts())
+
+    def write(self, file:t.BinaryIO):
+        for part in self.parts():
+            file.write(part)
+
+    def send(self, connection):
+        """Sends over a multiprocessing connection, buffers go as separate messages.
+        """
+        connection.send_bytes(self.header() + self.stream)
+        for buffer in self.buffers:
+            connection.send_bytes(buffer)
+
+    @classmethod
+    def from_bytes(cls, data:t.Any) -> "Snapshot":
+        view = memoryview(data).cast("B")
+        stream_length, layout = _read_header(view[:_HEAD.size],
+                                             lambda size: view[_HEAD.size:_HEAD.size + size])
+        offset = _HEAD.size + _BUFFER.size * len(layout)
+        if len(view) < offset + stream_length + sum(length for length, _ in layout):
+            raise SnapshotError("snapshot is truncated")
+        stream = bytes(view[offset:offset + stream_length])
+        offset += stream_length
+        buffers = []
+        for length, readonly in layout:
+            buffer = view[offset:offset + length]
+            if view.readonly and not readonly:
+                buffer = bytearray(buffer)
+            buffers.append(buffer)
+            offset += length
+        return cls(stream,buffers)
+
+    @classmethod
+    def read(cls, file:t.BinaryIO) -> "Snapshot":
+        """Reads a snapshot written with write, each buffer is read once straight
+           into the memory it is restored from.
+        """
+        stream_length, layout = _read_header(_read_exactly(file,_HEAD.size),
+                                             lambda size: _read_exactly(file,size))
+        stream = _read_exactly(file,stream_length)
+        buffers = []
+        for length, readonly in layout:
+            if readonly:
+                buffers.append(_read_exactly(file,length))
+                continue
+            buffer = bytearray(length)
+            if file.readinto(buffer) != length:
+                raise SnapshotError("snapshot is truncated")
+            buffers.append(buffer)
+        return cls(stream,buffers)
+
+    @classmethod
+    def recv(cls, connection) -> "Snapshot":
+        view = memoryview(connection.recv_bytes())
+        stream_length, layout = _read_header(view[:_HEAD.size],
+                                             lambda size: view[_HEAD.size:_HEAD.size + size])
+        offset = _HEAD.size + _BUFFER.size * len(layout)
+        buffers = []
+        for length, readonly in layout:
+            if readonly:
+                buffers.append(connection.recv_bytes())
+                continue
+            buffer = bytearray(length)
+            connection.recv_bytes_into(buffer)
+            buffers.append(buffer)
+        return cls(bytes(view[offset:offset + stream_length]),buffers)
+
+    def __reduce__(self):
+        return Snapshot.from_bytes, (self.to_bytes(),)
+
+    def __repr__(self) -> str:
+        return f"<Snapshot {self.nbytes} bytes, {len(self.buffers)} buffers>"
+
+
+def _read_header(head:t.Any, read_layout:t.Callable[[int],t.Any]) -> t.Tuple[int,t.List[t.Tuple[int,bool]]]:
+    """Checks the fixed header and returns the stream length and (length,
+       readonly) of every buffer.
+    """
+    if len(head) < _HEAD.size:
+        raise SnapshotError("snapshot is truncated")
+    magic, version, count, stream_length = _HEAD.unpack(head)
+    if magic != MAGIC:
+        raise SnapshotError("not a context snapshot")
+    if version != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"unsupported snapshot format {version}")
+    layout = read_layout(_BUFFER.size * count)
+    if len(layout) < _BUFFER.size * count:
+        raise SnapshotError("snapshot is truncated")
+    return stream_length, [(length,bool(readonly)) for length, readonly in _BUFFER.iter_unpack(layout)]
+
+
+def _binary(kind:type, value:memoryview) -> t.Any:
+    # buffers that already are a whole object of the right type aren't copied
+    if type(value) is memoryview:
+        whole = value.obj
+        if type(whole) is kind and len(whole) == value.nbytes:
+            return whole
+    return kind(value)
+
+
+def _read_exactly(file:t.BinaryIO, size:int) -> bytes:
+    data = file.read(size)
+    if len(data) != size:
+        raise SnapshotError("snapshot is truncated")
+    return data
+
+
+def pack(value:t.Any) -> Snapshot:
+    """Packs any picklable value. Large bytes and bytearray are only sent out of
+       band when they are the value or a value of a top-level mapping, pickle
+       keeps those nested deeper in the stream.
+    """
+    raw:t.Tuple[t.Tuple[t.Optional[str],type],...] = ()
+    if type(value) in _BINARY and len(value) >= OUT_OF_BAND_MIN:
+        value, raw = pickle.PickleBuffer(value), ((None,type(value)),)
+    elif type(value) in (dict,Ctx):
+        large = [(key,type(item)) for key, item in value.items()
+                 if type(item) in _BINARY and len(item) >= OUT_OF_BAND_MIN]
+        if large:
+            value = type(value)(value)
+            for key, _ in large:
+                value[key] = pickle.PickleBuffer(value[key])
+            raw = tuple(large)
+
+    buffers:t.List[pickle.PickleBuffer] = []
+    out = io.BytesIO()
+    _Pickler(out,protocol=5,buffer_callback=buffers.append).dump((value,raw))
+    return Snapshot(out.getvalue(),[buffer.raw() for buffer in buffers])
+
+
+def snapshot(context:t.Mapping, keys:t.Optional[t.Iterable[str]]=None) -> Snapshot:
+    """Snapshot of the context data, of the keys in keys present on the context
+       when given. Attached expressions and frame bindings are left out.
+    """
+    if keys is None:
+        keys = context.keys()
+    data = Ctx()
+    for key in keys:
+        if key in data or type(key) is not str or key.startswith("_Context__"):
+            continue
+        if key not in context:
+            continue
+        value = context[key]
+        if not isinstance(value,Command):
+            data[key] = value
+    return pack(data)
+
+
+def restore(context:t.MutableMapping, data:t.Union[Snapshot,bytes]) -> t.MutableMapping:
+    """Writes the values of a snapshot (or its bytes) into context and returns it.
+    """
+    if not isinstance(data,Snapshot):
+        data = Snapshot.from_bytes(data)
+    context.update(data.load())
+    return context
@@ -0,0 +1,278 @@
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import typing as t
+import weakref
+from collections.abc import Sequence
+
+# memory the windows of one store's lists may hold before items spill to disk
+DEFAULT_MEMORY_LIMIT = 64 * 1024 * 1024
+# most items moved to disk by one append, keeps the cost of a single append bounded
+SPILL_BATCH = 512
+# spilling goes on until the windows are this share of the limit below it
+LOW_WATER = 0.125
+# items fetched from disk per query while iterating
+READ_PAGE = 1024
+
+
+class SpillStore():
+    """Memory budget and directory shared by the spill lists of an engine.
+
+       Items of every list created by the store are pickled on append and kept
+       in the list's in-memory window. Once the windows hold more than
+       memory_limit bytes the oldest items move to a temporary SQLite file in
+       directory (the system temp directory by default).
+    """
+    def __init__(self, memory_limit:int=DEFAULT_MEMORY_LIMIT,
+                 directory:t.Optional[t.Union[str,os.PathLike]]=None) -> None:
+        self.memory_limit:int = memory_limit
+        self.directory:t.Optional[str] = None if directory is None else os.fspath(directory)
+        self.memory:int = 0
+        self.__lock = threading.Lock()
+        # lists aren't hashable, they are tracked by id while alive
+        self.__lists:"weakref.WeakValueDictionary[int,SpillList]" = weakref.WeakValueDictionary()
+
+    def new_list(self, items:t.Iterable=()) -> "SpillList":
+        return SpillList(items,self)
+
+    def track(self, spill_list:"SpillList"):
+        with self.__lock:
+            self.__lists[id(spill_list)] = spill_list
+
+    def grow(self, size:int) -> bool:
+        """Accounts for size more bytes in memory, True when over the limit.
+        """
+        with self.__lock:
+            self.memory += size
+            return self.memory > self.memory_limit
+
+    def over_limit(self) -> bool:
+        return self.memory > self.memory_limit
+
+    def relieve(self, skip:"SpillList"):
+        """Spills windows of other lists while the store is over its limit.
+        """
+        with self.__lock:
+            others = sorted((each for each in self.__lists.values() if each is not skip),
+                            key=lambda each: each.window_bytes,reverse=True)
+        for other in others:
+            if not self.over_limit():
+                return
+            other.spill(blocking=False)
+
+
+_default_store:t.Optional[SpillStore] = None
+
+def default_store() -> SpillStore:
+    """Store used by contexts of engines without Engine.enable_spill.
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = SpillStore()
+    return _default_store
+
+
+class SpillList(Sequence):
+    """List of picklable items that moves its oldest items to disk when the
+       store's memory limit is reached.
+
+       Supports append, extend, len, iteration, indexing and slicing (slices
+       are returned as lists) and replacing items by index. Items are stored
+       pickled, reading one returns a copy so changes made to it are not kept
+       unless it is assigned back with spill_list[index] = item. Reading a
+       spilled item is one primary key lookup, iteration reads pages of
+       READ_PAGE items.
+    """
+    def __init__(self, items:t.Iterable=(), store:t.Optional[SpillStore]=None) -> None:
+        self.store:SpillStore = store or default_store()
+        # positions below spilled are on disk
+        self.__spilled:int = 0
+        self.__window:t.List[bytes] = []
+        self.__lock = threading.RLock()
+        self.__state = _State()
+        self.__finalizer = weakref.finalize(self,_release,self.__state,self.store)
+        self.store.track(self)
+        self.extend(items)
+
+    def __get_window_bytes(self) -> int:
+        return self.__state.window_bytes
+
+    window_bytes:int = property(__get_window_bytes)
+
+    def __get_spilled(self) -> int:
+        return self.__spilled
+
+    spilled:int = property(__get_spilled)
+
+    def append(self, item):
+        data = pickle.dumps(item,protocol=pickle.HIGHEST_PROTOCOL)
+        with self.__lock:
+            self.__window.append(data)
+            self.__state.window_bytes += len(data)
+            over = self.store.grow(len(data))
+            if over:
+                self.spill()
+        if over and self.store.over_limit():
+            self.store.relieve(self)
+
+    def extend(self, items:t.Iterable):
+        for item in items:
+            self.append(item)
+
+    def __len__(self) -> int:
+        return self.__spilled + len(self.__window)
+
+    def __getitem__(self, index):
+        with self.__lock:
+            if isinstance(index,slice):
+                return [self[position] for position in range(*index.indices(len(self)))]
+            position = self.__position(index)
+            if position >= self.__spilled:
+                return pickle.loads(self.__window[position - self.__spilled])
+            row = self.__state.db.execute("SELECT data FROM items WHERE pos = ?",(position,)).fetchone()
+            return pickle.loads(row[0])
+
+    def __setitem__(self, index:int, item):
+        data = pickle.dumps(item,protocol=pickle.HIGHEST_PROTOCOL)
+        with self.__lock:
+            position = self.__position(index)
+            if position < self.__spilled:
+                with self.__state.db as db:
+                    db.execute("UPDATE items SET data = ? WHERE pos = ?",(data,position))
+                return
+            offset = position - self.__spilled
+            size = len(data) - len(self.__window[offset])
+            self.__window[offset] = data
+            self.__state.window_bytes += size
+            over = self.store.grow(size)
+            if over:
+                self.spill()
+
+    def __iter__(self) -> t.Iterator:
+        # items appended while iterating are visited like with a list
+        position = 0
+        while position < len(self):
+            with self.__lock:
+                spilled = self.__spilled
+                if position < spilled:
+                    rows = self.__state.db.execute(
+                        "SELECT data FROM items WHERE pos >= ? AND pos < ? ORDER BY pos",
+                        (position,min(spilled,position + READ_PAGE))).fetchall()
+                    page = [row[0] for row in rows]
+                else:
+                    page = self.__window[position - spilled:]
+            for data in page:
+                yield pickle.loads(data)
+            position += len(page)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other,(list,tuple,SpillList)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self,other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"<SpillList {len(self)} items, {self.__spilled} on disk>"
+
+    def __reduce__(self):
+        # items are streamed into a new list in the default store
+        return SpillList, (), None, iter(self)
+
+    def spill(self, blocking:bool=True) -> int:
+        """Moves up to SPILL_BATCH of the oldest window items to disk, as many
+           as needed to get the store below its low water mark, and returns
+           how many moved.
+        """
+        if not self.__lock.acquire(blocking):
+            return 0
+        try:
+            count = 0
+            size = 0
+            window = self.__window
+            limit = self.store.memory_limit
+            excess = self.store.memory - int(limit - limit * LOW_WATER)
+            while count < len(window) and count < SPILL_BATCH and size < excess:
+                size += len(window[count])
+                count += 1
+            if not count:
+                return 0
+            db = self.__open()
+            start = self.__spilled
+            with db:
+                db.executemany("INSERT INTO items (pos, data) VALUES (?, ?)",
+                               zip(range(start,start + count),window[:count]))
+            del window[:count]
+            self.__spilled += count
+            self.__state.window_bytes -= size
+            self.store.grow(-size)
+            return count
+        finally:
+            self.__lock.release()
+
+    def clear(self):
+        with self.__lock:
+            self.store.grow(-self.__state.window_bytes)
+            self.__state.window_bytes = 0
+            self.__window = []
+            if self.__state.db is not None:
+                with self.__state.db as db:
+                    db.execute("DELETE FROM items")
+            self.__spilled = 0
+
+    def close(self):
+        """Releases the window memory and deletes the spill file, the list is
+           empty afterwards. Lists that are garbage collected are closed too.
+        """
+        with self.__lock:
+            self.__finalizer()
+            self.__window = []
+            self.__spilled = 0
+            self.__state = _State()
+            self.__finalizer = weakref.finalize(self,_release,self.__state,self.store)
+
+    def __position(self, index:int) -> int:
+        length = len(self)
+        position = index + length if index < 0 else index
+        if not 0 <= position < length:
+            raise IndexError("spill list index out of range")
+        return position
+
+    def __open(self) -> sqlite3.Connection:
+        state = self.__state
+        if state.db is None:
+            fd, state.path = tempfile.mkstemp(prefix="context-engine-",suffix=".spill",
+                                              dir=self.store.directory)
+            os.close(fd)
+            db = sqlite3.connect(state.path,check_same_thread=False)
+            # the file only lives as long as the list, durability is not needed
+            db.execute("PRAGMA journal_mode = OFF")
+            db.execute("PRAGMA synchronous = OFF")
+            db.execute("CREATE TABLE items (pos INTEGER PRIMARY KEY, data BLOB NOT NULL)")
+            state.db = db
+        return state.db
+
+
+class _State():
+    """What a list holds outside its window, released when the list goes away.
+    """
+    __slots__ = ("window_bytes","db","path")
+
+    def __init__(self) -> None:
+        self.window_bytes:int = 0
+        self.db:t.Optional[sqlite3.Connection] = None
+        self.path:t.Optional[str] = None
+
+
+def _release(state:_State, store:SpillStore):
+    store.grow(-state.window_bytes)
+    state.window_bytes = 0
+    if state.db is not None:
+        state.db.close()
+        state.db = None
+        try:
+            os.unlink(state.path)
+        except OSError:
+            pass
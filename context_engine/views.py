@@ -0,0 +1,87 @@
+import typing as t
+from collections.abc import MutableMapping
+
+
+class AttrView(MutableMapping):
+    """Read/write attribute access over a dict without copying it.
+
+       Loop variables bound to dict items are wrapped in a view so expressions
+       can use locals.item.field while reads and writes go straight to the
+       record in the source collection. Nested dicts are wrapped lazily when
+       they are accessed, values of any other type are returned as is.
+
+       A view is a MutableMapping, not a dict: use unwrap(view) where a dict is
+       required and json.dumps(value, default=json_default) to serialize.
+    """
+    __slots__ = ("__data",)
+
+    def __init__(self, data:t.Dict) -> None:
+        object.__setattr__(self, "_AttrView__data", data)
+
+    def __getattr__(self, name):
+        try:
+            value = self.__data[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        return AttrView(value) if type(value) is dict else value
+
+    def __setattr__(self, name, value):
+        self.__data[name] = value
+
+    def __delattr__(self, name):
+        try:
+            del self.__data[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __getitem__(self, key):
+        value = self.__data[key]
+        return AttrView(value) if type(value) is dict else value
+
+    def __setitem__(self, key, value):
+        self.__data[key] = value
+
+    def __delitem__(self, key):
+        del self.__data[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.__data
+
+    def __iter__(self):
+        return iter(self.__data)
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def __eq__(self, other) -> bool:
+        return self.__data == unwrap(other)
+
+    def __ne__(self, other) -> bool:
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"AttrView({self.__data!r})"
+
+    def __reduce__(self):
+        return (AttrView,(self.__data,))
+
+    def copy(self) -> t.Dict:
+        return self.__data.copy()
+
+
+def unwrap(value:t.Any) -> t.Any:
+    """Returns the dict behind an AttrView, any other value unchanged.
+    """
+    if type(value) is AttrView:
+        return value._AttrView__data
+    return value
+
+
+def json_default(value:t.Any) -> t.Any:
+    """json.dumps default hook serializing views as the dicts behind them.
+    """
+    if type(value) is AttrView:
+        return value._AttrView__data
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -2,10 +2,10 @@ from context_engine import Context,Engine
 from functools import update_wrapper
 import typing as t
 
-def if_single_make_array(f,*args,**kwargs):
-    def wrapper(f):
+def if_single_make_array(f):
+    def wrapper(*args,**kwargs):
         val = f(*args,**kwargs)
-        if val is list:
+        if type(val) is list:
             return val
         else:
             return [val]
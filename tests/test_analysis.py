@@ -0,0 +1,156 @@
+from context_engine import init_engine
+from context_engine.analysis import dependencies, expression_effects, step_effects
+import pytest
+import time
+
+def get_engine(process):
+    engine, context = init_engine({"process":process})
+    return engine, context
+
+def test_expression_effects():
+    engine, context = get_engine([])
+    
+    effects = expression_effects("set('report.total',sum(orders) + tax)",context)
+    assert effects.reads == {"orders","tax"}
+    assert effects.writes == {"report"}
+    
+    effects = expression_effects("seen.append(locals.i)",context)
+    assert effects.reads == {"seen","locals"}
+    assert effects.writes == {"seen"}
+    
+    assert expression_effects("[x * 2 for x in items]",context).reads == {"items"}
+    assert expression_effects("set(name,1)",context) is None
+    assert expression_effects("eval('a')",context) is None
+    
+def test_call_arguments_may_be_written():
+    engine, context = get_engine([])
+    context.helper = object()
+    context.out = []
+    
+    assert expression_effects("helper.fill(target)",context).writes == {"helper","target"}
+    assert expression_effects("out.append(item)",context).writes == {"out"}
+    assert expression_effects("later.extend(item)",context).writes == {"later"}
+    assert expression_effects("list.append(item,1)",context).writes == {"item"}
+    assert expression_effects("locals.o.lines.append(1)",context).writes == {"locals"}
+    assert expression_effects("len(items) + max(items)",context).writes == set()
+    assert expression_effects("next(gen)",context) is None
+    assert expression_effects("os.remove(path)",context) is None
+    
+def test_component_declared_effects():
+    engine, context = get_engine([{"step":"fetch"},{"step":"other"}])
+    
+    @engine.component(reads=["config.url"],writes=["rates"])
+    def fetch(engine,context):
+        pass
+    
+    @engine.component()
+    def other(engine,context):
+        pass
+    
+    engine.compile()
+    effects = step_effects(engine.plan[0],context)
+    assert (effects.reads, effects.writes) == ({"config"},{"rates"})
+    assert step_effects(engine.plan[1],context) is None
+    
+def test_for_each_writing_items_writes_collection():
+    engine, context = get_engine([
+        {"flow":"for each","collection":"orders","var":"o",
+         "steps":[{"expressions":["set('locals.o.total',locals.o.price * 2)"]}]},
+        {"flow":"for each","collection":"orders","var":"o",
+         "steps":[{"expressions":["totals.append(locals.o.price)"]}]},
+    ])
+    engine.compile()
+    
+    assert "orders" in step_effects(engine.plan[0],context).writes
+    assert "orders" not in step_effects(engine.plan[1],context).writes
+    
+def test_dependencies():
+    engine, context = get_engine([
+        {"expressions":["set('a',1)"]},
+        {"expressions":["set('b',2)"]},
+        {"expressions":["set('c',a + b)"]},
+        {"step":"unknown"},
+        {"expressions":["set('d',1)"]},
+        {"expressions":["set('e',1)"]},
+    ])
+    
+    @engine.component()
+    def unknown(engine,context):
+        pass
+    
+    engine.compile()
+    assert dependencies(engine.plan.nodes,context) == [
+        frozenset(),frozenset(),{0,1},{0,1,2},{3},{3}
+    ]
+    
+def get_sleepy_engine():
+    engine, context = get_engine([{"step":"load_a"},{"step":"load_b"},
+                                  {"expressions":["set('total',a + b)"]}])
+    context.order = []
+    
+    @engine.component(writes=["a"])
+    def load_a(engine,context):
+        time.sleep(0.2)
+        context.order.append("a")
+        context.a = 1
+        
+    @engine.component(writes=["b"])
+    def load_b(engine,context):
+        time.sleep(0.1)
+        context.order.append("b")
+        context.b = 2
+    
+    return engine, context
+    
+def test_parallel_steps_overlap_independent_steps():
+    engine, context = get_sleepy_engine()
+    engine.enable_parallel_steps()
+    
+    start = time.perf_counter()
+    engine.run()
+    elapsed = time.perf_counter() - start
+    
+    assert context.total == 3
+    assert context.order == ["b","a"]
+    assert elapsed < 0.28
+    assert engine.is_finished
+    
+def test_parallel_steps_raise_first_error_in_document_order():
+    engine, context = get_sleepy_engine()
+    
+    @engine.component(writes=["b"])
+    def load_b(engine,context):
+        raise ValueError("b failed")
+    
+    engine.enable_parallel_steps()
+    with pytest.raises(ValueError):
+        engine.run()
+    assert "total" not in context
+    
+def test_parallel_steps_wait_for_map_expression_reads():
+    engine, context = get_engine([
+        {"step":"load_factor"},
+        {"flow":"map","collection":"items","var":"i","expression":"locals.i * factor","result":"out"},
+    ])
+    context.items = [1,2,3]
+    context.factor = 1
+    
+    @engine.component(writes=["factor"])
+    def load_factor(engine,context):
+        time.sleep(0.05)
+        context.factor = 10
+    
+    engine.compile()
+    assert "factor" in step_effects(engine.plan[1],context).reads
+    engine.enable_parallel_steps()
+    engine.run()
+    
+    assert context.out == [10,20,30]
+    
+def test_unknown_flow_members_have_unknown_effects():
+    engine, context = get_engine([
+        {"flow":"block","steps":[{"expressions":["set('a',1)"]}],"timeout":"limits.block"},
+    ])
+    engine.compile()
+    
+    assert step_effects(engine.plan[0],context) is None
@@ -0,0 +1,125 @@
+import json
+import os
+
+from context_engine import init_engine
+from context_engine.checkpoint import CheckpointError
+import pytest
+
+def get_engine(process, fail_at=None):
+    engine, context = init_engine({"process":process})
+    
+    @engine.component()
+    def boom(engine,context):
+        position = context.locals.get("i",context.locals.get("n"))
+        if position == fail_at:
+            raise RuntimeError("worker died")
+        context.out.append(position)
+        
+    return engine, context
+
+def crash_and_resume(process, directory, fail_at, **options):
+    engine, context = get_engine(process,fail_at)
+    context.out = []
+    engine.enable_checkpoints(directory,**options)
+    with pytest.raises(RuntimeError):
+        engine.run()
+    
+    engine, context = get_engine(process)
+    engine.resume(directory)
+    return context
+    
+def test_resume_top_level_steps(tmp_path):
+    process = [{"step":"boom","args":"a"},{"step":"boom","args":"b"},{"step":"boom","args":"c"}]
+    engine, context = init_engine({"process":process})
+    
+    @engine.component()
+    def boom(engine,context):
+        if context.args == "b" and not context.get("resumed"):
+            raise RuntimeError("worker died")
+        context.out.append(context.args)
+    
+    context.out = []
+    engine.enable_checkpoints(tmp_path)
+    with pytest.raises(RuntimeError):
+        engine.run()
+    context.out.append("lost")
+    context.resumed = True
+    engine.resume(tmp_path)
+    
+    assert context.out == ["a","b","c"]
+    
+def test_resume_for_each_position(tmp_path):
+    process = [{"flow":"for each","collection":"items","var":"i","steps":[{"step":"boom"}]}]
+    engine, context = get_engine(process,fail_at=3)
+    context.out = []
+    context.items = list(range(6))
+    engine.enable_checkpoints(tmp_path,loop_every=2)
+    with pytest.raises(RuntimeError):
+        engine.run()
+    
+    engine, context = get_engine(process)
+    engine.resume(tmp_path)
+    
+    assert context.out == [0,1,2,3,4,5]
+    
+def test_resume_while_counter(tmp_path):
+    process = [{"flow":"while","var":"n","conditions":["locals.n < 5"],"steps":[{"step":"boom"}]}]
+    context = crash_and_resume(process,tmp_path,fail_at=3,loop_every=1)
+    
+    assert context.out == [0,1,2,3,4]
+    
+def test_resume_do_while_skips_first_pass(tmp_path):
+    process = [{"flow":"do while","var":"n","conditions":["locals.n < 4"],"steps":[{"step":"boom"}]}]
+    context = crash_and_resume(process,tmp_path,fail_at=2,loop_every=1)
+    
+    assert context.out == [0,1,2,3]
+    
+def test_checkpoint_blobs_are_shared_and_pruned(tmp_path):
+    process = [{"expressions":["set('a',1)"]},{"expressions":["set('b',1)"]},{"expressions":["set('a',2)"]}]
+    engine, context = init_engine({"process":process})
+    checkpoints = engine.enable_checkpoints(tmp_path)
+    engine.run()
+    
+    with open(tmp_path / "manifest.json") as source:
+        manifest = json.load(source)
+    
+    assert checkpoints.saves == 4
+    assert manifest["index"] == 3
+    assert set(os.listdir(tmp_path / "blobs")) == set(manifest["keys"].values())
+    assert len(os.listdir(tmp_path / "blobs")) == 2
+    
+def test_resume_without_checkpoint(tmp_path):
+    engine, context = init_engine({"process":[]})
+    
+    with pytest.raises(CheckpointError):
+        engine.resume(tmp_path)
+    
+def test_checkpoint_packs_only_touched_keys(tmp_path, monkeypatch):
+    import context_engine.checkpoint as checkpoint
+    packed = []
+    pack = checkpoint.pack
+    def counting_pack(value):
+        packed.append(value)
+        return pack(value)
+    monkeypatch.setattr(checkpoint,"pack",counting_pack)
+    
+    process = [{"expressions":["set('a',1)"]},{"expressions":["big.append(2)"]},{"expressions":["set('b',3)"]}]
+    engine, context = init_engine({"process":process})
+    context.big = list(range(1000))
+    engine.enable_checkpoints(tmp_path)
+    engine.run()
+    
+    assert packed == [context.big,1,context.big,3]
+    engine, context = init_engine({"process":process})
+    engine.resume(tmp_path)
+    assert context.big[-1] == 2 and context.b == 3
+    
+def test_resume_refuses_changed_process(tmp_path):
+    process = [{"expressions":["set('a',1)"]},{"expressions":["set('b',2)"]}]
+    engine, context = init_engine({"process":process})
+    engine.enable_checkpoints(tmp_path)
+    engine.run()
+    
+    engine, context = init_engine({"process":process[:1] + [{"expressions":["set('b',3)"]}]})
+    with pytest.raises(CheckpointError):
+        engine.resume(tmp_path)
@@ -0,0 +1,106 @@
+import json
+import pytest
+
+from context_engine import init_engine
+from context_engine import loader
+from context_engine.cli import main
+from context_engine.loader import parse_jsonc, validate_process, ProcessValidationError
+
+DOCUMENT = """
+{
+    "process":[
+        {
+            /*
+            comment blocks and trailing commas are allowed
+            */
+            "expressions":[
+                // set a value
+                "set('url','http://example.com/a//b')",
+                "set('doubled',value * 2)",
+            ],
+        },
+        {
+            "step":"teststep",
+            "args":"doubled"
+        }
+    ]
+}
+"""
+
+MODULE = """
+def register(engine,context):
+    @engine.component()
+    def teststep(engine,context):
+        context.test = context[context.args] + 1
+"""
+
+def test_parse_jsonc_keeps_strings():
+    doc = parse_jsonc(DOCUMENT)
+    
+    assert doc["process"][0]["expressions"][0] == "set('url','http://example.com/a//b')"
+    assert len(doc["process"][0]["expressions"]) == 2
+    
+def test_cli_runs_document_with_module(tmp_path,capsys,monkeypatch):
+    monkeypatch.setenv("CONTEXT_ENGINE_CACHE_DIR",str(tmp_path / "cache"))
+    (tmp_path / "process.jsonc").write_text(DOCUMENT)
+    (tmp_path / "components.py").write_text(MODULE)
+    
+    code = main([str(tmp_path / "process.jsonc"),"-m",str(tmp_path / "components.py"),
+                 "--set","value=20","--print","test","--print","url",
+                 "--time","--steps","--memory","--cprofile",str(tmp_path / "run.prof")])
+    
+    out, err = capsys.readouterr()
+    assert code == 0
+    assert [json.loads(line) for line in out.splitlines()] == [41,"http://example.com/a//b"]
+    assert "compile" in err
+    assert "process[1]" in err
+    assert "peak memory" in err
+    assert (tmp_path / "run.prof").exists()
+    
+def test_cli_records_and_replays(tmp_path,capsys,monkeypatch):
+    monkeypatch.setenv("CONTEXT_ENGINE_CACHE_DIR",str(tmp_path / "cache"))
+    (tmp_path / "process.jsonc").write_text(DOCUMENT)
+    (tmp_path / "components.py").write_text(MODULE)
+    command = [str(tmp_path / "process.jsonc"),"-m",str(tmp_path / "components.py"),
+               "--set","value=20","--print","test"]
+    trace = str(tmp_path / "run.trace")
+    
+    assert main(command + ["--record",trace]) == 0
+    assert main(command + ["--replay",trace]) == 0
+    
+    out, err = capsys.readouterr()
+    assert out.splitlines() == ["41","41"]
+    assert "recorded 1 calls" in err
+    assert "replayed 1 calls" in err
+    
+def test_load_process_uses_disk_cache(tmp_path,monkeypatch):
+    (tmp_path / "process.jsonc").write_text(DOCUMENT)
+    cache_dir = tmp_path / "cache"
+    
+    document = loader.load_process(tmp_path / "process.jsonc",cache_dir=str(cache_dir))
+    loader._loaded.clear()
+    
+    def fail(text):
+        raise AssertionError("parsed again")
+    monkeypatch.setattr(loader,"parse_jsonc",fail)
+    monkeypatch.setattr(loader,"validate_process",fail)
+    
+    assert loader.load_process(tmp_path / "process.jsonc",cache_dir=str(cache_dir)) == document
+    assert len(list(cache_dir.iterdir())) == 1
+    
+def test_init_engine_loads_document_path(tmp_path,monkeypatch):
+    monkeypatch.setenv("CONTEXT_ENGINE_CACHE_DIR",str(tmp_path / "cache"))
+    (tmp_path / "process.jsonc").write_text(DOCUMENT)
+    
+    engine, context = init_engine(str(tmp_path / "process.jsonc"))
+    
+    assert engine.steps[1]["step"] == "teststep"
+    
+def test_validate_process_reports_path():
+    document = {"process": [{"flow": "block","steps": [{"flow": "for each","steps": []}]}]}
+    
+    with pytest.raises(ProcessValidationError) as x:
+        validate_process(document)
+    
+    assert x.value.path == "process[0].steps[0]"
+    assert "collection" in str(x.value)
@@ -4,6 +4,19 @@ from ctx import Ctx
 import typing as t
 
 from context_engine.engine import Flow, Step
+from context_engine.scope import Scope
+from context_engine.views import AttrView, json_default, unwrap
+from context_engine.cache import ExpressionCache
+from context_engine.decorators import Expression
+from context_engine.commands.command_map import registry
+from context_engine.plan import CompileError
+from context_engine.commands.flows.parallel_foreach_logic import ForEachError
+import pytest
+import asyncio
+import functools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 
         
 def get_process_skeleton(steps:t.List[str]=[]):
@@ -565,6 +578,25 @@ def test_frame_push_step_current_step():
     step = frame.push_step(step)
     assert step is frame.current_step
 
+def test_components_set_step_attributes():
+    pd = get_process_skeleton([get_step(name="mark"),get_step(name="check")])
+    engine, context = init_engine(pd)
+    
+    @engine.component()
+    def mark(engine,context):
+        context.current_step.marker = "set"
+        context.marked = context.current_step.marker
+    
+    @engine.component()
+    def check(engine,context):
+        # the popped step is reused, what mark set must not carry over
+        context.leaked = hasattr(context.current_step,"marker")
+    
+    engine.run()
+    
+    assert context.marked == "set"
+    assert context.leaked == False
+    
 def test_frame_push_flow_step_return_flow():
     flow = get_if()
     frame = Frame()
@@ -724,4 +756,759 @@ def test_frame_link_locals_sub_steps_depth_scope_ref_value():
 # def test_thing():
 #     engine, context = init_engine()
 #     f = Frame()
-#     f.
\ No newline at end of file
+#     f.
+
+def test_expression_cache_compiles_loop_expressions_once():
+    steps = [ get_expression(["outlist.append(locals.i * 2)"]) ]
+    fl = get_for_each('test_col','i',steps)
+    pd = get_process_skeleton([fl])
+    
+    engine, context = init_engine(pd)
+    
+    context.test_col = [ x for x in range(10)]
+    context.outlist = []
+    
+    engine.expression_cache.clear()
+    engine.run()
+    
+    assert context.outlist[-1] == 18
+    assert engine.expression_cache.misses == 1
+    
+    engine2, context2 = init_engine(pd)
+    context2.test_col = [1]
+    context2.outlist = []
+    engine2.run()
+    
+    assert engine.expression_cache.misses == 1
+    assert engine.expression_cache.hits == 1
+    
+def test_expression_cache_evicts_least_recently_used():
+    cache = ExpressionCache(maxsize=2)
+    
+    first = cache.compile("1 + 1")
+    cache.compile("2 + 2")
+    cache.compile("1 + 1")
+    cache.compile("3 + 3")
+    
+    assert cache.evictions == 1
+    assert cache.compile("1 + 1") is first
+    assert cache.stats["size"] == 2
+    
+def test_engine_compile_resolves_components():
+    test_process = get_process_skeleton([get_step('teststep',["set('x',1)"])])
+    engine, context = init_engine(test_process)
+    
+    @engine.component()
+    def teststep(engine,context):
+        context.test = context.x
+    
+    plan = engine.compile()
+    
+    assert plan[0].component is engine.step_functions['teststep']
+    
+    engine.run()
+    engine.run()
+    
+    assert engine.plan is plan
+    assert context.test == 1
+    
+def test_engine_compile_unknown_step_raises():
+    test_process = get_process_skeleton([get_block([get_step('missing')])])
+    engine, context = init_engine(test_process)
+    
+    with pytest.raises(CompileError) as x:
+        engine.compile()
+        
+    assert x.value.path == "process[0].steps[0]"
+    
+def test_engine_compile_syntax_error_raises():
+    test_process = get_process_skeleton([get_if(["t1 =="],[])])
+    engine, context = init_engine(test_process)
+    
+    with pytest.raises(CompileError) as x:
+        engine.run()
+    
+    assert x.value.path == "process[0].conditions[0]"
+    
+def test_engine_register_component_drops_plan():
+    test_process = get_process_skeleton([get_step('teststep')])
+    engine, context = init_engine(test_process)
+    
+    with pytest.raises(CompileError):
+        engine.compile()
+    
+    @engine.component()
+    def teststep(engine,context):
+        context.test = 'Pass'
+    
+    engine.run()
+    
+    assert context.test == 'Pass'
+    
+def test_try_catch_restores_frame_stacks():
+    pd = get_process_skeleton([
+        get_try([get_block([get_expression(["undefined_name"])])],
+                [get_expression(['set("error",locals._)'])])
+    ])
+    
+    engine, context = init_engine(pd)
+    engine.run()
+    
+    assert type(context.error) is Exception
+    assert engine.frame.flow_stack_is_empty
+    assert engine.is_finished
+    
+def test_frame_reuses_popped_steps():
+    frame = Frame()
+    
+    step1 = frame.push_step(get_step(name="step1",args="a"))
+    frame.pop_step()
+    step2 = frame.push_step(get_step(name="step2",args="b"))
+    
+    assert step1 is step2
+    assert step2.step == "step2"
+    assert step2.args == "b"
+    
+def test_frame_step_references_document():
+    doc = get_for_each('test_col','i',[])
+    doc["custom"] = 1
+    frame = Frame()
+    
+    flow = frame.push_flow(doc)
+    flow.var = '_'
+    
+    assert flow.fields is doc
+    assert flow.custom == 1
+    assert doc["var"] == 'i'
+    
+def test_scope_reads_parent_writes_local():
+    parent = Ctx()
+    parent.a = 1
+    scope = Scope(parent)
+    scope.b = 2
+    scope.a = 3
+    
+    assert scope.a == 3 and scope.b == 2
+    assert parent.a == 1 and 'b' not in parent
+    assert set(scope.keys()) == {'a','b'}
+    assert scope.get('c') is None
+    
+def test_scope_sees_later_parent_writes():
+    parent = Ctx()
+    scope = Scope(Scope(parent))
+    parent.late = 'x'
+    
+    assert scope.late == 'x'
+    assert 'late' in scope
+    assert dict(scope) == {'late':'x'}
+    with pytest.raises(AttributeError):
+        scope.missing
+    
+def test_frame_push_flow_layers_locals():
+    frame = Frame()
+    frame.push_flow(get_if())
+    frame.push_step(get_step(name="step1"))
+    frame.current_step.locals.outer = 1
+    flow = frame.push_flow(get_if())
+    
+    assert isinstance(flow.locals,Scope)
+    assert len(dict.keys(flow.locals)) == 0
+    assert flow.locals.outer == 1
+    
+def test_for_each_dict_items_are_views():
+    steps = [ get_expression(["set('locals.r.total',locals.r.price * locals.r.meta.qty)",
+                              "set('locals.r.meta.seen',True)",
+                              "views.append(locals.r)"]) ]
+    pd = get_process_skeleton([get_for_each('records','r',steps)])
+    records = [{"price":2,"meta":{"qty":3}},{"price":5,"meta":{"qty":1}}]
+    
+    engine, context = init_engine(pd)
+    context.records = records
+    context.views = []
+    engine.run()
+    
+    assert records[0] == {"price":2,"meta":{"qty":3,"seen":True},"total":6}
+    assert records[1]["total"] == 5
+    assert all(unwrap(view) is record for view, record in zip(context.views,records))
+    
+def test_attr_view_wraps_nested_lazily():
+    record = {"a":{"b":1},"c":[1]}
+    view = AttrView(record)
+    view.a.b = 2
+    view["d"] = 3
+    
+    assert record == {"a":{"b":2},"c":[1],"d":3}
+    assert isinstance(view["a"],AttrView) and view.c is record["c"]
+    assert view == record
+    with pytest.raises(AttributeError):
+        view.missing
+    
+def test_for_each_dict_items_serialize_with_json_default():
+    steps = [ get_expression(["dumped.append(to_json(locals.r))"]) ]
+    pd = get_process_skeleton([get_for_each('records','r',steps)])
+    engine, context = init_engine(pd)
+    context.records = [{"price":2,"meta":{"qty":3}}]
+    context.dumped = []
+    
+    @context.expression()
+    def to_json(context,record):
+        assert unwrap(record) is context.records[0]
+        return json.dumps(record,default=json_default)
+    
+    engine.run()
+    
+    assert context.dumped == ['{"price": 2, "meta": {"qty": 3}}']
+    with pytest.raises(TypeError):
+        json.dumps(object(),default=json_default)
+    
+def get_cached_lookup_engine(steps):
+    pd = get_process_skeleton([get_for_each('test_col','i',steps)])
+    engine, context = init_engine(pd)
+    context.test_col = range(5)
+    context.calls = []
+    return engine, context
+
+def test_component_cache_reuses_results_per_args():
+    step = get_step(name="lookup",args="schema_a")
+    step["result"] = "locals.schema"
+    engine, context = get_cached_lookup_engine([step,get_expression(["out.append(locals.schema)"])])
+    context.out = []
+    
+    @engine.component(cache=True)
+    def lookup(engine,context):
+        context.calls.append(context.args)
+        return {"name":context.args}
+    
+    engine.run()
+    
+    assert context.calls == ["schema_a"]
+    assert context.out == [{"name":"schema_a"}] * 5
+    assert engine.cache_stats["lookup"]["hits"] == 4
+    
+def test_step_cache_flag_and_result():
+    uncached = get_step(name="lookup",args="a")
+    cached = get_step(name="lookup",args="b")
+    cached["cache"] = {"maxsize":1}
+    cached["result"] = "last"
+    engine, context = get_cached_lookup_engine([uncached,cached])
+    
+    @engine.component()
+    def lookup(engine,context):
+        context.calls.append(context.args)
+        return context.args.upper()
+    
+    engine.run()
+    
+    assert context.calls == ["a","b","a","a","a","a"]
+    assert context.last == "B"
+    assert engine.cache_stats == {"process[0].steps[1]":{"hits":4,"misses":1,"evictions":0,
+                                  "expirations":0,"uncacheable":0,"size":1,"maxsize":1}}
+    
+def test_component_cache_key_function():
+    step = get_step(name="lookup",args={"table":"t","row":1})
+    engine, context = get_cached_lookup_engine([step])
+    
+    @engine.component(cache=True,key=lambda args: args["table"])
+    def lookup(engine,context):
+        context.calls.append(context.args["table"])
+    
+    engine.run()
+    
+    assert context.calls == ["t"]
+    
+def test_expression_cache_ttl_and_lru():
+    engine, context = get_cached_lookup_engine([])
+    now = [0.0]
+    
+    @context.expression(cache=True,maxsize=2,ttl=10)
+    def square(context,x):
+        context.calls.append(x)
+        return x * x
+    square.result_cache.clock = lambda: now[0]
+    
+    assert [square(2),square(2),square(3),square(4),square(2)] == [4,4,9,16,4]
+    now[0] = 11
+    assert context.eval_expression("square(4)") == 16
+    
+    assert context.calls == [2,3,4,2,4]
+    assert square.result_cache.stats["evictions"] == 2
+    assert square.result_cache.stats["expirations"] == 1
+    assert engine.cache_stats["square"]["hits"] == 1
+    
+def test_expression_cache_freezes_arguments():
+    engine, context = get_cached_lookup_engine([])
+    
+    @context.expression(cache=True)
+    def size(context,value):
+        context.calls.append(1)
+        return len(value)
+    
+    assert size([1,{"a":[2]}]) == size([1,{"a":[2]}]) == 2
+    assert size(bytearray(b"ab")) == size(bytearray(b"ab")) == 2
+    
+    assert len(context.calls) == 3
+    assert size.result_cache.stats["uncacheable"] == 2
+    
+def test_cache_keys_tell_types_apart():
+    engine, context = get_cached_lookup_engine([])
+    
+    @context.expression(cache=True)
+    def kind(context,value):
+        return type(value).__name__
+    
+    assert [kind(1),kind(True),kind(1.0)] == ["int","bool","float"]
+    assert [kind([1,2]),kind((1,2)),kind({"a":[1]}),kind({"a":(1,)})] == ["list","tuple","dict","dict"]
+    assert kind.result_cache.stats["hits"] == 0
+    
+def test_step_cache_options_keep_component_key():
+    # without the key function the unhashable args would miss every time
+    step = get_step(name="lookup",args={"table":"t","raw":bytearray(b"row")})
+    step["cache"] = {"maxsize":4}
+    engine, context = get_cached_lookup_engine([step])
+    
+    @engine.component(cache=True,key=lambda args: args["table"])
+    def lookup(engine,context):
+        context.calls.append(context.args["table"])
+    
+    engine.run()
+    
+    assert context.calls == ["t"]
+    
+def get_parallel_for_each(collection:str='',var:t.Union[str,t.List[str]]='',steps:t.List[t.Any]=[],**options):
+    flow = get_for_each(collection,var,steps)
+    flow["flow"] = "parallel for each"
+    flow.update(options)
+    return flow
+    
+def test_parallel_for_each_results_ordered():
+    steps = [ get_expression(["set('locals.square',locals.i * locals.i)",
+                              "outlist.append(locals.i)"]) ]
+    pd = get_process_skeleton([get_parallel_for_each('test_col','i',steps,max_workers=4,results='squares')])
+    
+    engine, context = init_engine(pd)
+    context.test_col = [ x for x in range(50)]
+    context.outlist = []
+    
+    engine.run()
+    
+    assert sorted(context.outlist) == context.test_col
+    assert [r.square for r in context.squares] == [ x * x for x in range(50)]
+    assert engine.frame.flow_stack_is_empty
+    
+def test_for_each_parallel_option_isolates_locals():
+    steps = [ get_expression(["set('locals.seen',locals.get('seen',[]) + [locals.i])"]) ]
+    fl = get_for_each('test_col','i',steps)
+    fl.update(parallel=True,results='out')
+    pd = get_process_skeleton([fl])
+    
+    engine, context = init_engine(pd)
+    context.test_col = [ x for x in range(10)]
+    
+    engine.run()
+    
+    assert [r.seen for r in context.out] == [ [x] for x in range(10)]
+    
+def test_parallel_for_each_error_caught_by_try():
+    steps = [ get_expression(["fail_on(locals.i)"]) ]
+    pd = get_process_skeleton([
+        get_try([get_parallel_for_each('test_col','i',steps)],
+                [get_expression(['set("error",locals._)'])])
+    ])
+    
+    engine, context = init_engine(pd)
+    context.test_col = [ x for x in range(10)]
+    
+    @context.expression()
+    def fail_on(context,i):
+        if i == 3:
+            raise ValueError(i)
+    
+    engine.run()
+    
+    assert type(context.error) is Exception
+    assert engine.frame.flow_stack_is_empty
+    
+def test_parallel_for_each_collects_all_errors():
+    steps = [ get_expression(["fail_on(locals.i)"]) ]
+    pd = get_process_skeleton([get_parallel_for_each('test_col','i',steps,fail_on_error=False)])
+    
+    engine, context = init_engine(pd)
+    context.test_col = [ x for x in range(10)]
+    context.ran = []
+    
+    @context.expression()
+    def fail_on(context,i):
+        context.ran.append(i)
+        if i % 3 == 0:
+            raise ValueError(i)
+    
+    with pytest.raises(ForEachError) as x:
+        engine.run()
+    
+    assert sorted(context.ran) == context.test_col
+    assert [index for index,_ in x.value.errors] == [0,3,6,9]
+    
+def test_run_async_awaits_async_components_and_expressions():
+    pd = get_process_skeleton([
+        get_expression(["set('fetched',fetch('a'))"]),
+        get_step('teststep')
+    ])
+    engine, context = init_engine(pd)
+    
+    @context.expression()
+    async def fetch(context,key):
+        await asyncio.sleep(0)
+        return f"{key}_value"
+    
+    @engine.component()
+    async def teststep(engine,context):
+        await asyncio.sleep(0)
+        context.test = context.fetched
+    
+    asyncio.run(engine.run_async())
+    
+    assert context.test == 'a_value'
+    
+def test_run_async_parallel_for_each_runs_items_concurrently():
+    steps = [ get_expression(["outlist.append(wait(locals.i))"]) ]
+    pd = get_process_skeleton([get_parallel_for_each('test_col','i',steps,max_workers=10)])
+    engine, context = init_engine(pd)
+    context.test_col = [ x for x in range(10)]
+    context.outlist = []
+    
+    @context.expression()
+    async def wait(context,i):
+        await asyncio.sleep(0.2)
+        return i
+    
+    async def main():
+        start = time.perf_counter()
+        await asyncio.gather(engine.run_async(),asyncio.sleep(0))
+        return time.perf_counter() - start
+    
+    assert asyncio.run(main()) < 1.0
+    assert sorted(context.outlist) == context.test_col
+    
+def test_run_sync_resolves_async_component():
+    engine, context = init_engine(get_process_skeleton([get_step('teststep')]))
+    
+    @engine.component()
+    async def teststep(engine,context):
+        context.test = 'Pass'
+        
+    engine.run()
+    
+    assert context.test == 'Pass'
+    
+def test_partials_and_async_callables_are_awaited():
+    engine, context = init_engine(get_process_skeleton([
+        get_expression(["set('fetched',fetch('a'))"]),
+        get_step('teststep')
+    ]))
+    
+    async def fetch(context,key,prefix):
+        await asyncio.sleep(0)
+        return f"{prefix}{key}"
+    
+    class Step():
+        async def __call__(self,engine,context):
+            await asyncio.sleep(0)
+            context.test = context.fetched
+    
+    context.expression("fetch")(functools.partial(fetch,prefix="got_"))
+    engine.component("teststep")(Step())
+    engine.run()
+    
+    assert context.test == 'got_a'
+    
+def get_run_many_engine():
+    pd = get_process_skeleton([
+        get_expression(["set('doubled',value * 2)"]),
+        get_step('teststep')
+    ])
+    engine, context = init_engine(pd)
+    
+    @engine.component()
+    def teststep(engine,context):
+        if context.value == 3:
+            raise ValueError("bad value")
+        context.test = context.doubled + 1
+        
+    return engine, context
+    
+def test_run_many_threads_results_in_order():
+    engine, context = get_run_many_engine()
+    
+    results = engine.run_many([{"value": x} for x in range(8)],workers=4)
+    
+    assert [r.context.test for r in results if r.ok] == [ x * 2 + 1 for x in range(8) if x != 3]
+    assert type(results[3].error) is ValueError
+    assert "value" not in context.keys()
+    
+def test_run_many_processes_results_in_order():
+    engine, context = get_run_many_engine()
+    
+    results = engine.run_many([{"value": x} for x in range(8)],workers=2,mode="process")
+    
+    assert results[7].context.test == 15
+    assert type(results[3].error) is ValueError
+    assert not any(isinstance(v,Expression) for r in results for v in r.context.values())
+    
+def test_run_many_processes_from_concurrent_threads():
+    engines = [get_run_many_engine()[0] for _ in range(2)]
+    
+    @engines[1].component()
+    def teststep(engine,context):
+        context.test = -context.value
+    
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first, second = pool.map(lambda engine: engine.run_many([{"value": x} for x in range(4)],
+                                                                workers=2,mode="process"),engines)
+    
+    assert [r.context.test for r in first if r.ok] == [1,3,5]
+    assert [r.context.test for r in second] == [0,-1,-2,-3]
+    
+def test_run_many_processes_needs_fork(monkeypatch):
+    import multiprocessing
+    engine, context = get_run_many_engine()
+    monkeypatch.setattr(multiprocessing,"get_all_start_methods",lambda: ["spawn"])
+    
+    with pytest.raises(ValueError):
+        engine.run_many([{"value": x} for x in range(2)],workers=2,mode="process")
+    
+def test_spawn_shares_plan_and_copies_expressions():
+    engine, context = get_run_many_engine()
+    
+    @context.expression()
+    def custom(context):
+        return context.value
+    
+    spawned, spawned_context = engine.spawn()
+    spawned_context.value = 1
+    
+    assert spawned.plan is engine.plan
+    assert spawned.step_functions is engine.step_functions
+    assert spawned_context.eval_expression("custom()") == 1
+    
+def test_spawned_engines_recompile_after_registering():
+    engine, context = get_run_many_engine()
+    spawned, spawned_context = engine.spawn()
+    
+    @engine.component()
+    def teststep(engine,context):
+        context.test = "replaced"
+    
+    assert spawned.plan is None
+    spawned_context.value = 1
+    spawned.run()
+    assert spawned_context.test == "replaced"
+    
+    @spawned.component()
+    def other(engine,context):
+        pass
+    
+    assert engine.plan is None and spawned.plan is None
+    
+def test_for_each_consumes_generator_lazily():
+    steps = [ get_expression(["outlist.append((locals.i,len(pulled)))"]) ]
+    pd = get_process_skeleton([get_for_each('test_col','i',steps)])
+    engine, context = init_engine(pd)
+    context.pulled = []
+    context.outlist = []
+    
+    def generate():
+        for x in range(3):
+            context.pulled.append(x)
+            yield x
+    
+    context.test_col = generate()
+    
+    engine.run()
+    
+    assert context.outlist == [(0,1),(1,2),(2,3)]
+    
+def test_for_each_batch_size_binds_chunks():
+    steps = [ get_expression(["outlist.append(locals.batch)"]) ]
+    fl = get_for_each('data.rows','batch',steps)
+    fl["batch_size"] = 2
+    pd = get_process_skeleton([fl])
+    engine, context = init_engine(pd)
+    context.data = {"rows": (x for x in range(5))}
+    context.outlist = []
+    
+    engine.run()
+    
+    assert context.outlist == [[0,1],[2,3],[4]]
+    
+def test_for_each_batch_size_two_variables():
+    steps = [ get_expression(["set(f'batch_{locals.k}',locals.v)"]) ]
+    fl = get_for_each('test_col',['k','v'],steps)
+    fl["batch_size"] = 2
+    pd = get_process_skeleton([fl])
+    engine, context = init_engine(pd)
+    context.test_col = {"a": 1,"b": 2,"c": 3}
+    
+    engine.run()
+    
+    assert context.batch_0 == [("a",1),("b",2)]
+    assert context.batch_1 == [("c",3)]
+    
+def get_map(collection:str='',var:str='',expression:str='',**options):
+    flow = {
+        "flow":"map",
+        "collection":collection,
+        "var":var,
+        "expression":expression
+    }
+    flow.update(options)
+    return flow
+    
+def get_counted_map_engine(flow,collection):
+    engine, context = init_engine(get_process_skeleton([flow]))
+    context.test_col = collection
+    context.calls = 0
+    
+    @context.expression()
+    def counted(context,value):
+        context.calls += 1
+        return value
+    
+    return engine, context
+    
+def test_map_records_writes_field():
+    records = [{"price": x,"qty": 2} for x in range(5)]
+    engine, context = get_counted_map_engine(
+        get_map('test_col','o','counted(locals.o.price) * locals.o.qty',field='total',result='totals'),records)
+    
+    engine.run()
+    
+    assert [r["total"] for r in records] == [ x * 2 for x in range(5)]
+    assert context.totals == [ x * 2 for x in range(5)]
+    
+def test_map_vectorizes_numeric_records(monkeypatch):
+    pytest.importorskip("numpy")
+    from context_engine.commands.flows import map_logic
+    records = [{"price": x,"qty": 2} for x in range(5)]
+    engine, context = get_counted_map_engine(
+        get_map('test_col','o','abs(locals.o.price - 2) * locals.o.qty + rate',result='totals'),records)
+    context.rate = 0.5
+    monkeypatch.setattr(map_logic,"map_items",None)
+    
+    engine.run()
+    
+    assert context.totals == [ abs(x - 2) * 2 + 0.5 for x in range(5)]
+    
+def test_map_runs_other_calls_once_per_item():
+    pytest.importorskip("numpy")
+    records = [{"price": x,"qty": 2} for x in range(5)]
+    engine, context = get_counted_map_engine(
+        get_map('test_col','o','counted(locals.o.price) * locals.o.qty',result='totals'),records)
+    
+    engine.run()
+    
+    assert context.totals == [ x * 2 for x in range(5)]
+    assert context.calls == 5
+    
+@pytest.mark.parametrize("expression,expected",[
+    ("str(locals.n)",["1","2","3"]),
+    ("len(str(locals.n))",[1,1,1]),
+    ("locals.n ** 40",[n ** 40 for n in (1,2,3)]),
+    ("locals.n * 2 ** 62",[n * 2 ** 62 for n in (1,2,3)]),
+    ("-locals.n < 0",[True,True,True]),
+    ("7",[7,7,7]),
+])
+def test_map_results_match_per_item(expression,expected):
+    pytest.importorskip("numpy")
+    engine, context = init_engine(get_process_skeleton([get_map('numbers','n',expression,result='out')]))
+    context.numbers = [1,2,3]
+    
+    engine.run()
+    
+    assert context.out == expected
+    
+def test_map_division_by_zero_raises_like_per_item():
+    pytest.importorskip("numpy")
+    engine, context = init_engine(get_process_skeleton([get_map('numbers','n','1 / locals.n',result='out')]))
+    context.numbers = [1,0,3]
+    
+    with pytest.raises(ZeroDivisionError):
+        engine.run()
+    
+def test_map_columns_and_numbers():
+    engine, context = init_engine(get_process_skeleton([
+        get_map('columns','c','locals.c.a + locals.c.b',field='total'),
+        get_map('numbers','n','locals.n * 10',result='tens')
+    ]))
+    context.columns = {"a": [1,2],"b": [3,4]}
+    context.numbers = [1,2,3]
+    
+    engine.run()
+    
+    assert context.columns["total"] == [4,6]
+    assert context.tens == [10,20,30]
+    
+def test_map_falls_back_per_item():
+    records = [{"name": "a","qty": 1},{"name": "b","qty": 2}]
+    engine, context = get_counted_map_engine(
+        get_map('test_col','o','f"{locals.o.name}_{counted(locals.o.qty)}"',result='labels'),records)
+    
+    engine.run()
+    
+    assert context.labels == ["a_1","b_2"]
+    assert context.calls == 2
+    
+def test_profiler_records_steps_flows_and_expressions(tmp_path):
+    steps = [ get_step('teststep',["outlist.append(locals.i)"]) ]
+    pd = get_process_skeleton([
+        get_for_each('test_col','i',steps),
+        get_while(['len(outlist) < 5'],[get_expression(["outlist.append(0)"])])
+    ])
+    engine, context = init_engine(pd)
+    context.test_col = [ x for x in range(3)]
+    context.outlist = []
+    
+    @engine.component()
+    def teststep(engine,context):
+        pass
+    
+    profiler = engine.enable_profiler()
+    engine.run()
+    engine.disable_profiler()
+    
+    entries = profiler.entries
+    assert entries[("step","process[0]")].calls == 1
+    assert entries[("flow","for each")].calls == 1
+    assert entries[("step","process[0].steps[0]")].calls == 3
+    assert entries[("step name","teststep")].calls == 3
+    assert entries[("expression","outlist.append(locals.i)")].calls == 3
+    assert entries[("condition","len(outlist) < 5")].calls == 3
+    
+    outer = entries[("step","process[0]")]
+    assert outer.cumulative >= entries[("step","process[0].steps[0]")].cumulative
+    assert outer.self_time <= outer.cumulative
+    assert "teststep" in profiler.report()
+    
+    profiler.write_collapsed(tmp_path / "profile.folded")
+    lines = (tmp_path / "profile.folded").read_text().splitlines()
+    assert any(line.startswith("process[0] for each;process[0].steps[0] teststep;expression ") for line in lines)
+    
+def test_profiler_detached_restores_engine_methods():
+    engine, context = init_engine(get_process_skeleton([get_expression(["set('x',1)"])]))
+    
+    profiler = engine.enable_profiler()
+    engine.disable_profiler()
+    engine.run()
+    
+    assert "do_step" not in vars(engine)
+    assert engine.profiler is None
+    assert profiler.entries == {}
+    
+def test_init_engine_uses_shared_builtin_registry():
+    engine, context = init_engine()
+    engine2, context2 = init_engine()
+    
+    assert registry("flows") is registry("flows")
+    assert set(engine.flow_functions.keys()) == set(name for _,_,name in registry("flows"))
+    assert engine.flow_functions["if"].command is engine2.flow_functions["if"].command
+    assert engine.flow_functions["if"].engine is engine
+    assert context.set.context is context
@@ -0,0 +1,151 @@
+import copy
+import os
+import threading
+
+from context_engine import init_engine
+from context_engine.commands.flows.parallel_foreach_logic import ForEachError
+from context_engine.distributed import LocalTransport, SocketTransport, WorkerError, connect_worker
+import pytest
+
+def get_process(**options):
+    loop = {"flow":"for each","collection":"orders","var":"o","distributed":True,
+            "steps":[{"step":"price"},
+                     {"expressions":["set(f'total_{locals.o.id}',locals.o.qty * rate)"]}]}
+    loop.update(options)
+    return {"process":[loop,{"expressions":["set('done',True)"]}]}
+
+def factory(**options):
+    engine, context = init_engine(get_process(**options))
+    
+    @engine.component()
+    def price(engine,context):
+        if context.locals.o.qty < 0:
+            raise ValueError(f"bad qty {context.locals.o.qty}")
+        context.locals.pid = os.getpid()
+        
+    return engine, context
+
+def get_orders(count):
+    return [{"id":i,"qty":i} for i in range(count)]
+
+def test_distributed_for_each_local_workers():
+    with LocalTransport(factory,processes=2) as transport:
+        engine, context = factory(results="priced",chunk_size=3)
+        engine.enable_workers(transport)
+        context.orders = get_orders(20)
+        context.rate = 2
+        engine.run()
+    
+    assert [context[f"total_{i}"] for i in range(20)] == [i * 2 for i in range(20)]
+    assert [item["o"]["id"] for item in context.priced] == list(range(20))
+    assert len({item["pid"] for item in context.priced}) == 2
+    assert os.getpid() not in {item["pid"] for item in context.priced}
+    assert context.done == True
+    
+def test_distributed_for_each_errors_in_order():
+    with LocalTransport(lambda: factory(fail_on_error=False),processes=2) as transport:
+        engine, context = factory(fail_on_error=False)
+        engine.enable_workers(transport)
+        context.orders = get_orders(6) + [{"id":6,"qty":-1},{"id":7,"qty":-2}]
+        context.rate = 1
+        with pytest.raises(ForEachError) as error:
+            engine.run()
+    
+    assert [position for position, _ in error.value.errors] == [6,7]
+    assert context.total_5 == 5
+    
+def test_distributed_for_each_needs_workers():
+    engine, context = factory()
+    context.orders = get_orders(1)
+    context.rate = 1
+    
+    with pytest.raises(WorkerError):
+        engine.run()
+    
+def test_distributed_for_each_socket_transport():
+    transport = SocketTransport(("localhost",0),workers=1,authkey=b"test")
+    worker_engine, _ = factory()
+    worker = threading.Thread(target=connect_worker,args=(transport.address,worker_engine,b"test"))
+    worker.start()
+    try:
+        engine, context = factory()
+        engine.enable_workers(transport)
+        context.orders = get_orders(5)
+        context.rate = 3
+        engine.run()
+    finally:
+        transport.close()
+        worker.join(5)
+    
+    assert context.total_4 == 12
+    
+def map_factory():
+    engine, context = init_engine({"process":[
+        {"flow":"for each","collection":"orders","var":"o","distributed":True,"steps":[
+            {"flow":"map","collection":"locals.o.lines","var":"l","expression":"locals.l * factor",
+             "result":"scaled"},
+            {"step":"collect"}]}]})
+    
+    @engine.component(reads=["scaled"],writes=["scaled"])
+    def collect(engine,context):
+        context[f"total_{context.locals.o.id}"] = sum(context.pop("scaled"))
+        
+    return engine, context
+    
+def test_distributed_for_each_ships_keys_read_by_nested_map():
+    with LocalTransport(map_factory,processes=2) as transport:
+        engine, context = map_factory()
+        engine.enable_workers(transport)
+        context.orders = [{"id":i,"lines":[i,1]} for i in range(4)]
+        context.factor = 10
+        engine.run()
+    
+    assert [context[f"total_{i}"] for i in range(4)] == [(i + 1) * 10 for i in range(4)]
+    
+def run_distributed(expressions, setup, factory_setup=lambda context: None):
+    process = {"process":[{"flow":"for each","collection":"orders","var":"o","distributed":True,
+                           "steps":[{"expressions":expressions}]}]}
+    def worker_factory():
+        engine, context = init_engine(copy.deepcopy(process))
+        factory_setup(context)
+        return engine, context
+    
+    with LocalTransport(worker_factory,processes=2) as transport:
+        engine, context = init_engine(copy.deepcopy(process))
+        engine.enable_workers(transport)
+        setup(context)
+        engine.run()
+    return context
+    
+def test_distributed_for_each_merges_appends_in_order():
+    def setup(context):
+        context.orders = [1,2,3,4]
+        context.out = [0]
+        context.seen = {}
+        context.tags = set()
+    context = run_distributed(["out.append(locals.o)","seen.update({locals.o:True})",
+                               "tags.add(locals.o % 2)","set('checked',True)"],setup)
+    
+    assert context.out == [0,1,2,3,4]
+    assert context.seen == {1:True,2:True,3:True,4:True}
+    assert context.tags == {0,1}
+    assert context.checked == True
+    
+def test_distributed_for_each_rejects_conflicting_items():
+    def setup(context):
+        context.orders = [1,2,3,4]
+        context.total = 0
+    with pytest.raises(WorkerError):
+        run_distributed(["set('total',total + locals.o)"],setup)
+    
+def test_distributed_for_each_merges_only_item_writes():
+    def setup(context):
+        context.orders = [1,2]
+        context.out = []
+    def factory_setup(context):
+        context.worker_only = True
+        context.out = ["stale"]
+    context = run_distributed(["out.append(locals.o)"],setup,factory_setup)
+    
+    assert context.out == [1,2]
+    assert "worker_only" not in context
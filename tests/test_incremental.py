@@ -0,0 +1,151 @@
+from context_engine import init_engine
+import copy
+import threading
+import pytest
+
+PROCESS = [
+    {"step":"load","args":"orders"},
+    {"flow":"block","steps":[
+        {"expressions":["set('locals.total',sum(orders))"]},
+        {"expressions":["set('report',f'{locals.total} {currency}')"]},
+    ]},
+    {"flow":"for each","collection":"orders","var":"o","steps":[
+        {"expressions":["seen.append(locals.o)"]},
+    ]},
+]
+
+def get_engine(calls, **seed):
+    engine, context = init_engine({"process":copy.deepcopy(PROCESS)})
+    context.currency = "EUR"
+    context.seen = []
+    context.update(seed)
+    
+    @engine.component()
+    def load(engine,context):
+        calls.append(context.args)
+        context.orders = [1,2,3]
+        
+    return engine, context
+
+def test_first_run_records_every_step(tmp_path):
+    calls = []
+    engine, context = get_engine(calls)
+    report = engine.run_incremental(tmp_path / "state")
+    
+    assert [unit.skipped for unit in report] == [False,False,False,False]
+    assert all(unit.reason == "no previous run" for unit in report)
+    assert context.report == "6 EUR"
+    
+def test_rerun_skips_and_restores_outputs(tmp_path):
+    state = tmp_path / "state"
+    get_engine([])[0].run_incremental(state)
+    
+    calls = []
+    engine, context = get_engine(calls)
+    report = engine.run_incremental(state)
+    
+    assert calls == []
+    assert all(unit.skipped for unit in report)
+    assert context.orders == [1,2,3]
+    assert context.report == "6 EUR"
+    assert context.seen == [1,2,3]
+    
+def test_changed_input_reruns_dependents_only(tmp_path):
+    state = tmp_path / "state"
+    get_engine([])[0].run_incremental(state)
+    
+    calls = []
+    engine, context = get_engine(calls,currency="USD")
+    report = engine.run_incremental(state)
+    
+    assert calls == []
+    assert [unit.path for unit in report if not unit.skipped] == ["process[1].steps[1]"]
+    assert report[2].reason == "inputs changed: currency"
+    assert context.report == "6 USD"
+    
+def test_changed_step_document_reruns(tmp_path):
+    state = tmp_path / "state"
+    get_engine([])[0].run_incremental(state)
+    
+    engine, context = get_engine([])
+    engine.steps[0]["args"] = "archive"
+    engine.steps = engine.steps
+    report = engine.run_incremental(state)
+    
+    assert report[0].reason == "step or component changed"
+    assert not report[0].skipped
+    
+def test_incremental_disabled_step_always_runs(tmp_path):
+    state = tmp_path / "state"
+    PROCESS[0]["incremental"] = False
+    try:
+        get_engine([])[0].run_incremental(state)
+        calls = []
+        engine, context = get_engine(calls)
+        report = engine.run_incremental(state)
+    finally:
+        del PROCESS[0]["incremental"]
+    
+    assert calls == ["orders"]
+    assert report[0].reason == "incremental disabled"
+    assert report[1].skipped
+    
+def test_failed_step_is_not_recorded(tmp_path):
+    state = tmp_path / "state"
+    engine, context = get_engine([])
+    
+    @engine.component()
+    def load(engine,context):
+        raise RuntimeError("down")
+    
+    with pytest.raises(RuntimeError):
+        engine.run_incremental(state)
+    
+    calls = []
+    engine, context = get_engine(calls)
+    engine.run_incremental(state)
+    
+    assert calls == ["orders"]
+    assert type(context).__name__ == "Context"
+    
+def test_incremental_run_keeps_profiler(tmp_path):
+    engine, context = get_engine([])
+    profiler = engine.enable_profiler()
+    profiled = engine.__dict__["do_step"]
+    
+    engine.run_incremental(tmp_path / "state")
+    
+    assert engine.__dict__["do_step"] is profiled
+    assert profiler.entries[("step","process[0]")].calls == 1
+    engine.disable_profiler()
+    assert "do_step" not in engine.__dict__
+    
+def test_concurrent_incremental_runs_track_their_own_reads(tmp_path):
+    barrier = threading.Barrier(2,timeout=5)
+    engines = []
+    for key in ("eur","usd"):
+        engine, context = init_engine({"process":[{"expressions":[f"set('report',wait() + {key})"]}]})
+        context[key] = 1
+        
+        @context.expression()
+        def wait(context):
+            # both engines are inside a unit at the same time
+            barrier.wait()
+            return 0
+        
+        engines.append((key,engine,context))
+    
+    threads = [threading.Thread(target=engine.run_incremental,args=(tmp_path / key,))
+               for key, engine, _ in engines]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    
+    barrier = threading.Barrier(1)
+    for key, engine, context in engines:
+        assert type(context).__name__ == "Context"
+        context[key] = 5
+        report = engine.run_incremental(tmp_path / key)
+        assert report[0].reason == f"inputs changed: {key}"
+        assert context.report == 5
@@ -0,0 +1,61 @@
+from context_engine import init_engine
+from context_engine.paths import compile_path, PathError
+import pytest
+
+def get_data():
+    return {
+        "project":{"dirs":[{"name":"a"},{"name":"b"},{"name":"c"},{"name":"d"}]},
+        "items":[{"id":1,"tags":["x"]},{"id":2,"tags":["y","z"]}],
+    }
+
+def test_compile_path_is_cached():
+    assert compile_path("project.dirs[3].name") is compile_path("project.dirs[3].name")
+    
+def test_path_get_index():
+    data = get_data()
+    
+    assert compile_path("project.dirs[3].name").get(data) == "d"
+    assert compile_path("project.dirs[-1].name").get(data) == "d"
+    
+def test_path_get_wildcard():
+    data = get_data()
+    
+    assert compile_path("items[*].id").get(data) == [1,2]
+    assert compile_path("items[*].tags[*]").get(data) == [["x"],["y","z"]]
+    
+def test_path_set_broadcasts_over_wildcard():
+    data = get_data()
+    compile_path("items[*].done").set(data,True)
+    compile_path("project.dirs[0].name").set(data,"root")
+    
+    assert [item["done"] for item in data["items"]] == [True,True]
+    assert data["project"]["dirs"][0]["name"] == "root"
+    
+def test_path_set_each():
+    data = get_data()
+    compile_path("items[*].id").set_each(data,[10,20])
+    
+    assert compile_path("items[*].id").get(data) == [10,20]
+    with pytest.raises(ValueError):
+        compile_path("items[*].id").set_each(data,[1])
+    
+@pytest.mark.parametrize("path",["","a..b",".a","a.","[0]","a[x]","a[0"])
+def test_compile_path_invalid(path):
+    with pytest.raises(PathError):
+        compile_path(path)
+    
+def test_for_each_collection_and_set_paths():
+    pd = {"process":[{
+        "flow":"for each",
+        "collection":"project.dirs[*].name",
+        "var":"n",
+        "steps":[{"expressions":["out.append(locals.n)","set('project.dirs[0].seen',True)"]}]
+    }]}
+    
+    engine, context = init_engine(pd)
+    context.project = get_data()["project"]
+    context.out = []
+    engine.run()
+    
+    assert context.out == ["a","b","c","d"]
+    assert context.project["dirs"][0]["seen"] == True
@@ -0,0 +1,80 @@
+import json
+import pickle
+
+from context_engine import init_engine
+from context_engine.records import INDEX_STRIDE, RecordFile, open_records
+from context_engine.views import AttrView
+import pytest
+
+def write_jsonl(path, count, blank_every=None):
+    with open(path,"w") as out:
+        for i in range(count):
+            out.write(json.dumps({"id":i,"customer":{"name":f"c{i}"}}) + "\n")
+            if blank_every and i % blank_every == 0:
+                out.write("\n")
+    return path
+
+def test_jsonl_records_random_access(tmp_path):
+    records = open_records(write_jsonl(tmp_path / "orders.jsonl",INDEX_STRIDE * 3 + 5,blank_every=7))
+    
+    assert records.format == "jsonl"
+    assert len(records) == INDEX_STRIDE * 3 + 5
+    assert isinstance(records[0],AttrView)
+    assert records[0].customer.name == "c0"
+    assert records[INDEX_STRIDE + 1].id == INDEX_STRIDE + 1
+    assert records[-1].id == INDEX_STRIDE * 3 + 4
+    assert [record.id for record in records[10:13]] == [10,11,12]
+    assert [record.id for record in records] == list(range(INDEX_STRIDE * 3 + 5))
+    with pytest.raises(IndexError):
+        records[len(records)]
+    
+def test_csv_records(tmp_path):
+    path = tmp_path / "rates.csv"
+    path.write_text('code,name\r\nEUR,"Euro, EU"\r\n\r\nUSD,Dollar\r\n')
+    records = open_records(path)
+    
+    assert records.format == "csv"
+    assert records.fieldnames == ["code","name"]
+    assert len(records) == 2
+    assert records[0].name == "Euro, EU"
+    assert [record.code for record in records] == ["EUR","USD"]
+    
+    path = tmp_path / "rates.tsv"
+    path.write_text("EUR\tEuro\n")
+    records = RecordFile(path,delimiter="\t",fieldnames=["code","name"])
+    assert list(records) == [{"code":"EUR","name":"Euro"}]
+    
+    path = tmp_path / "codes.tsv"
+    path.write_text("code\tname\nEUR\tEuro, EU\n")
+    records = open_records(path)
+    assert records.fieldnames == ["code","name"]
+    assert list(records) == [{"code":"EUR","name":"Euro, EU"}]
+    
+def test_empty_record_file(tmp_path):
+    path = tmp_path / "empty.jsonl"
+    path.write_text("")
+    
+    assert len(open_records(path)) == 0
+    assert list(open_records(path)) == []
+    
+def test_record_file_pickles_by_path(tmp_path):
+    path = write_jsonl(tmp_path / "orders.jsonl",3)
+    records = open_records(path)
+    data = pickle.dumps(records)
+    
+    assert [record.id for record in pickle.loads(data)] == [0,1,2]
+    write_jsonl(path,4)
+    assert pickle.dumps(records) != data
+    
+def test_for_each_over_record_file(tmp_path):
+    write_jsonl(tmp_path / "orders.jsonl",100)
+    process = {"process":[
+        {"expressions":["set('orders',open_jsonl(path))","set('names',[])"]},
+        {"flow":"for each","collection":"orders","var":"o",
+         "steps":[{"expressions":["names.append(locals.o.customer.name)"]}]},
+    ]}
+    engine, context = init_engine(process)
+    context.path = str(tmp_path / "orders.jsonl")
+    engine.run()
+    
+    assert context.names == [f"c{i}" for i in range(100)]
@@ -0,0 +1,198 @@
+from context_engine import init_engine
+from context_engine.replay import ReplayError, call_key, load_trace
+import copy
+import os
+import pytest
+import subprocess
+import sys
+import time
+
+PROCESS = [
+    {"step":"fetch","args":"orders"},
+    {"step":"fetch","args":"rates"},
+    {"expressions":["set('total',price(sum(orders)))"]},
+    {"flow":"for each","collection":"orders","var":"o","steps":[
+        {"expressions":["seen.append(locals.o)"]},
+    ]},
+]
+
+def get_engine(calls, process=PROCESS):
+    engine, context = init_engine({"process":copy.deepcopy(process)})
+    context.seen = []
+
+    @engine.component()
+    def fetch(engine,context):
+        calls.append(context.args)
+        context[context.args] = [1,2,3] if context.args == "orders" else {"EUR":2}
+
+    @context.expression()
+    def price(context,value):
+        calls.append("price")
+        return value * context.rates["EUR"]
+
+    return engine, context
+
+def test_record_writes_a_call_per_invocation(tmp_path):
+    trace = tmp_path / "run.trace"
+    calls = []
+    engine, context = get_engine(calls)
+    recorder = engine.run_recorded(trace)
+
+    assert calls == ["orders","rates","price"]
+    assert recorder.calls == 3
+    recorded = list(load_trace(trace))
+    assert [(call.kind,call.name) for call in recorded] == [
+        ("component","fetch"),("component","fetch"),("expression","price")]
+    assert all(call.duration >= 0 and not call.live for call in recorded)
+
+def test_replay_substitutes_recorded_calls(tmp_path):
+    trace = tmp_path / "run.trace"
+    get_engine([])[0].run_recorded(trace)
+
+    calls = []
+    engine, context = get_engine(calls)
+    report = engine.run_replay(trace)
+
+    assert calls == []
+    assert context.orders == [1,2,3]
+    assert context.rates == {"EUR":2}
+    assert context.total == 12
+    assert context.seen == [1,2,3]
+    assert report.replayed == 3
+    assert report.recorded_time > 0
+    assert report.engine_time <= report.wall_time
+
+def test_replay_fails_on_calls_not_recorded(tmp_path):
+    trace = tmp_path / "run.trace"
+    get_engine([])[0].run_recorded(trace)
+
+    process = copy.deepcopy(PROCESS)
+    process[1]["args"] = "fees"
+    engine, context = get_engine([],process)
+    with pytest.raises(ReplayError):
+        engine.run_replay(trace)
+    assert "invoke" not in engine.step_functions["fetch"].__dict__
+
+def test_replay_reraises_recorded_errors(tmp_path):
+    trace = tmp_path / "run.trace"
+    engine, context = get_engine([])
+
+    @engine.component()
+    def fetch(engine,context):
+        raise KeyError(context.args)
+
+    with pytest.raises(KeyError):
+        engine.run_recorded(trace)
+
+    calls = []
+    engine, context = get_engine(calls)
+    with pytest.raises(KeyError):
+        engine.run_replay(trace)
+    assert calls == []
+
+def test_replay_counts_changed_inputs(tmp_path):
+    trace = tmp_path / "run.trace"
+    get_engine([])[0].run_recorded(trace)
+
+    engine, context = get_engine([],PROCESS[:2] + [
+        {"expressions":["set('rates',{'EUR':3})"]},
+        PROCESS[2]])
+    # the recorded price read rates={'EUR':2}, the value is replayed regardless
+    report = engine.run_replay(trace,check_inputs=True)
+
+    assert context.total == 12
+    assert report.input_mismatches == 1
+
+def test_recording_does_not_serialize_parallel_calls(tmp_path):
+    trace = tmp_path / "run.trace"
+    process = [{"flow":"parallel for each","collection":"ids","var":"i","max_workers":8,
+                "results":"done","steps":[{"step":"slow","args":"ids"}]}]
+
+    def get_parallel_engine(calls):
+        engine, context = init_engine({"process":copy.deepcopy(process)})
+        context.ids = list(range(8))
+
+        @engine.component()
+        def slow(engine,context):
+            calls.append(context.locals.i)
+            time.sleep(0.1)
+            context.locals.square = context.locals.i ** 2
+
+        return engine, context
+
+    engine, context = get_parallel_engine([])
+    start = time.perf_counter()
+    recorder = engine.run_recorded(trace)
+    elapsed = time.perf_counter() - start
+
+    assert recorder.calls == 8
+    assert elapsed < 0.5
+    assert type(context).__name__ == "Context"
+
+    calls = []
+    engine, context = get_parallel_engine(calls)
+    # calls with the same args are told apart by the loop variable they read
+    context.ids.reverse()
+    report = engine.run_replay(trace)
+    assert calls == []
+    assert report.replayed == 8
+    assert [item["square"] for item in context.done] == [i ** 2 for i in reversed(range(8))]
+
+def test_hooks_keep_earlier_invoke_overrides(tmp_path):
+    calls = []
+    engine, context = get_engine(calls)
+    component = engine.step_functions["fetch"]
+    invoke = component.invoke
+    seen = []
+
+    def traced_invoke(engine,*args,**kwargs):
+        seen.append(engine.context.args)
+        return invoke(engine,*args,**kwargs)
+
+    component.invoke = traced_invoke
+    engine.run_recorded(tmp_path / "run.trace")
+
+    assert seen == ["orders","rates"]
+    assert component.invoke is traced_invoke
+
+TRACE_SCRIPT = """
+import sys
+from context_engine import init_engine
+
+calls = []
+engine, context = init_engine({"process":[{"expressions":[
+    "set('found',lookup({'eur','usd','gbp','chf','jpy'},codes))"]}]})
+context.codes = {"eur","jpy","sek","nok","dkk"}
+
+@context.expression()
+def lookup(context,wanted,codes):
+    calls.append(1)
+    return sorted(wanted & codes)
+
+if sys.argv[1] == "record":
+    engine.run_recorded(sys.argv[2])
+else:
+    report = engine.run_replay(sys.argv[2],check_inputs=True)
+    assert calls == [] and report.input_mismatches == 0, (calls,report.summary())
+print(context.found)
+"""
+
+def test_replay_in_another_process(tmp_path):
+    trace = str(tmp_path / "run.trace")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    outputs = []
+    for seed, mode in (("1","record"),("2","replay"),("3","replay")):
+        env = dict(os.environ,PYTHONHASHSEED=seed,
+                   PYTHONPATH=os.pathsep.join(filter(None,(root,os.environ.get("PYTHONPATH")))))
+        done = subprocess.run([sys.executable,"-c",TRACE_SCRIPT,mode,trace],env=env,
+                              capture_output=True,text=True,timeout=60)
+        assert done.returncode == 0, done.stderr
+        outputs.append(done.stdout)
+
+    assert outputs == ["['eur', 'jpy']\n"] * 3
+
+def test_call_keys_are_canonical():
+    assert call_key(None,({"b","a","c"},),{"x":frozenset((3,1))}) == call_key(None,({"c","a","b"},),{"x":frozenset((1,3))})
+    # unpicklable arguments are keyed by their repr without the address
+    assert call_key(None,(lambda: 1,),{}) == call_key(None,(lambda: 1,),{})
+    assert call_key("a",(),{}) != call_key("b",(),{})
@@ -0,0 +1,93 @@
+import io
+from multiprocessing import Pipe
+
+from ctx import Ctx
+from context_engine import init_engine
+from context_engine.snapshot import OUT_OF_BAND_MIN, Snapshot, SnapshotError, pack, restore, snapshot
+import pytest
+
+def get_context():
+    engine, context = init_engine()
+    
+    @context.expression()
+    def double(context,value):
+        return value * 2
+    
+    context.config = Ctx(db=Ctx(host="localhost",ports=[1,Ctx(admin=2)]))
+    context.blob = b"b" * OUT_OF_BAND_MIN
+    context.buffer = bytearray(b"a" * OUT_OF_BAND_MIN)
+    context.small = b"small"
+    context.rows = [{"id":i} for i in range(10)]
+    return context
+
+def test_snapshot_round_trips_ctx_nesting():
+    context = get_context()
+    data = snapshot(context).load()
+    
+    assert type(data) is Ctx
+    assert type(data.config.db) is Ctx
+    assert type(data.config.db.ports[1]) is Ctx
+    assert data.config.db.ports[1].admin == 2
+    assert data.rows == context.rows
+    assert "double" not in data
+    assert not [key for key in data if key.startswith("_Context__")]
+    
+def test_snapshot_large_binary_values_out_of_band():
+    context = get_context()
+    packed = snapshot(context)
+    
+    assert len(packed.buffers) == 2
+    assert len(packed.stream) < OUT_OF_BAND_MIN
+    data = packed.load()
+    assert type(data.blob) is bytes and data.blob == context.blob
+    assert type(data.buffer) is bytearray and data.buffer == context.buffer
+    assert data.small == b"small"
+    
+def test_snapshot_selected_keys():
+    context = get_context()
+    data = snapshot(context,["rows","small","missing","double"]).load()
+    
+    assert sorted(data) == ["rows","small"]
+    
+def test_snapshot_file_bytes_and_connection():
+    context = get_context()
+    packed = snapshot(context)
+    
+    out = io.BytesIO()
+    packed.write(out)
+    assert out.getvalue() == packed.to_bytes()
+    out.seek(0)
+    assert Snapshot.read(out).digest() == packed.digest()
+    assert Snapshot.from_bytes(packed.to_bytes()).load() == packed.load()
+    
+    sender, receiver = Pipe()
+    packed.send(sender)
+    received = Snapshot.recv(receiver)
+    assert received.load() == packed.load()
+    assert not received.buffers[1].readonly
+    
+def test_restore_into_context():
+    engine, context = init_engine()
+    context.kept = 1
+    restore(context,snapshot(get_context(),["config"]).to_bytes())
+    
+    assert context.kept == 1
+    assert context.config.db.host == "localhost"
+    
+def test_pack_value():
+    value = b"x" * OUT_OF_BAND_MIN
+    packed = pack(value)
+    
+    assert len(packed.buffers) == 1
+    assert packed.load() == value
+    assert pack([1,Ctx(a=1)]).load() == [1,{"a":1}]
+    
+def test_snapshot_errors():
+    packed = snapshot(get_context()).to_bytes()
+    
+    with pytest.raises(SnapshotError):
+        Snapshot.from_bytes(b"nope" + packed[4:])
+    with pytest.raises(SnapshotError):
+        Snapshot.from_bytes(packed[:-1])
+    with pytest.raises(SnapshotError):
+        Snapshot.read(io.BytesIO(packed[:100]))
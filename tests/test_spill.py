@@ -0,0 +1,88 @@
+import os
+import pickle
+
+from context_engine import init_engine
+from context_engine.spill import SPILL_BATCH, SpillList, SpillStore
+import pytest
+
+def get_records(count):
+    return [{"id":i,"name":f"record {i}"} for i in range(count)]
+
+def test_spill_list_spills_oldest_items(tmp_path):
+    store = SpillStore(memory_limit=2_000,directory=tmp_path)
+    records = store.new_list(get_records(500))
+    
+    assert len(records) == 500
+    assert records.spilled > 0
+    assert store.memory <= 2_000
+    assert os.listdir(tmp_path)
+    assert records[0] == {"id":0,"name":"record 0"}
+    assert records[-1]["id"] == 499
+    assert records[10:13] == get_records(13)[10:]
+    assert list(records) == get_records(500)
+    assert records == get_records(500)
+    with pytest.raises(IndexError):
+        records[500]
+    
+def test_spill_list_set_item_and_clear(tmp_path):
+    store = SpillStore(memory_limit=1_000,directory=tmp_path)
+    records = SpillList(get_records(100),store)
+    records[0] = {"id":0,"name":"changed"}
+    records[-1] = {"id":99,"name":"changed"}
+    
+    assert records[0]["name"] == "changed"
+    assert records[99]["name"] == "changed"
+    records.clear()
+    assert len(records) == 0
+    assert store.memory == 0
+    records.append(1)
+    assert list(records) == [1]
+    
+def test_spill_list_bounded_spill_per_append(tmp_path):
+    store = SpillStore(memory_limit=10**9,directory=tmp_path)
+    records = store.new_list(range(SPILL_BATCH * 3))
+    store.memory_limit = 0
+    
+    records.append(0)
+    assert records.spilled == SPILL_BATCH
+    
+def test_spill_list_close_releases_memory_and_file(tmp_path):
+    store = SpillStore(memory_limit=500,directory=tmp_path)
+    records = store.new_list(range(1_000))
+    other = store.new_list(range(10))
+    records.close()
+    
+    assert len(records) == 0
+    assert len(os.listdir(tmp_path)) == 1
+    del other
+    assert store.memory == 0
+    assert not os.listdir(tmp_path)
+    
+def test_spill_list_pickles_as_spill_list():
+    records = SpillList(range(10))
+    copy = pickle.loads(pickle.dumps(records))
+    
+    assert type(copy) is SpillList
+    assert copy == list(range(10))
+    
+def test_new_spill_list_expression_and_for_each(tmp_path):
+    process = {"process":[
+        {"expressions":["new_spill_list('records')"]},
+        {"flow":"for each","collection":"source","var":"r",
+         "steps":[{"expressions":["records.append(locals.r)"]}]},
+        {"expressions":["set('total',0)"]},
+        {"flow":"for each","collection":"records","var":"r",
+         "steps":[{"expressions":["set('total',total + locals.r.id)"]}]},
+    ]}
+    engine, context = init_engine(process)
+    store = engine.enable_spill(2_000,tmp_path)
+    context.source = get_records(300)
+    engine.run()
+    
+    assert type(context.records) is SpillList
+    assert context.records.store is store
+    assert context.records.spilled > 0
+    assert context.total == sum(range(300))
+    
+    spawned, spawned_context = engine.spawn()
+    assert spawned_context.spill_store is store